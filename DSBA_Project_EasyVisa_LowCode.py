@@ -87,7 +87,7 @@ from sklearn.ensemble import (
     StackingClassifier,
 )
 
-get_ipython().system('pip install xgboost')
+# xgboost is installed with the project dependencies (pip install -e .)
 from xgboost import XGBClassifier
 from sklearn.tree import DecisionTreeClassifier
 
@@ -1286,7 +1286,7 @@ xgb_classifier_model_test_perf
 # In[126]:
 
 
-get_ipython().system('pip install xgboost')
+# xgboost is installed with the project dependencies (pip install -e .)
 
 
 # In[125]:
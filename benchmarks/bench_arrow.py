@@ -0,0 +1,74 @@
+"""
+csv -> FeatureStore -> scores through pandas vs through Arrow: seconds,
+resident memory growth and the bytes the Arrow path viewed and copied
+
+usage: python benchmarks/bench_arrow.py path/to/model.joblib
+    [--data path/to/EasyVisa.csv] [--rows N]
+
+Without --data, --rows synthetic applications are written to a temporary
+csv first.
+"""
+
+import argparse
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from easyvisa import FeatureStore, Scorer, clean, load_visa
+from easyvisa.arrow import read_applications, score_ipc, to_store, write_ipc
+from easyvisa.profiling import PROFILER
+from easyvisa.resources import peak_memory
+from easyvisa.synthetic import write_csv
+
+
+def run(step):
+    with peak_memory() as peak:
+        start = time.perf_counter()
+        result = step()
+        seconds = time.perf_counter() - start
+    return result, {"seconds": seconds, "rss_growth_MiB": peak["bytes"] / 2**20}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model")
+    parser.add_argument("--data")
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args(argv)
+
+    path = args.data
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "synthetic.csv")
+        write_csv(path, args.rows)
+    scorer = Scorer.load(args.model)
+    PROFILER.enable()
+
+    report = {}
+    pandas_store, report["pandas: csv -> store"] = run(
+        lambda: FeatureStore.from_frame(clean(load_visa(path)))
+    )
+    table, report["arrow: csv -> table"] = run(lambda: read_applications(path))
+    PROFILER.counters.clear()
+    arrow_store, report["arrow: table -> store"] = run(lambda: to_store(table))
+    counters = dict(PROFILER.counters)
+    assert np.array_equal(pandas_store.buffer, arrow_store.buffer)
+
+    stream = io.BytesIO()
+    write_ipc(table, stream)
+    frame = load_visa(path)
+    _, report["pandas: frame -> scores"] = run(lambda: scorer.score_frame(frame))
+    _, report["arrow: IPC -> IPC scores"] = run(
+        lambda: score_ipc(scorer, stream.getvalue(), io.BytesIO())
+    )
+
+    print("rows:", table.num_rows)
+    print(pd.DataFrame(report).T.round(3))
+    print("table -> store:", counters)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Throughput of the multi-process batch scorer against the number of processes
+
+The applications of the csv, or synthetic applications without --data, are
+repeated up to --rows rows and scored with 1, 2, 4, ... processes up to the
+CPU count; the efficiency column is the speedup over one process divided by
+the number of processes.
+
+usage: python benchmarks/bench_batch.py path/to/model.joblib
+    [--data path/to/EasyVisa.csv] [--rows N]
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from easyvisa import FeatureStore, Scorer, clean, load_visa
+from easyvisa.batch import score_parallel
+from easyvisa.synthetic import synthetic_visa
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model")
+    parser.add_argument("--data")
+    parser.add_argument("--rows", type=int, default=1000000)
+    args = parser.parse_args(argv)
+
+    data = load_visa(args.data) if args.data else synthetic_visa(args.rows)
+    store = FeatureStore.from_frame(clean(data))
+    store = FeatureStore.concat([store] * -(-args.rows // len(store)))
+    scorer = Scorer.load(args.model)
+    expected = None
+    processes, report = 1, {}
+    while True:
+        start = time.perf_counter()
+        proba = score_parallel(scorer, store, processes)
+        elapsed = time.perf_counter() - start
+        if expected is None:
+            expected = proba
+        assert np.allclose(proba, expected)
+        report[processes] = {
+            "seconds": elapsed,
+            "rows_per_second": len(store) / elapsed,
+        }
+        if processes >= os.cpu_count():
+            break
+        processes = min(2 * processes, os.cpu_count())
+
+    report = pd.DataFrame(report).T.rename_axis("processes")
+    speedup = report["rows_per_second"] / report["rows_per_second"].iloc[0]
+    report["efficiency"] = speedup / report.index
+    print("rows:", len(store), "cpus:", os.cpu_count())
+    print(report.round(3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+One-hot design matrix vs out-of-fold target encoding: width, fit and
+predict time and test F1 of every model with its default parameters
+
+usage: python benchmarks/bench_encoding.py [--data path/to/EasyVisa.csv]
+    [--rows N] [model ...]
+
+Without --data, --rows synthetic applications are used.
+"""
+
+import argparse
+import time
+
+import pandas as pd
+from sklearn.metrics import f1_score
+
+from easyvisa import FeatureStore, Splitter, clean, load_visa
+from easyvisa.encoding import TargetEncoder
+from easyvisa.models import MODELS
+from easyvisa.synthetic import synthetic_visa
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("models", nargs="*", default=list(MODELS))
+    parser.add_argument("--data")
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    data = clean(load_visa(args.data) if args.data else synthetic_visa(args.rows))
+    store = FeatureStore.from_frame(data)
+    holdout = Splitter(store).holdout()
+    y_train, y_test = store.target[holdout.train], store.target[holdout.test]
+
+    start = time.perf_counter()
+    encoder = TargetEncoder()
+    matrices = {
+        "onehot": (
+            store.design_matrix()[holdout.train],
+            store.design_matrix()[holdout.test],
+        ),
+        "target": (
+            encoder.fit_transform(data, store, holdout.train),
+            encoder.transform(data, store)[holdout.test],
+        ),
+    }
+    print("target encoding: {:.3f}s".format(time.perf_counter() - start))
+
+    report = {}
+    for name in args.models:
+        for encoding, (X_train, X_test) in matrices.items():
+            model = MODELS[name].build()
+            start = time.perf_counter()
+            model.fit(X_train, y_train)
+            fitted = time.perf_counter()
+            pred = model.predict(X_test)
+            report[name, encoding] = {
+                "columns": X_train.shape[1],
+                "fit_s": fitted - start,
+                "predict_s": time.perf_counter() - fitted,
+                "F1": f1_score(y_test, pred),
+            }
+    report = pd.DataFrame(report).T.rename_axis(["model", "encoding"])
+    print(report.round(4).to_string())
+
+
+if __name__ == "__main__":
+    main()
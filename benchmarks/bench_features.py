@@ -0,0 +1,45 @@
+"""
+Memory footprint of the feature matrix: notebook dummies vs FeatureStore
+
+usage: python benchmarks/bench_features.py [path/to/EasyVisa.csv]
+
+Without a csv, one million synthetic applications are used.
+"""
+
+import sys
+import time
+
+import pandas as pd
+
+from easyvisa import FeatureStore, clean, load_visa
+from easyvisa.schema import TARGET
+from easyvisa.synthetic import synthetic_visa
+
+
+def main(path=None):
+    data = clean(load_visa(path) if path else synthetic_visa(1000000))
+    n_rows = len(data)
+    scale = 1e6 / n_rows
+
+    start = time.perf_counter()
+    X = pd.get_dummies(data.drop([TARGET], axis=1), drop_first=True)
+    dummies_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    store = FeatureStore.from_frame(data)
+    store.design_matrix()
+    store_time = time.perf_counter() - start
+
+    report = store.memory_report()
+    report["get_dummies frame"] = X.memory_usage(deep=True).sum() * scale
+    print("rows:", n_rows)
+    print(
+        "get_dummies: {:.3f}s, FeatureStore + design matrix: {:.3f}s".format(
+            dummies_time, store_time
+        )
+    )
+    print((report / 2**20).round(2).rename("MiB per million rows"))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,76 @@
+"""
+Cold start of the CLI and of a scoring process
+
+Reports the slowest imports of `import easyvisa.cli` from
+python -X importtime, the wall time of `python -m easyvisa --help` and the
+time until a fresh process has loaded a model artifact and is ready to
+score (target: under 200 ms).
+
+usage: python benchmarks/bench_startup.py [path/to/model.joblib]
+"""
+
+import subprocess
+import sys
+import time
+
+READY = "from easyvisa.scoring import Scorer; Scorer.load({!r})"
+
+
+def wall_time(command, repeat=5):
+    """
+    Best wall time of a command over several runs, in seconds
+
+    command: argument list
+    repeat: number of runs
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, capture_output=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def import_times(module, top=10):
+    """
+    Slowest imports of a module by cumulative time, in milliseconds
+
+    module: module to import
+    top: number of imports to return
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times.append((int(cumulative) / 1000, name.strip()))
+    return sorted(times, reverse=True)[:top]
+
+
+def main(model=None):
+    print("slowest imports of easyvisa.cli (cumulative ms):")
+    for ms, name in import_times("easyvisa.cli"):
+        print("  {:8.1f}  {}".format(ms, name))
+    print(
+        "python -c pass:          {:.0f} ms".format(
+            1000 * wall_time([sys.executable, "-c", "pass"])
+        )
+    )
+    print(
+        "python -m easyvisa --help: {:.0f} ms".format(
+            1000 * wall_time([sys.executable, "-m", "easyvisa", "--help"])
+        )
+    )
+    if model:
+        ready = wall_time([sys.executable, "-c", READY.format(model)])
+        print("ready to score:          {:.0f} ms (target 200 ms)".format(1000 * ready))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
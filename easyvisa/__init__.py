@@ -0,0 +1,25 @@
+"""
+EasyVisa visa certification pipeline
+
+The public names below are imported on first access, so importing the
+package does not load numpy, pandas or any model library.
+"""
+
+import importlib
+
+_EXPORTS = {
+    "FeatureStore": "features",
+    "Scorer": "scoring",
+    "Split": "split",
+    "Splitter": "split",
+    "clean": "data",
+    "load_visa": "data",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name in _EXPORTS:
+        return getattr(importlib.import_module("." + _EXPORTS[name], __name__), name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
@@ -0,0 +1,278 @@
+"""
+Apache Arrow interchange of applications and scores, with zero-copy
+conversion to numpy where the types allow
+
+Applications travel as record batches whose categorical and Y/N columns
+are dictionary-encoded: to_store() reads their indices and numeric
+columns as numpy views of the Arrow buffers and writes them once into a
+FeatureStore, the only copy between the csv or IPC stream and the design
+matrix. Scores leave as record batches wrapping the probability array.
+Every conversion adds the bytes it viewed or copied to the profiler
+counters arrow_zero_copy_bytes and arrow_copied_bytes, and counts its
+copies in arrow_copies.
+"""
+
+import numpy as np
+
+from .profiling import count, stage, timed
+from .schema import CATEGORIES, FEATURES, FLAGS, ID_COLUMN, NUMERIC, POSITIVE_CLASS
+from .schema import TARGET
+
+PREDICTIONS = ["Denied", POSITIVE_CLASS]
+
+
+def _string_dictionary():
+    import pyarrow as pa
+
+    return pa.dictionary(pa.int32(), pa.string())
+
+
+def schema():
+    """
+    Arrow schema of the raw applications, as read by read_applications:
+    dictionary-encoded categories, Y/N flags and case status, and the
+    numeric columns in their FeatureStore types
+    """
+    import pyarrow as pa
+
+    fields = [(ID_COLUMN, pa.string())]
+    for column in FEATURES:
+        if column in NUMERIC:
+            fields.append((column, pa.from_numpy_dtype(np.dtype(NUMERIC[column]))))
+        else:
+            fields.append((column, _string_dictionary()))
+    fields.append((TARGET, _string_dictionary()))
+    return pa.schema(fields)
+
+
+def _copied(nbytes):
+    count("arrow_copies")
+    count("arrow_copied_bytes", nbytes)
+
+
+def _numpy(array):
+    """
+    numpy view of an Arrow array, or a copy when its type or nulls do not
+    allow a view
+    """
+    import pyarrow as pa
+
+    try:
+        values = array.to_numpy(zero_copy_only=True)
+        count("arrow_zero_copy_bytes", values.nbytes)
+    except pa.ArrowInvalid:
+        values = array.to_numpy(zero_copy_only=False)
+        _copied(values.nbytes)
+    return values
+
+
+def _typed(array, dtype):
+    """
+    Arrow array cast to a numpy dtype, cast (and counted) only if needed
+    """
+    import pyarrow as pa
+
+    arrow_type = pa.from_numpy_dtype(np.dtype(dtype))
+    if array.type != arrow_type:
+        array = array.cast(arrow_type)
+        _copied(array.nbytes)
+    return array
+
+
+def _encoded(array):
+    """
+    Dictionary-encoded Arrow array, encoding (and counting) plain strings
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if not pa.types.is_dictionary(array.type):
+        array = pc.dictionary_encode(array)
+        _copied(array.indices.nbytes)
+    return array
+
+
+def _codes(array, lookup, missing, out):
+    """
+    Write the codes of the values of a dictionary-encoded array into out,
+    mapped through the codes of its dictionary without an intermediate
+    array; null values get the missing code
+    """
+    table = np.array(
+        [lookup(value) for value in array.dictionary.to_pylist()] + [missing],
+        dtype=np.uint8,
+    )
+    indices = array.indices
+    if array.null_count:
+        indices = indices.fill_null(len(table) - 1)
+        _copied(indices.nbytes)
+    # mode="clip" (the indices are in range) lets np.take write straight
+    # into out, which mode="raise" would buffer
+    np.take(table, _numpy(indices), out=out, mode="clip")
+
+
+def _fill(store, batch, start):
+    """
+    Encode the rows of a record batch into rows start: of a store
+    """
+    from .features import MISSING_CODE
+
+    stop = start + batch.num_rows
+    names = batch.schema.names
+    for column in FEATURES:
+        array = batch.column(names.index(column))
+        target = store.column(column)[start:stop]
+        if column in NUMERIC:
+            values = _numpy(_typed(array, NUMERIC[column]))
+            if column == "no_of_employees":
+                # taking the absolute values for number of employees
+                np.abs(values, out=target)
+            else:
+                target[:] = values
+        elif column in FLAGS:
+            _codes(_encoded(array), lambda value: value == "Y", 0, target)
+        else:
+            levels = {level: code for code, level in enumerate(CATEGORIES[column])}
+            _codes(
+                _encoded(array),
+                lambda value: levels.get(value, MISSING_CODE),
+                MISSING_CODE,
+                target,
+            )
+    if store.target is not None:
+        array = _encoded(batch.column(names.index(TARGET)))
+        _codes(
+            array, lambda value: value == POSITIVE_CLASS, 0, store.target[start:stop]
+        )
+
+
+def to_store(data):
+    """
+    FeatureStore of raw applications held in Arrow, cleaned as by
+    data.clean, with a target if the case status is present
+
+    data: pyarrow RecordBatch or Table with the columns of schema();
+        plain string columns are accepted and dictionary-encoded first
+    """
+    from .features import FeatureStore
+
+    batches = data.to_batches() if hasattr(data, "to_batches") else [data]
+    store = FeatureStore.empty(data.num_rows, with_target=TARGET in data.schema.names)
+    with stage("encode", rows=data.num_rows):
+        start = 0
+        for batch in batches:
+            _fill(store, batch, start)
+            start += batch.num_rows
+    return store
+
+
+@timed("load", rows=lambda table: table.num_rows)
+def read_applications(path, block_size=1 << 24):
+    """
+    Arrow Table of a csv of applications, read by pyarrow's multithreaded
+    reader straight into the types of schema()
+
+    path: csv file
+    block_size: bytes of csv per record batch
+    """
+    import pyarrow.csv as csv
+
+    types = {field.name: field.type for field in schema()}
+    return csv.read_csv(
+        path,
+        read_options=csv.ReadOptions(block_size=block_size),
+        convert_options=csv.ConvertOptions(column_types=types),
+    )
+
+
+def scores(proba, threshold=0.5, case_ids=None):
+    """
+    Record batch of case_id (if given), probability and prediction, the
+    probabilities wrapped without a copy and the predictions
+    dictionary-encoded
+
+    proba: float64 array of probabilities of certification
+    threshold: probability above which a case is predicted Certified
+    case_ids: Arrow or numpy array of the case ids
+    """
+    import pyarrow as pa
+
+    proba = np.ascontiguousarray(proba, dtype=np.float64)
+    count("arrow_zero_copy_bytes", proba.nbytes)
+    predictions = pa.DictionaryArray.from_arrays(
+        pa.array((proba > threshold).view(np.int8)), pa.array(PREDICTIONS)
+    )
+    columns = {"probability": pa.array(proba), "prediction": predictions}
+    if case_ids is not None:
+        if not isinstance(case_ids, (pa.Array, pa.ChunkedArray)):
+            case_ids = pa.array(np.asarray(case_ids).astype(str))
+        if isinstance(case_ids, pa.ChunkedArray):
+            if case_ids.num_chunks > 1:
+                _copied(case_ids.nbytes)
+            case_ids = case_ids.combine_chunks()
+        columns = dict(case_id=case_ids, **columns)
+    return pa.RecordBatch.from_pydict(columns)
+
+
+def score_arrow(scorer, data):
+    """
+    Score a record batch or table of raw applications and return the
+    record batch of scores (see scores)
+
+    scorer: scoring.Scorer
+    data: pyarrow RecordBatch or Table with the columns of schema()
+    """
+    case_ids = None
+    if ID_COLUMN in data.schema.names:
+        case_ids = data.column(ID_COLUMN)
+    if scorer.encoder is not None:
+        # the sparse and target encoders work on dataframes
+        frame = data.to_pandas()
+        _copied(int(frame.memory_usage(deep=True).sum()))
+        proba = scorer.score_frame(frame)["probability"].to_numpy()
+    else:
+        proba = scorer.predict_proba(to_store(data))
+    return scores(proba, scorer.threshold, case_ids)
+
+
+def score_ipc(scorer, source, sink):
+    """
+    Score every record batch of an Arrow IPC stream of applications and
+    write the scores as an IPC stream; returns the number of rows scored
+
+    scorer: scoring.Scorer
+    source: path (memory-mapped), bytes or readable file of the stream
+    sink: path or writable binary file of the output stream
+    """
+    import pyarrow as pa
+
+    if isinstance(source, str):
+        source = pa.memory_map(source)
+    writer = None
+    n_rows = 0
+    try:
+        with pa.ipc.open_stream(source) as reader:
+            for batch in reader:
+                scored = score_arrow(scorer, batch)
+                if writer is None:
+                    writer = pa.ipc.new_stream(sink, scored.schema)
+                writer.write_batch(scored)
+                n_rows += batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return n_rows
+
+
+def write_ipc(table, sink, batch_rows=65536):
+    """
+    Write a table of applications as an Arrow IPC stream
+
+    table: pyarrow Table, for example from read_applications
+    sink: path or writable binary file
+    batch_rows: rows per record batch
+    """
+    import pyarrow as pa
+
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=batch_rows)
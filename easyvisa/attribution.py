@@ -0,0 +1,404 @@
+"""
+Permutation importance and exact TreeSHAP contributions of the tree models
+"""
+
+import functools
+
+import numpy as np
+
+from .profiling import stage
+from .schema import FEATURES, dummy_sources
+
+# largest number of (row, node, quadrature point) cells processed at once
+CHUNK_CELLS = 1 << 21
+
+
+def permutation_importance(
+    model, X, y, n_repeats=5, random_state=1, n_jobs=-1, columns=None, scoring=None
+):
+    """
+    Drop in score when a column (or a group of columns) is shuffled
+
+    Predictions on the unshuffled data are computed once and shared by all
+    repeats; after a shuffle only the rows whose value actually changed are
+    predicted again, which for the one-hot and Y/N columns is a fraction
+    of the data. Columns are evaluated in parallel threads sharing the
+    model and X.
+
+    model: fitted classifier
+    X: design matrix
+    y: target
+    n_repeats: number of shuffles per column
+    random_state: seed of the shuffles
+    n_jobs: number of threads
+    columns: list of column indices or of index arrays permuted together,
+        every column on its own by default
+    scoring: callable (y_true, y_pred) -> score, F1 by default
+    """
+    from joblib import Parallel, delayed
+    from sklearn.metrics import f1_score
+
+    scoring = scoring or f1_score
+    X = np.asarray(X)
+    columns = list(range(X.shape[1])) if columns is None else columns
+    baseline = model.predict(X)
+    base_score = scoring(y, baseline)
+    seeds = np.random.SeedSequence(random_state).spawn(len(columns))
+
+    def drop(group, seed):
+        group = np.atleast_1d(group)
+        rng = np.random.default_rng(seed)
+        drops = np.empty(n_repeats)
+        for r in range(n_repeats):
+            shuffled = X[rng.permutation(len(X))[:, None], group]
+            changed = np.flatnonzero((shuffled != X[:, group]).any(axis=1))
+            pred = baseline.copy()
+            if len(changed):
+                rows = X[changed]
+                rows[:, group] = shuffled[changed]
+                pred[changed] = model.predict(rows)
+            drops[r] = base_score - scoring(y, pred)
+        return drops
+
+    with stage("attribution", rows=len(X) * len(columns) * n_repeats):
+        drops = Parallel(n_jobs=n_jobs, prefer="threads")(
+            delayed(drop)(group, seed) for group, seed in zip(columns, seeds)
+        )
+    drops = np.array(drops)
+    return {
+        "importances_mean": drops.mean(axis=1),
+        "importances_std": drops.std(axis=1),
+        "importances": drops,
+    }
+
+
+class _Forest:
+    """
+    Nodes of all the trees of a model flattened level by level
+
+    Every node but the roots stores the split leading to it merged with the
+    earlier splits on the same feature: the interval (lo, hi] of values
+    that reach it and the fraction z of training cover that follows the
+    feature's conditions down to it. The path-dependent Shapley game of a
+    leaf is prod_k (z_k (1 - x) + o_k x), o_k telling whether a row meets
+    the conditions on feature k, and the Shapley value of feature j is the
+    integral over [0, 1] of that product with factor j replaced by
+    o_j - z_j, which Gauss-Legendre quadrature computes exactly. The
+    products telescope along a path, so a node only needs the ratio of its
+    factor to the factor of the previous split on its feature (prev), and
+    the whole forest is evaluated with one pass down and one pass up its
+    levels (Linear TreeSHAP, Yu et al. 2022).
+    """
+
+    def __init__(self, trees, n_features):
+        """
+        trees: list of (sklearn Tree, output of every leaf, column of the
+            design matrix of every feature of the tree or None)
+        n_features: number of columns of the design matrix
+        """
+        fields = ["level", "tree", "position", "leaf", "prev"]
+        fields += ["column", "lo", "hi", "z", "z_prev", "value"]
+        columns = {name: [] for name in fields}
+        offset = 0
+        depth = 0
+        self.expected = 0.0
+        for index, (tree, leaf_value, features) in enumerate(trees):
+            left, right = tree.children_left, tree.children_right
+            cover = tree.weighted_n_node_samples
+            # breadth-first position of every node within its level
+            position = np.zeros(tree.node_count, dtype=np.intp)
+            frontier = [0]
+            while frontier:
+                position[frontier] = np.arange(len(frontier))
+                frontier = [
+                    child
+                    for node in frontier
+                    if left[node] != -1
+                    for child in (left[node], right[node])
+                ]
+
+            nodes = [None] * tree.node_count
+            # node, parent, split feature and threshold of the parent, and the
+            # merged conditions (lo, hi, z, node) of every feature on the path
+            stack = [(0, -1, -1, 0.0, {})]
+            while stack:
+                node, parent, feature, threshold, conditions = stack.pop()
+                lo, hi, z_prev, prev = conditions.get(
+                    feature, (-np.inf, np.inf, 1.0, -1)
+                )
+                level, z, column = 0, 1.0, 0
+                if parent != -1:
+                    level = nodes[parent][0] + 1
+                    z = z_prev * cover[node] / cover[parent]
+                    if node == left[parent]:
+                        hi = min(hi, threshold)
+                    else:
+                        lo = max(lo, threshold)
+                    conditions = dict(conditions)
+                    conditions[feature] = (lo, hi, z, node + offset)
+                    column = feature if features is None else features[feature]
+                leaf = left[node] == -1
+                value = leaf_value[node] if leaf else 0.0
+                nodes[node] = (level, index, position[node], leaf, prev)
+                nodes[node] += (column, lo, hi, z, z_prev, value)
+                if leaf:
+                    depth = max(depth, len(conditions))
+                    self.expected += value * cover[node] / cover[0]
+                    continue
+                split = (tree.feature[node], tree.threshold[node])
+                stack.append((right[node], node) + split + (conditions,))
+                stack.append((left[node], node) + split + (conditions,))
+            for node in nodes:
+                for name, item in zip(fields, node):
+                    columns[name].append(item)
+            offset += len(nodes)
+
+        # level by level, tree by tree, breadth-first: the nodes of a level
+        # are then the children of the internal nodes of the level above, in
+        # (left, right) pairs
+        columns = {name: np.array(items) for name, items in columns.items()}
+        order = np.lexsort((columns["position"], columns["tree"], columns["level"]))
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        columns = {name: items[order] for name, items in columns.items()}
+        prev = columns["prev"]
+        has_prev = prev != -1
+        self.prev = np.where(has_prev, rank[prev], np.arange(len(prev)))
+
+        level, leaf = columns["level"], columns["leaf"]
+        self.levels = []
+        for t in range(level.max() + 1):
+            start, stop = np.searchsorted(level, [t, t + 1])
+            inner = start + np.flatnonzero(~leaf[start:stop])
+            self.levels.append((slice(start, stop), inner))
+        self.column, self.lo, self.hi = columns["column"], columns["lo"], columns["hi"]
+        self.scatter = np.zeros((len(level), n_features))
+        split = level > 0
+        self.scatter[split, self.column[split]] = 1.0
+
+        # ratio of the factors of a node and of prev, and weighted change of
+        # (o - z) / factor between them, at every quadrature point and for
+        # the four values of (o, o of prev)
+        points, weights = np.polynomial.legendre.leggauss(max(1, (depth + 1) // 2))
+        x, w = (points + 1) / 2, weights / 2
+        o = np.array([0.0, 0.0, 1.0, 1.0])[:, None]
+        o_prev = np.array([0.0, 1.0, 0.0, 1.0])[:, None]
+        z = columns["z"][:, None, None]
+        z_prev = columns["z_prev"][:, None, None]
+        has_prev = has_prev[:, None, None]
+        factor = z * (1 - x) + o * x
+        factor_prev = np.where(has_prev, z_prev * (1 - x) + o_prev * x, 1.0)
+        change = (o - z) / factor
+        change -= np.where(has_prev, (o_prev - z_prev) / factor_prev, 0.0)
+        # roots have no split: a factor of 1 and nothing to contribute; the
+        # leaf outputs are folded into the ratios of the leaves. Single
+        # precision halves the memory traffic of the passes over the nodes
+        root = (level == 0)[:, None, None]
+        ratio = np.where(root, 1.0, factor / factor_prev)
+        ratio *= np.where(leaf, columns["value"], 1.0)[:, None, None]
+        change = np.where(root, 0.0, change * w)
+        self.ratio = ratio.reshape(-1, len(x)).astype(np.float32)
+        self.change = change.reshape(-1, len(x)).astype(np.float32)
+        self.offset = 4 * np.arange(len(level))[:, None]
+
+    def __len__(self):
+        return len(self.column)
+
+    def contributions(self, X, out):
+        """
+        Add the exact path-dependent SHAP values of the rows of X to out
+        """
+        n_rows = len(X)
+        values = X.T[self.column]
+        one = (values > self.lo[:, None]) & (values <= self.hi[:, None])
+        code = one[self.prev].astype(np.intp)
+        code += one
+        code += one
+        code += self.offset
+
+        # product of the factors down to every node, times the output at the
+        # leaves, then summed up to every node
+        mass = np.take(self.ratio, code, axis=0)
+        pairs = []
+        for (_, inner), (nodes, _) in zip(self.levels, self.levels[1:]):
+            children = mass[nodes].reshape(len(inner), 2, n_rows, -1)
+            children *= mass[inner][:, None]
+            pairs.append((inner, children))
+        for inner, children in reversed(pairs):
+            mass[inner] = children[:, 0] + children[:, 1]
+
+        change = np.take(self.change, code, axis=0)
+        node_contributions = np.einsum("knm,knm->kn", change, mass)
+        out += node_contributions.T @ self.scatter
+
+
+def _forest(model):
+    """
+    Forest of the trees of a model, with leaf outputs that sum to the
+    probability of certification or, for gradient boosting, to the log-odds
+    less the raw prediction of the init estimator
+    """
+    from sklearn.ensemble import (
+        BaggingClassifier,
+        GradientBoostingClassifier,
+        RandomForestClassifier,
+    )
+    from sklearn.tree import DecisionTreeClassifier
+
+    def proba(tree):
+        value = tree.value[:, 0, :]
+        return value[:, 1] / value.sum(axis=1)
+
+    if isinstance(model, DecisionTreeClassifier):
+        trees = [(model.tree_, proba(model.tree_), None)]
+    elif isinstance(model, RandomForestClassifier):
+        n = len(model.estimators_)
+        trees = [(e.tree_, proba(e.tree_) / n, None) for e in model.estimators_]
+    elif isinstance(model, BaggingClassifier) and all(
+        isinstance(e, DecisionTreeClassifier) for e in model.estimators_
+    ):
+        n = len(model.estimators_)
+        trees = [
+            (e.tree_, proba(e.tree_) / n, features)
+            for e, features in zip(model.estimators_, model.estimators_features_)
+        ]
+    elif isinstance(model, GradientBoostingClassifier):
+        rate = model.learning_rate
+        trees = [
+            (e.tree_, e.tree_.value[:, 0, 0] * rate, None)
+            for e in model.estimators_[:, 0]
+        ]
+    else:
+        raise TypeError("no TreeSHAP support for {}".format(type(model).__name__))
+    return _Forest(trees, model.n_features_in_)
+
+
+def tree_contributions(model, X, n_jobs=-1):
+    """
+    Exact TreeSHAP contributions of every column, plus a bias column
+
+    The rows of the result sum to the model output: the probability of
+    certification for decision trees, random forests and bagged trees, the
+    log-odds for gradient boosting and XGBoost. For gradient boosting the
+    raw prediction of the init estimator is part of the bias column. Rows
+    are explained in chunks spread over threads.
+
+    model: fitted DecisionTree, RandomForest, Bagging (of trees),
+        GradientBoosting or XGBoost classifier
+    X: design matrix
+    n_jobs: number of threads
+    """
+    from joblib import Parallel, delayed
+
+    X = np.asarray(X)
+    with stage("attribution", rows=len(X)):
+        if type(model).__name__ == "XGBClassifier":
+            from xgboost import DMatrix
+
+            return model.get_booster().predict(DMatrix(X), pred_contribs=True)
+
+        forest = _forest(model)
+        out = np.zeros((len(X), X.shape[1] + 1))
+        out[:, -1] = forest.expected
+        if hasattr(model, "init_"):
+            out[:, -1] += model._raw_predict_init(X)[:, 0]
+        chunk = max(1, CHUNK_CELLS // (len(forest) * forest.ratio.shape[1]))
+        Parallel(n_jobs=n_jobs, prefer="threads")(
+            delayed(forest.contributions)(X[i : i + chunk], out[i : i + chunk, :-1])
+            for i in range(0, len(X), chunk)
+        )
+        return out
+
+
+@functools.lru_cache(maxsize=None)
+def aggregation_matrix():
+    """
+    Sparse matrix with a one where a column of the design matrix encodes
+    a predictor, of shape (design matrix columns, len(schema.FEATURES))
+
+    Multiplying per-column attributions by it sums the dummies of every
+    predictor back together.
+    """
+    from scipy import sparse
+
+    sources = dummy_sources()
+    columns = [FEATURES.index(source) for source in sources]
+    return sparse.csr_matrix(
+        (np.ones(len(sources)), (np.arange(len(sources)), columns)),
+        shape=(len(sources), len(FEATURES)),
+    )
+
+
+def feature_groups():
+    """
+    Design matrix columns of every predictor of schema.FEATURES, to permute
+    the dummies of a predictor together in permutation_importance
+    """
+    matrix = aggregation_matrix().tocsc()
+    return np.split(matrix.indices, matrix.indptr[1:-1])
+
+
+def group_contributions(contributions):
+    """
+    Attributions of the predictors of schema.FEATURES, with the columns
+    after the design matrix ones (the bias of tree_contributions) kept
+
+    contributions: array with a row per case, or a single row such as
+        feature_importances_, whose first columns follow the design matrix
+    """
+    contributions = np.asarray(contributions)
+    n_columns = aggregation_matrix().shape[0]
+    grouped = contributions[..., :n_columns] @ aggregation_matrix()
+    return np.concatenate([grouped, contributions[..., n_columns:]], axis=-1)
+
+
+def reason_codes(contributions, feature_names, k=3):
+    """
+    Names of the k features pushing each application most towards denial
+    and most towards certification
+
+    contributions: output of tree_contributions or group_contributions (the
+        bias column is ignored)
+    feature_names: names of the columns, schema.FEATURES when grouped
+    k: number of reasons of each kind
+    """
+    import pandas as pd
+
+    contributions = np.asarray(contributions)[:, : len(feature_names)]
+    names = np.asarray(feature_names, dtype=object)
+    order = np.argsort(contributions, axis=1)
+    codes = {}
+    for i in range(k):
+        codes["denial_{}".format(i + 1)] = names[order[:, i]]
+        codes["certification_{}".format(i + 1)] = names[order[:, -1 - i]]
+    return pd.DataFrame(codes)
+
+
+def plot_importances(model, path, title=None):
+    """
+    Bar chart of the feature importances of a tree model, summed over the
+    dummies of every predictor, saved as an image
+
+    model: fitted model with feature_importances_ over the design matrix
+    path: image file
+    title: name of the model added to the chart title
+    """
+    with stage("render"):
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+
+        # the importances of the dummies of a predictor add up to its own
+        importances = group_contributions(model.feature_importances_)
+        indices = np.argsort(importances)
+
+        plt.figure(figsize=(12, 12))
+        plt.title("Feature Importances" + (" - " + title if title else ""))
+        plt.barh(
+            range(len(indices)), importances[indices], color="violet", align="center"
+        )
+        plt.yticks(range(len(indices)), [FEATURES[i] for i in indices])
+        plt.xlabel("Relative Importance")
+        plt.savefig(path, bbox_inches="tight")
+        plt.close()
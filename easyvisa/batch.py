@@ -0,0 +1,242 @@
+"""
+Multi-process batch scoring through shared memory
+"""
+
+import multiprocessing
+import os
+
+import numpy as np
+
+from .profiling import count, stage
+
+# per-process state of the pool workers, set once by _attach
+_WORKER = {}
+
+
+def _context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+
+
+def _single_threaded(model):
+    """
+    Pin the n_jobs of a fitted model and of its sub-estimators to 1, so the
+    worker processes do not each start a thread pool of the size of the
+    machine
+    """
+    if not hasattr(model, "get_params"):
+        return
+    params = {
+        key: 1
+        for key, value in model.get_params(deep=True).items()
+        if key.split("__")[-1] == "n_jobs" and value != 1
+    }
+    try:
+        model.set_params(**params)
+    except ValueError:
+        pass
+
+
+def _attach(scorer, features, scores, n_rows):
+    """
+    Pool initializer: map the shared input and output buffers
+
+    Under fork the scorer is inherited from the parent without being
+    pickled; under spawn it is pickled once per worker, never per chunk.
+    """
+    from multiprocessing import shared_memory
+
+    from .features import FeatureStore, _layout
+
+    features = shared_memory.SharedMemory(name=features)
+    scores = shared_memory.SharedMemory(name=scores)
+    _, size = _layout(n_rows)
+    _single_threaded(scorer.model)
+    _WORKER.update(
+        scorer=scorer,
+        segments=(features, scores),
+        store=FeatureStore(np.ndarray(size, np.uint8, features.buf), n_rows),
+        proba=np.ndarray(n_rows, np.float64, scores.buf),
+    )
+
+
+def _score_rows(rows):
+    start, stop = rows
+    chunk = _WORKER["store"].slice(start, stop)
+    _WORKER["proba"][start:stop] = _WORKER["scorer"].predict_proba(chunk)
+    return rows
+
+
+def chunks(n_rows, chunk_rows):
+    """
+    (start, stop) row ranges covering n_rows in chunks of chunk_rows
+
+    n_rows: number of rows
+    chunk_rows: rows per chunk, the last one may be shorter
+    """
+    return [
+        (start, min(start + chunk_rows, n_rows))
+        for start in range(0, n_rows, chunk_rows)
+    ]
+
+
+def score_parallel(
+    scorer, store, processes=None, chunk_rows=65536, out=None, case_ids=None
+):
+    """
+    Probability of certification of every row of a store, scored by a pool
+    of processes
+
+    The store's buffer, a few bytes per row, is copied once into shared
+    memory and the probabilities are written by the workers into a second
+    shared segment, so neither the inputs nor the outputs of a chunk are
+    pickled; only the (start, stop) ranges travel through the pool. Each
+    worker expands its own chunk to the design matrix and scores it with
+    its models single-threaded.
+
+    scorer: scoring.Scorer
+    store: FeatureStore of the applications
+    processes: worker processes, all the CPUs by default
+    chunk_rows: rows scored by a worker at a time
+    out: Parquet file written in row order as the chunks complete, one row
+        group per chunk, with case_id (if given), probability and
+        prediction; requires pyarrow
+    case_ids: case_id of every row, numpy or Arrow array, written to out
+    """
+    from multiprocessing import shared_memory
+
+    if scorer.encoder is not None:
+        # the workers only see the store, not the columns the encoder reads
+        raise ValueError(
+            "{} is fitted on the output of {}, score it with score_csv".format(
+                scorer.name, type(scorer.encoder).__name__
+            )
+        )
+    n_rows = len(store)
+    processes = processes or os.cpu_count()
+    writer = None
+    if out is not None:
+        if case_ids is not None:
+            import pyarrow as pa
+
+            if not isinstance(case_ids, pa.Array):
+                case_ids = np.asarray(case_ids)
+        writer = _writer(out, case_ids is not None)
+    segments = []
+    try:
+        with stage("batch", rows=n_rows):
+            features = shared_memory.SharedMemory(
+                create=True, size=max(store.buffer.nbytes, 1)
+            )
+            segments.append(features)
+            scores = shared_memory.SharedMemory(create=True, size=max(8 * n_rows, 1))
+            segments.append(scores)
+            np.ndarray(store.buffer.nbytes, np.uint8, features.buf)[:] = store.buffer
+            proba = np.ndarray(n_rows, np.float64, scores.buf)
+            ranges = chunks(n_rows, chunk_rows)
+            count("batch_chunks", len(ranges))
+            pool = _context().Pool(
+                min(processes, max(len(ranges), 1)),
+                initializer=_attach,
+                initargs=(scorer, features.name, scores.name, n_rows),
+            )
+            with pool:
+                for start, stop in pool.imap(_score_rows, ranges):
+                    if writer is not None:
+                        _write(writer, scorer, proba[start:stop], case_ids, start)
+            result = proba.copy()
+            del proba
+    finally:
+        if writer is not None:
+            writer.close()
+        for segment in segments:
+            try:
+                segment.close()
+            except BufferError:
+                # a view is still held by the traceback of an error
+                pass
+            segment.unlink()
+    return result
+
+
+def _writer(out, with_ids):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    fields = [("probability", pa.float64()), ("prediction", pa.string())]
+    if with_ids:
+        fields.insert(0, ("case_id", pa.string()))
+    return pq.ParquetWriter(out, pa.schema(fields))
+
+
+def _write(writer, scorer, proba, case_ids, start):
+    import pyarrow as pa
+
+    columns = {
+        "probability": pa.array(proba),
+        "prediction": pa.array(
+            np.where(proba > scorer.threshold, "Certified", "Denied")
+        ),
+    }
+    if case_ids is not None:
+        if isinstance(case_ids, pa.Array):
+            ids = case_ids.slice(start, len(proba))
+        else:
+            ids = pa.array(case_ids[start : start + len(proba)].astype(str))
+        columns = dict(case_id=ids, **columns)
+    writer.write_table(pa.table(columns, schema=writer.schema))
+
+
+def score_csv(scorer, path, out, processes=None, chunk_rows=65536):
+    """
+    Score a csv of applications in parallel and write the scores to Parquet
+
+    Models saved with an encoder (sparse.SparseEncoder, encoding.TargetEncoder)
+    read columns the FeatureStore does not hold: their csv is scored in
+    this process instead, chunk_rows rows at a time with score_frame.
+
+    path: csv of applications, read by arrow.read_applications
+    out: destination Parquet file
+    processes: worker processes, all the CPUs by default
+    chunk_rows: rows scored by a worker at a time
+    """
+    from .arrow import read_applications, to_store
+    from .schema import ID_COLUMN
+
+    if scorer.encoder is not None:
+        return _score_frames(scorer, path, out, chunk_rows)
+    table = read_applications(path)
+    case_ids = None
+    if ID_COLUMN in table.schema.names:
+        case_ids = table.column(ID_COLUMN).combine_chunks()
+    store = to_store(table)
+    del table
+    return score_parallel(scorer, store, processes, chunk_rows, out, case_ids)
+
+
+def _score_frames(scorer, path, out, chunk_rows):
+    """
+    Score a csv with score_frame one chunk at a time, for the models that
+    need the dataframe, and write the scores to Parquet
+    """
+    from .data import load_visa
+    from .schema import ID_COLUMN
+
+    writer = None
+    results = []
+    try:
+        with stage("batch"):
+            for chunk in load_visa(path, chunksize=chunk_rows):
+                scores = scorer.score_frame(chunk)
+                proba = scores["probability"].to_numpy()
+                if writer is None:
+                    writer = _writer(out, ID_COLUMN in scores)
+                case_ids = None
+                if ID_COLUMN in scores:
+                    case_ids = scores[ID_COLUMN].to_numpy()
+                _write(writer, scorer, proba, case_ids, 0)
+                results.append(proba)
+    finally:
+        if writer is not None:
+            writer.close()
+    return np.concatenate(results) if results else np.empty(0)
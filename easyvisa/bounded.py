@@ -0,0 +1,156 @@
+"""
+Bagging and random forest training within a memory budget
+"""
+
+import os
+
+import numpy as np
+
+from .profiling import stage
+
+# bytes per training row held by every estimator being fitted: the drawn
+# indices and their bincount (int64), the sample weights (float64) and the
+# tree builder's sample index (intp) and feature value (float32) buffers
+TRAIN_BYTES_PER_ROW = 36
+
+
+def _node_bytes(n_classes=2):
+    """
+    Bytes per node of a fitted sklearn tree: the node record and its
+    float64 class values
+    """
+    from sklearn.tree._tree import NODE_DTYPE
+
+    return NODE_DTYPE.itemsize + 8 * n_classes
+
+
+def _n_features(value, n_features):
+    """
+    Number of features selected by a BaggingClassifier max_features
+    """
+    if isinstance(value, (float, np.floating)):
+        return max(1, int(value * n_features))
+    return int(value)
+
+
+def _is_bagging(model):
+    from sklearn.ensemble import BaggingClassifier
+
+    return isinstance(model, BaggingClassifier)
+
+
+def budget_plan(model, n_rows, n_features, memory_budget, n_jobs=None):
+    """
+    Number of estimators fitted at once and leaf cap of every tree keeping
+    an unfitted forest or bagging ensemble within a memory budget
+
+    Every estimator is fitted on the shared design matrix with its
+    bootstrap sample drawn as a weight vector, so the rows are never
+    copied; it holds TRAIN_BYTES_PER_ROW bytes per row while it is built,
+    plus, for bagging with max_features below 1, the copy of its feature
+    columns that BaggingClassifier makes. The estimators fitted at once
+    take at most half of the budget and the fitted trees share the rest:
+    a tree with L leaves has 2L - 1 nodes.
+
+    model: unfitted RandomForestClassifier or BaggingClassifier of trees
+    n_rows: number of training rows
+    n_features: number of design matrix columns
+    memory_budget: bytes for the training workspace and the fitted model
+    n_jobs: estimators fitted at once at most, by default the model's
+        n_jobs (-1 for every CPU)
+    """
+    n_jobs = n_jobs or model.n_jobs or 1
+    if n_jobs < 0:
+        n_jobs = max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+    working = TRAIN_BYTES_PER_ROW * n_rows
+    if _is_bagging(model):
+        selected = _n_features(model.max_features, n_features)
+        if selected < n_features or model.bootstrap_features:
+            working += 4 * n_rows * selected
+    n_jobs = int(max(1, min(n_jobs, memory_budget // 2 // working)))
+    tree_budget = (memory_budget - n_jobs * working) // model.n_estimators
+    max_leaf_nodes = int((tree_budget // _node_bytes() + 1) // 2)
+    if max_leaf_nodes < 2:
+        raise ValueError(
+            "a memory budget of {} bytes is too small for {} estimators on {} "
+            "rows".format(memory_budget, model.n_estimators, n_rows)
+        )
+    return {
+        "n_jobs": n_jobs,
+        "max_leaf_nodes": max_leaf_nodes,
+        "train_bytes_per_estimator": working,
+        "model_bytes": model.n_estimators * (2 * max_leaf_nodes - 1) * _node_bytes(),
+    }
+
+
+def fit_bounded(model, X, y, memory_budget, n_jobs=None):
+    """
+    Fit a random forest or a bagging ensemble of trees within a memory
+    budget and return it with the plan it was fitted with (see budget_plan)
+
+    The trees are capped to the plan's max_leaf_nodes, or to their own
+    max_leaf_nodes if it is lower, and grown best-first up to the cap.
+
+    model: unfitted RandomForestClassifier or BaggingClassifier of trees,
+        for example models.MODELS["rf_estimator"].build()
+    X: design matrix, float32 so that it is not converted, or CSR matrix
+    y: target
+    memory_budget: bytes for the training workspace and the fitted model
+    n_jobs: estimators fitted at once at most
+    """
+    from sklearn.base import clone
+    from sklearn.tree import DecisionTreeClassifier
+
+    if not hasattr(X, "nnz"):
+        X = np.asarray(X, dtype=np.float32)
+    plan = budget_plan(model, X.shape[0], X.shape[1], memory_budget, n_jobs)
+    limit = plan["max_leaf_nodes"]
+    if _is_bagging(model):
+        tree = clone(model.estimator or DecisionTreeClassifier())
+        cap = min(tree.max_leaf_nodes or limit, limit)
+        model.set_params(
+            estimator=tree.set_params(max_leaf_nodes=cap), n_jobs=plan["n_jobs"]
+        )
+    else:
+        cap = min(model.max_leaf_nodes or limit, limit)
+        model.set_params(max_leaf_nodes=cap, n_jobs=plan["n_jobs"])
+    plan["max_leaf_nodes"] = cap
+    with stage("fit", rows=len(y)):
+        model.fit(X, y)
+    return model, plan
+
+
+def estimator_report(model, n_rows):
+    """
+    Size of every fitted tree of a forest or bagging ensemble and the
+    training memory it held
+
+    Returns a frame with one row per estimator: nodes, leaves, depth,
+    features it was fitted on, bytes of its node arrays (model_bytes) and
+    bytes of training workspace (train_bytes, as counted by budget_plan).
+
+    model: fitted RandomForestClassifier or BaggingClassifier of trees
+    n_rows: number of training rows
+    """
+    import pandas as pd
+
+    n_features = model.n_features_in_
+    features = getattr(model, "estimators_features_", None)
+    report = []
+    for i, estimator in enumerate(model.estimators_):
+        tree = estimator.tree_
+        selected = n_features if features is None else len(features[i])
+        train_bytes = TRAIN_BYTES_PER_ROW * n_rows
+        if selected < n_features or getattr(model, "bootstrap_features", False):
+            train_bytes += 4 * n_rows * selected
+        report.append(
+            {
+                "nodes": tree.node_count,
+                "leaves": tree.n_leaves,
+                "depth": tree.max_depth,
+                "features": selected,
+                "model_bytes": tree.node_count * _node_bytes(tree.value.shape[-1]),
+                "train_bytes": train_bytes,
+            }
+        )
+    return pd.DataFrame(report).rename_axis("estimator")
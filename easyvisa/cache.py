@@ -0,0 +1,175 @@
+"""
+LRU/TTL cache of predicted probabilities keyed on the encoded applications
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .profiling import count
+
+# 64-bit FNV-1a offset basis and prime
+_OFFSET = 0xCBF29CE484222325
+_PRIME = np.uint64(0x100000001B3)
+
+# periods of every unit_of_wage in a year of full-time work, by which the
+# prevailing wage is annualized before it is bucketed
+WAGE_PERIODS = {"Hour": 2080.0, "Week": 52.0, "Month": 12.0, "Year": 1.0}
+
+
+def row_keys(X, bucket=None, scale=None):
+    """
+    64-bit FNV-1a hash of every row of a float32 matrix, one column at a
+    time so the whole batch is hashed with a few vectorized passes
+
+    X: float32 matrix such as FeatureStore.design_matrix()
+    bucket: dict of column index to a bucket width; values of those
+        columns are floored to a multiple of the width before hashing, so
+        that rows differing by less than a bucket share a key
+    scale: dict of column index to an array of one factor per row, by
+        which the values of a bucketed column are multiplied first
+    """
+    X = np.asarray(X, dtype=np.float32)
+    keys = np.full(len(X), _OFFSET, dtype=np.uint64)
+    for j in range(X.shape[1]):
+        column = X[:, j]
+        if bucket and j in bucket:
+            if scale and j in scale:
+                column = column * scale[j]
+            column = (np.floor(column / bucket[j]) * bucket[j]).astype(np.float32)
+        keys ^= column.view(np.uint32)
+        keys *= _PRIME
+    return keys
+
+
+class PredictionCache:
+    """
+    Bounded least-recently-used cache of probabilities of certification
+
+    Entries are keyed on row_keys of the design matrix rows, optionally
+    with the annualized prevailing wage bucketed, expire ttl seconds after they were
+    stored and are all dropped when the cache is bound to a new model
+    version. A cache can be shared by threads scoring concurrently.
+    """
+
+    def __init__(self, maxsize=100000, ttl=None, wage_bucket=None):
+        """
+        maxsize: largest number of entries, the least recently used ones are
+            evicted beyond it
+        ttl: seconds an entry stays valid, forever by default
+        wage_bucket: width of the buckets of the prevailing wage annualized
+            with WAGE_PERIODS, so that one width fits hourly and yearly
+            wages alike; exact wages by default
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.wage_bucket = wage_bucket
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def keys(self, store):
+        """
+        Cache keys of the rows of a FeatureStore
+
+        store: FeatureStore
+        """
+        from .schema import CATEGORIES
+
+        bucket = scale = None
+        if self.wage_bucket:
+            j = store.feature_names.index("prevailing_wage")
+            periods = [WAGE_PERIODS[unit] for unit in CATEGORIES["unit_of_wage"]]
+            # unseen units (MISSING_CODE) keep the wage as it is
+            periods = np.append(periods, np.ones(256 - len(periods)))
+            bucket = {j: self.wage_bucket}
+            scale = {j: periods[store.column("unit_of_wage")].astype(np.float32)}
+        return row_keys(store.design_matrix(), bucket, scale)
+
+    def bind(self, version):
+        """
+        Drop every entry if the model version changed
+
+        version: identifier of the model whose predictions are cached
+        """
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+
+    def clear(self):
+        """
+        Drop every entry
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def lookup(self, keys):
+        """
+        Cached probabilities of the keys, NaN for misses
+
+        keys: array of row keys
+        """
+        proba = np.full(len(keys), np.nan)
+        now = time.monotonic()
+        hits = 0
+        with self._lock:
+            entries = self._entries
+            for i, key in enumerate(keys.tolist()):
+                entry = entries.get(key)
+                if entry is None:
+                    continue
+                value, expires = entry
+                if expires is not None and expires < now:
+                    del entries[key]
+                    self.expirations += 1
+                    continue
+                entries.move_to_end(key)
+                proba[i] = value
+                hits += 1
+            self.hits += hits
+            self.misses += len(keys) - hits
+        count("cache_hits", hits)
+        count("cache_misses", len(keys) - hits)
+        return proba
+
+    def update(self, keys, proba):
+        """
+        Store probabilities, evicting the least recently used entries
+
+        keys: array of row keys
+        proba: probabilities of certification of the keys
+        """
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            entries = self._entries
+            for key, value in zip(keys.tolist(), proba.tolist()):
+                entries[key] = (value, expires)
+                entries.move_to_end(key)
+            evictions = max(0, len(entries) - self.maxsize)
+            for _ in range(evictions):
+                entries.popitem(last=False)
+            self.evictions += evictions
+
+    def stats(self):
+        """
+        Size, hits, misses, hit rate, evictions and expirations so far
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else float("nan"),
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
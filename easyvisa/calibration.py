@@ -0,0 +1,91 @@
+"""
+Probability calibration maps stored as piecewise-linear lookup tables
+"""
+
+import numpy as np
+
+from .profiling import stage
+
+METHODS = ["isotonic", "platt"]
+
+
+class Calibration:
+    """
+    Piecewise-linear map from a model's probability of certification to a
+    calibrated one
+
+    Both methods are reduced to knots (x, y) held as float32 arrays of a
+    few hundred entries at most, so the map is pickled with the model for
+    a few kB and applied to a whole batch with one np.interp.
+    """
+
+    def __init__(self, x, y, method):
+        """
+        x: increasing probabilities predicted by the model
+        y: calibrated probabilities at x
+        method: name of the method the knots come from
+        """
+        self.x = np.asarray(x, dtype=np.float32)
+        self.y = np.asarray(y, dtype=np.float32)
+        self.method = method
+
+    def __call__(self, proba):
+        """
+        Calibrated probabilities, constant beyond the first and last knots
+
+        proba: array of predicted probabilities of certification
+        """
+        return np.interp(proba, self.x, self.y)
+
+    def __repr__(self):
+        return "Calibration(method={!r}, knots={})".format(self.method, len(self.x))
+
+
+def _isotonic(proba, target, sample_weight):
+    from sklearn.isotonic import IsotonicRegression
+
+    isotonic = IsotonicRegression(y_min=0, y_max=1, out_of_bounds="clip")
+    isotonic.fit(proba, target, sample_weight=sample_weight)
+    return isotonic.X_thresholds_, isotonic.y_thresholds_
+
+
+def _platt(proba, target, sample_weight, knots=257, eps=1e-6):
+    from sklearn.linear_model import LogisticRegression
+
+    def logit(p):
+        p = np.clip(p, eps, 1 - eps)
+        return np.log(p / (1 - p))
+
+    model = LogisticRegression(C=np.inf)
+    model.fit(logit(proba)[:, None], target, sample_weight=sample_weight)
+    # knots evenly spaced on the logit scale, where the sigmoid bends
+    x = np.concatenate([[0.0], 1 / (1 + np.exp(-np.linspace(-12, 12, knots))), [1.0]])
+    return x, model.predict_proba(logit(x)[:, None])[:, 1]
+
+
+def fit_calibration(proba, target, method="isotonic", sample_weight=None):
+    """
+    Fit a calibration map on out-of-fold probabilities
+
+    proba: probabilities of certification of the rows of target, or an
+        (n_repeats, n_rows) array of them such as ModelComparison.oof_proba
+        values, where NaN marks rows that were not predicted
+    target: 0/1 target of the rows
+    method: "isotonic" (monotone step fit) or "platt" (logistic fit on the
+        log-odds)
+    sample_weight: weights of the rows, such as those of a weighted
+        training sample (see sampling.draw)
+    """
+    if method not in METHODS:
+        raise ValueError("method must be one of {}".format(METHODS))
+    proba = np.asarray(proba, dtype=np.float64)
+    target = np.broadcast_to(np.asarray(target), proba.shape)
+    predicted = np.isfinite(proba)
+    proba, target = proba[predicted], target[predicted]
+    if sample_weight is not None:
+        sample_weight = np.broadcast_to(np.asarray(sample_weight), predicted.shape)
+        sample_weight = sample_weight[predicted]
+    with stage("calibrate", rows=len(proba)):
+        fit = _isotonic if method == "isotonic" else _platt
+        x, y = fit(proba, target, sample_weight)
+    return Calibration(x, y, method)
@@ -0,0 +1,122 @@
+"""
+Tiered triage scoring: a cheap model first, the ensemble only for the cases
+it is unsure about
+"""
+
+import time
+
+import numpy as np
+
+from .profiling import count, stage
+
+BANDS = [(0.4, 0.6), (0.3, 0.7), (0.2, 0.8)]
+
+
+class Cascade:
+    """
+    Scores every case with a fast model and escalates the cases whose
+    probability of certification falls inside the uncertainty band
+    (low, high) to a slow, more accurate model
+
+    Behaves as a fitted binary classifier, so it can be saved with
+    scoring.save_model, scored with Scorer and evaluated like the
+    notebook's models.
+    """
+
+    def __init__(self, fast, slow, low=0.3, high=0.7):
+        """
+        fast: fitted cheap classifier, for example the tuned decision tree
+        slow: fitted expensive classifier, for example the stacking classifier
+        low: probabilities above low and below high are escalated
+        high: upper end of the uncertainty band
+        """
+        if not 0 <= low <= high <= 1:
+            raise ValueError("need 0 <= low <= high <= 1")
+        self.fast = fast
+        self.slow = slow
+        self.low = low
+        self.high = high
+
+    @property
+    def classes_(self):
+        return self.slow.classes_
+
+    def escalate(self, proba):
+        """
+        Mask of the cases sent to the slow model
+
+        proba: probabilities of certification from the fast model
+        """
+        return (proba > self.low) & (proba < self.high)
+
+    def predict_proba(self, X):
+        """
+        Class probabilities of the fast model, replaced by those of the slow
+        model for the escalated rows
+
+        X: design matrix
+        """
+        with stage("cascade", rows=len(X)):
+            proba = self.fast.predict_proba(X)
+            uncertain = np.flatnonzero(self.escalate(proba[:, 1]))
+            count("escalated", len(uncertain))
+            if len(uncertain):
+                proba[uncertain] = self.slow.predict_proba(X[uncertain])
+        return proba
+
+    def predict(self, X):
+        """
+        Predicted class of every row
+
+        X: design matrix
+        """
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def cascade_report(fast, slow, X, y, bands=BANDS):
+    """
+    Fraction of traffic escalated, throughput and accuracy loss of
+    cascades with several uncertainty bands, against always scoring with
+    the slow model
+
+    fast: fitted cheap classifier
+    slow: fitted expensive classifier
+    X: design matrix
+    y: target
+    bands: list of (low, high) uncertainty bands
+    """
+    import pandas as pd
+    from sklearn.metrics import accuracy_score, f1_score
+
+    def run(model):
+        start = time.perf_counter()
+        pred = model.predict(X)
+        return pred, len(X) / (time.perf_counter() - start)
+
+    pred, rows_per_second = run(slow)
+    accuracy, f1 = accuracy_score(y, pred), f1_score(y, pred)
+    report = {
+        "ensemble": {
+            "escalated": 1.0,
+            "rows_per_second": rows_per_second,
+            "Accuracy": accuracy,
+            "F1": f1,
+        }
+    }
+    fast_proba = fast.predict_proba(X)[:, 1]
+    for low, high in bands:
+        cascade = Cascade(fast, slow, low, high)
+        pred, rows_per_second = run(cascade)
+        report["({:g}, {:g})".format(low, high)] = {
+            "escalated": cascade.escalate(fast_proba).mean(),
+            "rows_per_second": rows_per_second,
+            "Accuracy": accuracy_score(y, pred),
+            "F1": f1_score(y, pred),
+        }
+    report = pd.DataFrame(report).T
+    report["speedup"] = (
+        report["rows_per_second"] / report.loc["ensemble", "rows_per_second"]
+    )
+    report["accuracy_loss"] = accuracy - report["Accuracy"]
+    report["f1_loss"] = f1 - report["F1"]
+    return report
@@ -0,0 +1,951 @@
+"""
+Command line interface of the EasyVisa pipeline
+
+usage: python -m easyvisa {train,tune,run,dedup,compare,calibrate,compact,stack,cascade,sampling,jobs,trials,synth,score,batch,report} ...
+
+Every subcommand imports its dependencies when it runs, so starting the
+CLI or importing this module only loads the standard library.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+DEFAULT_MODELS = ["dtree_estimator", "rf_tuned", "gbc_tuned", "xgb_tuned"]
+COMPACT_MODELS = ["rf_tuned", "bagging_estimator_tuned", "gbc_tuned", "abc_tuned"]
+# sampling.STRATEGIES, repeated so that building the parser imports nothing
+SAMPLING_STRATEGIES = ["stratified", "undersample", "coreset"]
+# jobs.STATUSES
+JOB_STATUSES = ["queued", "running", "done", "failed", "cancelled"]
+
+
+def _prepare(path):
+    """
+    Load, clean and encode a csv, and draw the notebook's 70:30 split
+    """
+    return _prepare_frame(path)[1:]
+
+
+def _prepare_frame(path):
+    """
+    _prepare, with the cleaned dataframe the store is encoded from first
+    """
+    from .data import clean, load_visa
+    from .features import FeatureStore
+    from .split import Splitter
+
+    data = clean(load_visa(path))
+    store = FeatureStore.from_frame(data)
+    splitter = Splitter(store)
+    return data, store, splitter, splitter.holdout()
+
+
+def _model_input(encoder, data, store):
+    """
+    Input of a saved model for every row: the design matrix, or the output
+    of the encoder saved with the model (see _training_arrays)
+
+    encoder: the artifact's encoder, None for the design matrix
+    data: cleaned dataframe
+    store: FeatureStore encoded from it
+    """
+    if encoder is None:
+        return store.design_matrix()
+    return encoder.transform(data, store)
+
+
+def _params_path(directory):
+    return os.path.join(directory, "params.pkl")
+
+
+def _read_params(directory):
+    import joblib
+
+    path = _params_path(directory)
+    if not os.path.exists(path):
+        return {}
+    return joblib.load(path)
+
+
+def _sample(args):
+    """
+    (strategy, size, ratio) of the --sample options, None without them
+    """
+    if args.sample is None:
+        return None
+    return args.sample, args.sample_size, args.sample_ratio
+
+
+def _training_arrays(args):
+    """
+    Design matrix and target of the notebook's training rows, and the
+    metadata saved with the models fitted on them
+
+    With --extras the extra columns are one-hot encoded next to the
+    predictors into a CSR matrix, by a sparse.SparseEncoder fitted on the
+    training rows and saved with the models. With --encoding target the
+    categorical predictors and the extra columns are replaced by their
+    out-of-fold certification rates (see encoding.TargetEncoder).
+    """
+    if not args.extras and args.encoding == "onehot":
+        store, splitter, holdout = _prepare(args.data)
+        return splitter.arrays(holdout.train) + ({},)
+    from .data import clean, load_visa
+    from .encoding import TargetEncoder
+    from .features import FeatureStore
+    from .sparse import SparseEncoder
+    from .split import Splitter
+
+    data = clean(load_visa(args.data))
+    store = FeatureStore.from_frame(data)
+    train = Splitter(store).holdout().train
+    if args.encoding == "target":
+        encoder = TargetEncoder(args.extras or ())
+        X_train = encoder.fit_transform(data, store, train)
+        return X_train, store.target[train], {"encoder": encoder}
+    encoder = SparseEncoder(
+        args.extras, args.max_categories, args.min_frequency, args.hash_buckets
+    )
+    X = encoder.fit(data.iloc[train]).transform(data, store)
+    return X[train], store.target[train], {"encoder": encoder}
+
+
+def _fit_and_save(name, model, X_train, y_train, directory, **metadata):
+    from .profiling import stage
+    from .scoring import save_model
+
+    with stage("fit", rows=len(y_train)):
+        model.fit(X_train, y_train)
+    save_model(os.path.join(directory, name + ".joblib"), model, name, **metadata)
+    return model
+
+
+def train(args):
+    """
+    Fit models with their tuned parameters (see tune) or, before any
+    tuning, with the notebook's base parameters, and save them
+    """
+    from .models import MODELS
+
+    X_train, y_train, metadata = _training_arrays(args)
+    params = _read_params(args.out)
+    os.makedirs(args.out, exist_ok=True)
+    for name in args.models:
+        model = MODELS[name].build().set_params(**params.get(name, {}))
+        if args.memory_budget and _is_ensemble_of_trees(model):
+            _fit_bounded_and_save(name, model, X_train, y_train, args, **metadata)
+        else:
+            _fit_and_save(name, model, X_train, y_train, args.out, **metadata)
+        print("trained", name)
+
+
+def _is_ensemble_of_trees(model):
+    from sklearn.ensemble import BaggingClassifier, RandomForestClassifier
+
+    return isinstance(model, RandomForestClassifier) or (
+        isinstance(model, BaggingClassifier) and model.estimator is None
+    )
+
+
+def _fit_bounded_and_save(name, model, X_train, y_train, args, **metadata):
+    """
+    Fit a forest or bagging model within --memory-budget and print the
+    size of its estimators
+    """
+    from .bounded import estimator_report, fit_bounded
+    from .scoring import save_model
+
+    model, plan = fit_bounded(model, X_train, y_train, args.memory_budget * 2**20)
+    save_model(os.path.join(args.out, name + ".joblib"), model, name, **metadata)
+    report = estimator_report(model, len(y_train))
+    print(name, plan)
+    print(report.describe().loc[["mean", "max"]].round(1).to_string())
+    print("model MiB: {:.2f}".format(report["model_bytes"].sum() / 2**20))
+
+
+def tune(args):
+    """
+    Run the grid searches, store the best parameters and save the refit
+    models
+    """
+    import joblib
+
+    from .models import tune as grid_search
+    from .profiling import stage
+    from .sampling import tune_sampled
+    from .scoring import save_model
+
+    X_train, y_train, metadata = _training_arrays(args)
+    params = _read_params(args.out)
+    os.makedirs(args.out, exist_ok=True)
+    search = {} if args.n_jobs is None else {"n_jobs": args.n_jobs}
+    if args.trials:
+        search["trials"] = args.trials
+    sample = _sample(args)
+    for name in args.models:
+        with stage("tune:" + name, rows=len(y_train)):
+            if sample is None:
+                model, oof = grid_search(
+                    name, X_train, y_train, return_oof=True, **search
+                )
+            else:
+                model, oof = tune_sampled(
+                    name, X_train, y_train, *sample, return_oof=True, **search
+                )
+        params[name] = model.get_params(deep=False)
+        # the out-of-fold predictions of the search, for calibrate
+        save_model(
+            os.path.join(args.out, name + ".joblib"), model, name, oof=oof, **metadata
+        )
+        print("tuned", name)
+    joblib.dump(params, _params_path(args.out))
+
+
+def sampling(args):
+    """
+    Compare grid searches on the full training data and on samples of it
+    """
+    from .sampling import sampling_report
+
+    store, splitter, holdout = _prepare(args.data)
+    X_train, y_train = splitter.arrays(holdout.train)
+    X_test, y_test = splitter.arrays(holdout.test)
+    search = {} if args.n_jobs is None else {"n_jobs": args.n_jobs}
+    report = sampling_report(
+        args.models,
+        X_train,
+        y_train,
+        X_test,
+        y_test,
+        args.strategies,
+        args.sample_size,
+        args.sample_ratio,
+        **search,
+    )
+    print(report.round(4).to_string())
+
+
+def score(args):
+    """
+    Score applications from a csv, or from an Arrow IPC stream into an
+    IPC stream of scores, with a saved model
+    """
+    from .data import load_visa
+    from .scoring import Scorer
+
+    cache = None
+    if args.cache_size:
+        from .cache import PredictionCache
+
+        cache = PredictionCache(args.cache_size, wage_bucket=args.wage_bucket)
+    scorer = Scorer.load(args.model, threshold=args.threshold, cache=cache)
+    if args.ipc:
+        source = sys.stdin.buffer if args.data == "-" else args.data
+        scorer.score_ipc(source, args.out or sys.stdout.buffer)
+    else:
+        scores = scorer.score_frame(load_visa(args.data), reasons=args.reasons)
+        scores.to_csv(args.out or sys.stdout, index=False)
+    if cache is not None:
+        print("prediction cache:", cache.stats(), file=sys.stderr)
+
+
+def batch(args):
+    """
+    Score a csv with a pool of processes and write the scores to Parquet
+    """
+    from .batch import score_csv
+    from .scoring import Scorer
+
+    scorer = Scorer.load(args.model, threshold=args.threshold)
+    score_csv(scorer, args.data, args.out, args.processes, args.chunk_rows)
+
+
+def report(args):
+    """
+    Compare the saved models on the training and test sets and optionally
+    plot the feature importances of one of them
+    """
+    import glob
+
+    import pandas as pd
+
+    from .metrics import model_performance_classification_sklearn
+    from .models import MODELS
+    from .scoring import Scorer
+
+    data, store, splitter, holdout = _prepare_frame(args.data)
+    scorers = {}
+    for path in sorted(glob.glob(os.path.join(args.models_dir, "*.joblib"))):
+        scorer = Scorer.load(path)
+        scorers[scorer.name] = scorer
+    order = [name for name in MODELS if name in scorers]
+    order += [name for name in scorers if name not in order]
+    # models saved with an encoder (--extras, --encoding target) take its
+    # output instead of the design matrix
+    inputs = {name: _model_input(scorers[name].encoder, data, store) for name in order}
+    for part, rows in [("train", holdout.train), ("test", holdout.test)]:
+        y = store.target[rows]
+        comparison = pd.concat(
+            [
+                model_performance_classification_sklearn(
+                    scorers[name].model, inputs[name][rows], y
+                ).T
+                for name in order
+            ],
+            axis=1,
+        )
+        comparison.columns = [
+            MODELS[name].label if name in MODELS else name for name in order
+        ]
+        print("{} performance comparison:".format(part.capitalize()))
+        print(comparison)
+    if args.plot:
+        scorer = scorers[args.plot_model or order[-1]]
+        if scorer.encoder is not None:
+            print(
+                "no importances plot for {}: it is fitted on the output of {}".format(
+                    scorer.name, type(scorer.encoder).__name__
+                ),
+                file=sys.stderr,
+            )
+        else:
+            from .attribution import plot_importances
+
+            plot_importances(scorer.model, args.plot)
+
+
+def run(args):
+    """
+    Run the pipeline, resuming from its checkpoints
+    """
+    from .pipeline import Pipeline
+
+    pipeline = Pipeline(
+        args.data,
+        args.checkpoints,
+        models=args.models,
+        stack=not args.no_stack,
+        n_jobs=args.n_jobs,
+        dedup=args.dedup,
+        sample=_sample(args),
+        trials=args.trials,
+    )
+    status = pipeline.run(until=args.until, force=args.force)
+    for name, state in status.items():
+        print("{:<32} {}".format(name, state))
+    if "evaluate" in status:
+        evaluation = pipeline.result("evaluate")
+        print("Test performance comparison:")
+        print(evaluation["test"])
+
+
+def dedup(args):
+    """
+    Copy a csv without its duplicate applications, reading it in chunks,
+    and optionally count the near-duplicates left
+    """
+    from .data import load_visa
+    from .dedup import BLOCK_COLUMNS, Deduplicator, near_duplicates
+
+    def write(chunks, path):
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(path, mode="a" if i else "w", header=not i, index=False)
+
+    deduplicator = Deduplicator(collapse=args.collapse)
+    chunks = load_visa(args.data, chunksize=args.chunksize)
+    write((deduplicator.partial(chunk) for chunk in chunks), args.out)
+    print(
+        "rows: {}, duplicates dropped: {}".format(
+            deduplicator.rows, deduplicator.duplicates
+        )
+    )
+    if args.collapse:
+        # a second streaming pass adds the counts, known once all is read
+        submissions = deduplicator.submissions()
+        chunks = load_visa(args.out, chunksize=args.chunksize)
+        write(
+            (chunk.assign(n_submissions=submissions[chunk.index]) for chunk in chunks),
+            args.out + ".tmp",
+        )
+        os.replace(args.out + ".tmp", args.out)
+    if args.near:
+        columns = BLOCK_COLUMNS + ["prevailing_wage", "no_of_employees"]
+        match = near_duplicates(load_visa(args.out, usecols=columns))
+        print("near-duplicates: {}".format((match >= 0).sum()))
+
+
+def compare(args):
+    """
+    Compare models over repeated stratified K-fold with confidence intervals
+    """
+    import pandas as pd
+
+    from .compare import compare_models
+    from .models import MODELS
+
+    store, splitter, holdout = _prepare(args.data)
+    params = _read_params(args.params) if args.params else {}
+    estimators = {
+        name: MODELS[name].build().set_params(**params.get(name, {}))
+        for name in args.models
+    }
+    comparison = compare_models(
+        store,
+        estimators,
+        splitter,
+        n_splits=args.splits,
+        n_repeats=args.repeats,
+        n_jobs=args.n_jobs,
+        cache_dir=args.cache,
+    )
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(comparison.summary().round(4))
+        print(comparison.paired_tests().round(4))
+    best, tied = comparison.best()
+    print("best model:", best)
+    if tied:
+        print("not significantly worse:", ", ".join(tied))
+
+
+def calibrate(args):
+    """
+    Fit a calibration map on the out-of-fold probabilities that tune saved
+    with every tuned model and store it in the model's artifact
+    """
+    import glob
+
+    import joblib
+    from sklearn.metrics import brier_score_loss
+
+    from .calibration import fit_calibration
+    from .models import MODELS
+    from .scoring import save_model
+
+    data, store, splitter, holdout = _prepare_frame(args.data)
+    y_test = store.target[holdout.test]
+    for path in sorted(glob.glob(os.path.join(args.models_dir, "*.joblib"))):
+        artifact = joblib.load(path)
+        name = artifact["name"]
+        if name not in MODELS:
+            # compacted models and cascades are built from tuned artifacts
+            print("skipped", os.path.basename(path), "(not a tuned model)")
+            continue
+        oof = artifact.get("oof")
+        if oof is None:
+            print("skipped", name, "(no out-of-fold predictions, run tune first)")
+            continue
+        model = artifact.pop("model")
+        del artifact["name"]
+        calibration = fit_calibration(
+            oof["proba"], oof["target"], args.method, oof["sample_weight"]
+        )
+        X = _model_input(artifact.get("encoder"), data, store)
+        proba = model.predict_proba(X[holdout.test])[:, 1]
+        print(
+            "{:<24} test Brier score {:.4f} -> {:.4f}".format(
+                name,
+                brier_score_loss(y_test, proba),
+                brier_score_loss(y_test, calibration(proba)),
+            )
+        )
+        artifact.pop("feature_names")
+        artifact.update(calibration=calibration, version=name + "+" + args.method)
+        save_model(path, model, name, **artifact)
+
+
+def compact(args):
+    """
+    Prune and quantize saved tree ensembles into numpy-only artifacts,
+    checked against the originals on the test set
+    """
+    import joblib
+
+    from .compaction import compact as compact_model
+    from .compaction import compaction_report
+    from .scoring import save_model
+    from .sparse import SparseEncoder
+
+    data, store, splitter, holdout = _prepare_frame(args.data)
+    for name in args.models:
+        path = os.path.join(args.models_dir, name + ".joblib")
+        if not os.path.exists(path):
+            print("skipped", name, "(no artifact)")
+            continue
+        artifact = joblib.load(path)
+        encoder = artifact.get("encoder")
+        if isinstance(encoder, SparseEncoder):
+            # the compacted trees walk dense rows
+            print("skipped", name, "(fitted on sparse --extras)")
+            continue
+        X_test = _model_input(encoder, data, store)[holdout.test]
+        model = artifact.pop("model")
+        compacted = compact_model(model, X_test, args.tolerance)
+        print(name)
+        print(compaction_report(model, compacted, X_test).round(4).to_string())
+        artifact.pop("feature_names")
+        artifact["version"] = artifact["version"] + "+compact"
+        name = artifact.pop("name") + "_compact"
+        save_model(
+            os.path.join(args.models_dir, name + ".joblib"), compacted, name, **artifact
+        )
+
+
+def stack(args):
+    """
+    Fit the notebook's stacking classifier on the training rows over the
+    saved models of its estimators, and save it as stacking_classifier
+    (the ensemble of a cascade)
+
+    Estimators without an artifact, such as the untuned AdaBoost, are
+    built with their tuned or the notebook's parameters.
+    """
+    import joblib
+
+    from .models import MODELS, STACKING_ESTIMATORS, STACKING_FINAL, build_stacking
+
+    params = _read_params(args.models_dir)
+    fitted = {}
+    for name in [name for _, name in STACKING_ESTIMATORS] + [STACKING_FINAL]:
+        path = os.path.join(args.models_dir, name + ".joblib")
+        if not os.path.exists(path):
+            fitted[name] = MODELS[name].build().set_params(**params.get(name, {}))
+            continue
+        artifact = joblib.load(path)
+        if artifact.get("encoder") is not None:
+            sys.exit(
+                "stack: {} is fitted on the output of {}, not the design "
+                "matrix".format(name, type(artifact["encoder"]).__name__)
+            )
+        fitted[name] = artifact["model"]
+    store, splitter, holdout = _prepare(args.data)
+    X_train, y_train = splitter.arrays(holdout.train)
+    _fit_and_save(
+        "stacking_classifier",
+        build_stacking(fitted),
+        X_train,
+        y_train,
+        args.models_dir,
+    )
+    print("trained stacking_classifier")
+
+
+def cascade(args):
+    """
+    Report the escalated fraction, throughput and accuracy loss of a
+    fast -> slow scoring cascade on the test set, and optionally save it
+    """
+    import pandas as pd
+
+    from .cascade import BANDS, Cascade, cascade_report
+    from .scoring import Scorer, save_model
+
+    fast, slow = Scorer.load(args.fast), Scorer.load(args.slow)
+    for scorer in (fast, slow):
+        if scorer.encoder is not None:
+            # both models of a cascade score the same design matrix
+            sys.exit(
+                "cascade: {} is fitted on the output of {}, not the design "
+                "matrix".format(scorer.name, type(scorer.encoder).__name__)
+            )
+    store, splitter, holdout = _prepare(args.data)
+    X_test, y_test = splitter.arrays(holdout.test)
+    bands = args.band or BANDS
+    report = cascade_report(fast.model, slow.model, X_test, y_test, bands)
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(report.round(4))
+    if args.save:
+        model = Cascade(fast.model, slow.model, *bands[0])
+        version = fast.version + ">" + slow.version
+        save_model(args.save, model, "cascade", version=version)
+
+
+def jobs(args):
+    """
+    Submit, run, list, watch and cancel queued tuning and training jobs
+    """
+    from .jobs import JobQueue, work
+
+    queue = JobQueue(args.db)
+    if args.action == "submit":
+        for name in args.models:
+            spec = {"data": args.data, "model": name, "out": args.out}
+            if args.n_jobs is not None:
+                spec["n_jobs"] = args.n_jobs
+            if args.trials:
+                spec["trials"] = os.path.abspath(args.trials)
+            if args.sample:
+                spec.update(
+                    sample=args.sample, size=args.sample_size, ratio=args.sample_ratio
+                )
+            print(queue.submit(args.kind, args.priority, **spec))
+    elif args.action == "worker":
+        recovered = queue.recover(args.stale) if args.recover else 0
+        if recovered:
+            print("resuming", recovered, "interrupted jobs", file=sys.stderr)
+        work(queue, once=args.once, poll=args.poll)
+    elif args.action == "list":
+        for job in queue.jobs(args.status):
+            print(_job_line(queue, job))
+    elif args.action == "status":
+        job = queue.get(args.job)
+        print(_job_line(queue, job))
+        for candidate in queue.candidates(args.job):
+            print(
+                "  {candidate:4d} {score:.4f} {fit_time:7.2f}s {params}".format(
+                    **dict(candidate, score=candidate["score"] or float("nan"))
+                )
+            )
+        if job["error"]:
+            print(job["error"])
+    elif args.action == "cancel":
+        for job in args.jobs:
+            queue.cancel(job)
+    elif args.action == "watch":
+        for job in queue.watch(args.job, args.interval):
+            print(_job_line(queue, job), flush=True)
+    queue.close()
+
+
+def trials(args):
+    """
+    Print the trials stored for a model, or its learning curve over one
+    parameter or over the training rows
+    """
+    import pandas as pd
+
+    from .models import MODELS
+    from .trials import TrialStore
+
+    store = TrialStore(args.db)
+    model = type(MODELS[args.model].build())
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        if args.curve:
+            print(store.learning_curve(model, args.curve).round(4))
+        else:
+            results = store.results(model).drop(columns="data")
+            print(results.sort_values("score", ascending=False).head(args.top))
+    store.close()
+
+
+def synth(args):
+    """
+    Write a csv of seeded synthetic applications
+    """
+    from .synthetic import write_csv
+
+    write_csv(args.out, args.rows, args.seed, args.chunk_rows)
+
+
+def _job_line(queue, job):
+    spec = json.loads(job["spec"])
+    progress = queue.progress(job)
+    line = "{} {:9s} {} {} p{} {}/{}".format(
+        job["id"],
+        job["status"],
+        job["kind"],
+        spec.get("model"),
+        job["priority"],
+        job["completed"],
+        job["total"] or "?",
+    )
+    if job["status"] == "running" and job["worker"]:
+        line += " on " + job["worker"]
+    if job["best_score"] is not None:
+        line += " best {:.4f}".format(job["best_score"])
+    if progress["eta"] is not None:
+        line += " eta {:.0f}s".format(progress["eta"])
+    if job["result"]:
+        line += " -> " + job["result"]
+    return line
+
+
+def _add_sample_arguments(sub, strategy=True):
+    if strategy:
+        sub.add_argument(
+            "--sample",
+            choices=SAMPLING_STRATEGIES,
+            help="grid search on a sample of the training rows",
+        )
+    sub.add_argument(
+        "--sample-size", type=float, default=0.2, help="fraction or number of rows"
+    )
+    sub.add_argument(
+        "--sample-ratio", type=float, default=1.0, help="undersampled majority ratio"
+    )
+
+
+def _write_profile(profiler, args):
+    """
+    Write or print the cProfile statistics or the sampled stacks of the
+    profiled stage
+    """
+    stage = args.profile_stage
+    if args.profile_mode == "cprofile":
+        if stage not in profiler.profiles:
+            print("stage {} did not run".format(stage), file=sys.stderr)
+        elif args.profile_out:
+            profiler.profiles[stage].dump_stats(args.profile_out)
+        else:
+            profiler.profiles[stage].stream = sys.stderr
+            profiler.profiles[stage].sort_stats("cumulative").print_stats(20)
+    elif not profiler.samples:
+        print("no samples of stage {}".format(stage), file=sys.stderr)
+    elif args.profile_out:
+        profiler.write_folded(args.profile_out)
+    else:
+        for stack, count in profiler.samples.most_common(10):
+            print(count, stack, file=sys.stderr)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="easyvisa", description=__doc__.split("\n")[1]
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="print per-stage timings at exit"
+    )
+    parser.add_argument("--trace", help="write a Chrome trace of the run to this file")
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="trace the peak memory of every stage with tracemalloc (slower)",
+    )
+    parser.add_argument("--profile-stage", help="profile every run of this stage")
+    parser.add_argument(
+        "--profile-mode",
+        choices=["cprofile", "sample"],
+        default="cprofile",
+        help="deterministic profiling or stack sampling of --profile-stage",
+    )
+    parser.add_argument(
+        "--profile-out",
+        help="write the profile of --profile-stage to this file, pstats "
+        "(cprofile) or folded stacks (sample); printed by default",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name, handler, summary in [
+        ("train", train, "fit models with the notebook's or tuned parameters"),
+        ("tune", tune, "grid search hyperparameters and save the best models"),
+    ]:
+        sub = subparsers.add_parser(name, help=summary)
+        sub.add_argument("--data", required=True, help="EasyVisa csv file")
+        sub.add_argument("--out", default="artifacts", help="artifact directory")
+        sub.add_argument("--models", nargs="+", default=DEFAULT_MODELS)
+        sub.add_argument(
+            "--extras", nargs="+", help="high-cardinality columns one-hot encoded"
+        )
+        sub.add_argument(
+            "--max-categories", type=int, default=1000, help="vocabulary per extra"
+        )
+        sub.add_argument(
+            "--min-frequency", type=int, default=5, help="rows per vocabulary value"
+        )
+        sub.add_argument("--hash-buckets", type=int, help="hash the extras instead")
+        sub.add_argument(
+            "--encoding",
+            choices=["onehot", "target"],
+            default="onehot",
+            help="dummies or out-of-fold certification rates of the categories",
+        )
+        sub.set_defaults(handler=handler)
+    subparsers.choices["tune"].add_argument("--n-jobs", type=int)
+    subparsers.choices["tune"].add_argument(
+        "--trials", help="SQLite store of fold scores reused by the searches"
+    )
+    subparsers.choices["train"].add_argument(
+        "--memory-budget",
+        type=float,
+        help="MiB for fitting each forest or bagging model, trees capped to fit",
+    )
+    _add_sample_arguments(subparsers.choices["tune"])
+
+    sub = subparsers.add_parser("run", help="run the pipeline with checkpoints")
+    sub.add_argument("--data", required=True, help="EasyVisa csv file")
+    sub.add_argument("--checkpoints", default="checkpoints", help="stage outputs")
+    sub.add_argument("--models", nargs="+", help="models to tune, all by default")
+    sub.add_argument("--no-stack", action="store_true", help="skip the stacking fit")
+    sub.add_argument("--n-jobs", type=int, help="n_jobs of every grid search")
+    sub.add_argument("--until", help="last stage to run")
+    sub.add_argument("--force", nargs="+", default=[], help="stages to recompute")
+    sub.add_argument("--dedup", action="store_true", help="drop duplicate cases")
+    sub.add_argument("--trials", help="SQLite store of fold scores to reuse")
+    _add_sample_arguments(sub)
+    sub.set_defaults(handler=run)
+
+    sub = subparsers.add_parser("dedup", help="drop duplicate applications")
+    sub.add_argument("--data", required=True, help="EasyVisa csv file")
+    sub.add_argument("--out", required=True, help="deduplicated csv")
+    sub.add_argument("--chunksize", type=int, default=1000000, help="rows per read")
+    sub.add_argument(
+        "--collapse", action="store_true", help="add a count of submissions"
+    )
+    sub.add_argument("--near", action="store_true", help="count near-duplicates")
+    sub.set_defaults(handler=dedup)
+
+    sub = subparsers.add_parser("compare", help="cross-validated model comparison")
+    sub.add_argument("--data", required=True, help="EasyVisa csv file")
+    sub.add_argument("--models", nargs="+", default=list(DEFAULT_MODELS))
+    sub.add_argument("--params", help="artifact directory with tuned parameters")
+    sub.add_argument("--splits", type=int, default=5)
+    sub.add_argument("--repeats", type=int, default=3)
+    sub.add_argument("--n-jobs", type=int, default=-1)
+    sub.add_argument("--cache", help="directory of cached fold models")
+    sub.set_defaults(handler=compare)
+
+    sub = subparsers.add_parser("calibrate", help="calibrate the saved models")
+    sub.add_argument("--data", required=True, help="EasyVisa csv file")
+    sub.add_argument("--models-dir", default="artifacts")
+    sub.add_argument("--method", choices=["isotonic", "platt"], default="isotonic")
+    sub.set_defaults(handler=calibrate)
+
+    sub = subparsers.add_parser("compact", help="prune and quantize tree ensembles")
+    sub.add_argument("--data", required=True, help="EasyVisa csv file")
+    sub.add_argument("--models-dir", default="artifacts")
+    sub.add_argument("--models", nargs="+", default=COMPACT_MODELS)
+    sub.add_argument(
+        "--tolerance", type=float, default=1e-3, help="largest probability change"
+    )
+    sub.set_defaults(handler=compact)
+
+    sub = subparsers.add_parser("stack", help="fit the stacking classifier")
+    sub.add_argument("--data", required=True, help="EasyVisa csv file")
+    sub.add_argument("--models-dir", default="artifacts")
+    sub.set_defaults(handler=stack)
+
+    sub = subparsers.add_parser("cascade", help="evaluate a fast -> slow cascade")
+    sub.add_argument("--data", required=True, help="EasyVisa csv file")
+    sub.add_argument("--fast", required=True, help="artifact of the cheap model")
+    sub.add_argument("--slow", required=True, help="artifact of the ensemble")
+    sub.add_argument(
+        "--band",
+        nargs=2,
+        type=float,
+        action="append",
+        metavar=("LOW", "HIGH"),
+        help="uncertainty band escalated to the ensemble, repeatable",
+    )
+    sub.add_argument("--save", help="save the cascade with the first band here")
+    sub.set_defaults(handler=cascade)
+
+    sub = subparsers.add_parser("sampling", help="tune on samples vs. full data")
+    sub.add_argument("--data", required=True, help="EasyVisa csv file")
+    sub.add_argument("--models", nargs="+", default=DEFAULT_MODELS)
+    sub.add_argument(
+        "--strategies",
+        nargs="+",
+        choices=SAMPLING_STRATEGIES,
+        default=SAMPLING_STRATEGIES,
+    )
+    sub.add_argument("--n-jobs", type=int)
+    _add_sample_arguments(sub, strategy=False)
+    sub.set_defaults(handler=sampling)
+
+    sub = subparsers.add_parser("jobs", help="queue long tuning and training runs")
+    sub.add_argument("--db", default="jobs.sqlite", help="SQLite job queue")
+    actions = sub.add_subparsers(dest="action", required=True)
+    action = actions.add_parser("submit", help="queue a job per model")
+    action.add_argument("--data", required=True, help="EasyVisa csv file")
+    action.add_argument("--out", default="artifacts", help="artifact directory")
+    action.add_argument("--models", nargs="+", default=DEFAULT_MODELS)
+    action.add_argument("--kind", choices=["tune", "train"], default="tune")
+    action.add_argument("--priority", type=int, default=0, help="higher runs first")
+    action.add_argument("--n-jobs", type=int)
+    action.add_argument("--trials", help="SQLite store of fold scores to reuse")
+    _add_sample_arguments(action)
+    action = actions.add_parser("worker", help="run queued jobs")
+    action.add_argument("--once", action="store_true", help="stop when idle")
+    action.add_argument("--poll", type=float, default=1.0, help="seconds when idle")
+    action.add_argument(
+        "--recover", action="store_true", help="requeue jobs of dead workers"
+    )
+    action.add_argument(
+        "--stale",
+        type=float,
+        default=60.0,
+        help="seconds without a heartbeat after which a worker is dead",
+    )
+    action = actions.add_parser("list", help="list the jobs")
+    action.add_argument("--status", choices=JOB_STATUSES)
+    action = actions.add_parser("status", help="show a job and its candidates")
+    action.add_argument("job", type=int)
+    action = actions.add_parser("cancel", help="cancel jobs")
+    action.add_argument("jobs", type=int, nargs="+")
+    action = actions.add_parser("watch", help="follow the progress of a job")
+    action.add_argument("job", type=int)
+    action.add_argument("--interval", type=float, default=1.0)
+    sub.set_defaults(handler=jobs)
+
+    sub = subparsers.add_parser("trials", help="stored trials and learning curves")
+    sub.add_argument("--db", default="trials.sqlite", help="SQLite trial store")
+    sub.add_argument("--model", required=True, help="key of the model grid")
+    sub.add_argument("--curve", help="parameter, or n_train, of a learning curve")
+    sub.add_argument("--top", type=int, default=20, help="best trials listed")
+    sub.set_defaults(handler=trials)
+
+    sub = subparsers.add_parser("synth", help="write synthetic applications")
+    sub.add_argument("--out", required=True, help="output csv file")
+    sub.add_argument("--rows", type=int, default=25480)
+    sub.add_argument("--seed", type=int, default=0)
+    sub.add_argument("--chunk-rows", type=int, default=1000000)
+    sub.set_defaults(handler=synth)
+
+    sub = subparsers.add_parser("score", help="score applications with a saved model")
+    sub.add_argument("--model", required=True, help="artifact written by train/tune")
+    sub.add_argument("--data", required=True, help="csv of applications")
+    sub.add_argument("--out", help="output csv, standard output by default")
+    sub.add_argument("--threshold", type=float, default=0.5)
+    sub.add_argument(
+        "--reasons", type=int, default=0, help="reason codes attached to every case"
+    )
+    sub.add_argument(
+        "--cache-size", type=int, default=0, help="entries of a prediction cache"
+    )
+    sub.add_argument(
+        "--wage-bucket", type=float, help="annual wage width shared by a key"
+    )
+    sub.add_argument(
+        "--ipc",
+        action="store_true",
+        help="data and output are Arrow IPC streams, - for standard input",
+    )
+    sub.set_defaults(handler=score)
+
+    sub = subparsers.add_parser("batch", help="score a large csv on every core")
+    sub.add_argument("--model", required=True, help="artifact written by train/tune")
+    sub.add_argument("--data", required=True, help="csv of applications")
+    sub.add_argument("--out", required=True, help="output Parquet file")
+    sub.add_argument("--threshold", type=float, default=0.5)
+    sub.add_argument("--processes", type=int, help="worker processes, all CPUs")
+    sub.add_argument("--chunk-rows", type=int, default=65536)
+    sub.set_defaults(handler=batch)
+
+    sub = subparsers.add_parser("report", help="compare the saved models")
+    sub.add_argument("--data", required=True, help="EasyVisa csv file")
+    sub.add_argument("--models-dir", default="artifacts")
+    sub.add_argument("--plot", help="write a feature importance plot to this file")
+    sub.add_argument("--plot-model", help="model whose importances are plotted")
+    sub.set_defaults(handler=report)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    recording = args.profile or args.trace or args.profile_stage
+    if recording:
+        from .profiling import PROFILER
+
+        PROFILER.enable(track_memory=args.profile_memory)
+        if args.profile_stage:
+            PROFILER.profile(args.profile_stage, args.profile_mode)
+    args.handler(args)
+    if recording:
+        if args.profile_stage:
+            _write_profile(PROFILER, args)
+        if args.trace:
+            PROFILER.chrome_trace(args.trace)
+        if args.profile:
+            print(PROFILER.summary().to_string(), file=sys.stderr)
+            for name, value in sorted(PROFILER.counters.items()):
+                print("{:<32} {}".format(name, value), file=sys.stderr)
@@ -0,0 +1,388 @@
+"""
+Pruned and quantized flat-array copies of the tree ensembles for serving
+"""
+
+import pickle
+import time
+
+import numpy as np
+
+from .profiling import stage
+
+# nodes (rows x trees) walked at once by CompactForest
+CHUNK_CELLS = 1 << 22
+# probabilities of the init estimator of gradient boosting are clipped to
+# [EPS, 1 - EPS] before taking the log-odds, as sklearn does
+EPS = np.finfo(np.float64).eps
+
+
+def _trees(model):
+    """
+    (tree, output of every leaf, design matrix column of every tree
+    feature or None) of the trees of a model, with the link turning the
+    sum of the leaf outputs into the probability of certification and the
+    init estimator of gradient boosting
+    """
+    from sklearn.ensemble import (
+        AdaBoostClassifier,
+        BaggingClassifier,
+        GradientBoostingClassifier,
+        RandomForestClassifier,
+    )
+    from sklearn.tree import DecisionTreeClassifier
+
+    def proba(tree):
+        value = tree.value[:, 0, :]
+        return value[:, 1] / value.sum(axis=1)
+
+    def all_trees(estimators):
+        return all(isinstance(e, DecisionTreeClassifier) for e in estimators)
+
+    if isinstance(model, DecisionTreeClassifier):
+        return [(model.tree_, proba(model.tree_), None)], "identity", None
+    if isinstance(model, RandomForestClassifier):
+        n = len(model.estimators_)
+        trees = [(e.tree_, proba(e.tree_) / n, None) for e in model.estimators_]
+        return trees, "identity", None
+    if isinstance(model, BaggingClassifier) and all_trees(model.estimators_):
+        n = len(model.estimators_)
+        trees = [
+            (e.tree_, proba(e.tree_) / n, features)
+            for e, features in zip(model.estimators_, model.estimators_features_)
+        ]
+        return trees, "identity", None
+    if isinstance(model, AdaBoostClassifier) and all_trees(model.estimators_):
+        # binary SAMME: the decision function sums 2 w / sum(w) times the
+        # +-1 vote of every tree, and the probability is its sigmoid
+        weights = 2 * model.estimator_weights_ / model.estimator_weights_.sum()
+        trees = [
+            (e.tree_, np.where(e.tree_.value[:, 0, :].argmax(axis=1) == 1, w, -w), None)
+            for e, w in zip(model.estimators_, weights)
+        ]
+        return trees, "logistic", None
+    if isinstance(model, GradientBoostingClassifier):
+        rate = model.learning_rate
+        trees = [
+            (e.tree_, e.tree_.value[:, 0, 0] * rate, None)
+            for e in model.estimators_[:, 0]
+        ]
+        if isinstance(model.init_, str):
+            init = 0.0
+        elif type(model.init_).__name__ == "DummyClassifier":
+            init = _logit(model.init_.predict_proba(np.zeros((1, 1)))[0, 1])
+        else:
+            init = model.init_
+        return trees, "logistic", init
+    raise TypeError("cannot compact {}".format(type(model).__name__))
+
+
+def _logit(p):
+    p = np.clip(p, EPS, 1 - EPS)
+    return np.log(p / (1 - p))
+
+
+def _levels(left, right, leaf):
+    """
+    Node ids of a tree level by level from the root, not descending below
+    the nodes marked as leaves
+    """
+    levels = []
+    level = np.array([0])
+    while len(level):
+        levels.append(level)
+        inner = level[~leaf[level]]
+        level = np.concatenate([left[inner], right[inner]])
+    return levels
+
+
+def _prune(tree, value, tolerance):
+    """
+    Leaf mask and node outputs of a tree once every split whose two leaves
+    differ by at most tolerance is collapsed, bottom-up
+
+    The output of a collapsed split is the mean of its leaves weighted by
+    their training samples.
+    """
+    left, right = tree.children_left, tree.children_right
+    weight = tree.weighted_n_node_samples
+    value = np.asarray(value, dtype=np.float64).copy()
+    leaf = left == -1
+    for level in reversed(_levels(left, right, leaf)):
+        inner = level[~leaf[level]]
+        l, r = left[inner], right[inner]
+        total = weight[l] + weight[r]
+        value[inner] = np.where(
+            total > 0,
+            (weight[l] * value[l] + weight[r] * value[r]) / np.maximum(total, 1e-300),
+            (value[l] + value[r]) / 2,
+        )
+        collapse = leaf[l] & leaf[r] & (np.abs(value[l] - value[r]) <= tolerance)
+        leaf[inner[collapse]] = True
+    return leaf, value
+
+
+def _float32_below(threshold):
+    """
+    Largest float32 at or below every threshold
+
+    sklearn sends a row left when x <= threshold, with thresholds halfway
+    between two float32 training values a < b; the float32 just below the
+    midpoint lies in [a, b), so the split of any float32 input is unchanged.
+    """
+    rounded = threshold.astype(np.float32)
+    above = rounded > threshold
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+    return rounded
+
+
+class CompactForest:
+    """
+    Tree ensemble flattened into four numpy arrays, scored with numpy only
+
+    Node i splits on feature[i] at the float32 threshold[i] and continues
+    to child[i] when x <= threshold[i] or to child[i] + 1 otherwise;
+    siblings are stored next to each other. Leaves point to themselves
+    with an infinite threshold and hold an int16 output, value[i] * scale.
+    At 11 to 12 bytes per node against 80 for an sklearn tree, and with
+    no sklearn import when it is unpickled, a compacted model loads and
+    scores in a fraction of the memory and start-up time of the original.
+    """
+
+    def __init__(self, trees, link, init, classes, n_features, prune=0.0):
+        """
+        trees: list of (tree, leaf outputs, columns) as returned by _trees
+        link: "identity" when the leaf outputs sum to the probability of
+            certification, "logistic" when they sum to its log-odds
+        init: log-odds added to every row, either a constant or a
+            CompactForest whose probabilities are turned into log-odds
+        classes: classes_ of the model
+        n_features: number of design matrix columns
+        prune: largest difference between the two leaves of a split
+            collapsed into one leaf, in units of the leaf outputs
+        """
+        self.link = link
+        self.init = init
+        self.classes_ = np.asarray(classes)
+        self.n_features_in_ = n_features
+        self.bias = 0.0
+        self.depth = 0
+        dtype = np.uint8 if n_features <= np.iinfo(np.uint8).max else np.int16
+        feature, threshold, child, value, roots = [], [], [], [], []
+        offset = 0
+        for tree, output, columns in trees:
+            leaf, output = _prune(tree, output, prune)
+            if leaf[0]:
+                self.bias += output[0]
+                continue
+            levels = _levels(tree.children_left, tree.children_right, leaf)
+            old = np.concatenate(levels)
+            position = np.full(tree.node_count, -1, dtype=np.int64)
+            position[old] = np.arange(len(old))
+            # children of a level are laid out pair by pair, left then right
+            for level in levels:
+                inner = level[~leaf[level]]
+                pairs = np.stack(
+                    [tree.children_left[inner], tree.children_right[inner]], axis=1
+                )
+                start = position[pairs[:, 0]].min() if len(inner) else 0
+                position[pairs.ravel()] = start + np.arange(pairs.size)
+            old = old[np.argsort(position[old])]
+            is_leaf = leaf[old]
+            columns = np.arange(n_features) if columns is None else columns
+            feature.append(np.where(is_leaf, 0, columns[tree.feature[old]]))
+            threshold.append(
+                np.where(is_leaf, np.inf, _float32_below(tree.threshold[old]))
+            )
+            child.append(
+                offset
+                + np.where(
+                    is_leaf,
+                    np.arange(len(old)),
+                    position[np.maximum(tree.children_left[old], 0)],
+                )
+            )
+            value.append(np.where(is_leaf, output[old], 0.0))
+            roots.append(offset)
+            offset += len(old)
+            self.depth = max(self.depth, len(levels) - 1)
+        value = np.concatenate(value) if value else np.zeros(0)
+        largest = np.abs(value).max() if len(value) else 0.0
+        self.scale = largest / np.iinfo(np.int16).max if largest > 0 else 1.0
+        self.feature = np.concatenate(feature or [np.zeros(0)]).astype(dtype)
+        self.threshold = np.concatenate(threshold or [np.zeros(0)]).astype(np.float32)
+        self.child = np.concatenate(child or [np.zeros(0)]).astype(np.int32)
+        self.value = np.round(value / self.scale).astype(np.int16)
+        self.roots = np.array(roots, dtype=np.int32)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.child)
+
+    @property
+    def nbytes(self):
+        """
+        Bytes held by the node arrays, those of the init estimator included
+        """
+        arrays = [self.feature, self.threshold, self.child, self.value, self.roots]
+        nbytes = sum(array.nbytes for array in arrays)
+        if isinstance(self.init, CompactForest):
+            nbytes += self.init.nbytes
+        return nbytes
+
+    def raw(self, X):
+        """
+        Sum of the tree outputs of every row, before the link
+
+        X: design matrix
+        """
+        X = np.asarray(X, dtype=np.float32)
+        n_features = X.shape[1]
+        raw = np.full(len(X), self.bias)
+        if self.n_trees:
+            chunk = max(1, CHUNK_CELLS // self.n_trees)
+            for start in range(0, len(X), chunk):
+                rows = slice(start, min(start + chunk, len(X)))
+                flat = np.ascontiguousarray(X[rows]).ravel()
+                n_rows = len(flat) // n_features
+                # one entry per (row, tree) still walking down; once most of
+                # them rest on a leaf, the outputs of those are added to their
+                # rows and they are dropped
+                row = np.repeat(np.arange(n_rows), self.n_trees)
+                offset = row * n_features
+                node = np.tile(self.roots, n_rows)
+                totals = np.zeros(n_rows)
+                for step in range(self.depth):
+                    x = flat[offset + self.feature[node]]
+                    node = self.child[node] + (x > self.threshold[node])
+                    if step % 4 == 3:
+                        done = self.threshold[node] == np.inf
+                        if 2 * done.sum() > len(node):
+                            totals += np.bincount(
+                                row[done], self.value[node[done]], minlength=n_rows
+                            )
+                            walking = ~done
+                            row = row[walking]
+                            offset = offset[walking]
+                            node = node[walking]
+                totals += np.bincount(row, self.value[node], minlength=n_rows)
+                raw[rows] += totals * self.scale
+        if isinstance(self.init, CompactForest):
+            raw += _logit(self.init.predict_proba(X)[:, 1])
+        elif self.init is not None:
+            raw += self.init
+        return raw
+
+    def predict_proba(self, X):
+        """
+        Class probabilities of every row, as the compacted model's
+
+        X: design matrix
+        """
+        with stage("compact_predict", rows=len(X)):
+            raw = self.raw(X)
+            if self.link == "logistic":
+                proba = 1 / (1 + np.exp(-raw))
+            else:
+                proba = np.clip(raw, 0, 1)
+        return np.column_stack([1 - proba, proba])
+
+    def predict(self, X):
+        """
+        Predicted class of every row
+
+        X: design matrix
+        """
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    def __repr__(self):
+        return "CompactForest(trees={}, nodes={}, nbytes={})".format(
+            self.n_trees, self.n_nodes, self.nbytes
+        )
+
+
+def _compact(model, prune):
+    trees, link, init = _trees(model)
+    if init is not None and not isinstance(init, float):
+        init = _compact(init, prune)
+    return CompactForest(trees, link, init, model.classes_, model.n_features_in_, prune)
+
+
+def compact(model, X, tolerance=1e-3):
+    """
+    Pruned, quantized copy of a fitted tree ensemble whose probabilities of
+    certification differ from the model's by at most tolerance on X
+
+    Splits are first collapsed when their leaves differ by up to tolerance;
+    the pruning threshold is halved until the copy is within tolerance, down
+    to no pruning at all. The largest difference found is kept as
+    max_error.
+
+    model: fitted DecisionTree, RandomForest, Bagging (of trees), AdaBoost
+        (of trees) or GradientBoosting classifier
+    X: design matrix the predictions are compared on, for example the
+        test rows
+    tolerance: largest allowed change of a probability
+    """
+    with stage("compact", rows=len(X)):
+        reference = model.predict_proba(X)[:, 1]
+        prune = tolerance
+        while True:
+            compacted = _compact(model, prune)
+            error = np.abs(compacted.predict_proba(X)[:, 1] - reference).max()
+            if error <= tolerance:
+                break
+            if prune == 0:
+                raise ValueError(
+                    "quantization alone changes the probabilities by {:.3g}, "
+                    "more than the tolerance {:.3g}".format(error, tolerance)
+                )
+            prune = prune / 2 if prune > tolerance / 1024 else 0.0
+    compacted.max_error = error
+    return compacted
+
+
+def _best_time(predict, X, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        predict(X)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def compaction_report(model, compacted, X):
+    """
+    Trees, nodes, pickled size and prediction latency of a model and of its
+    compacted copy, with the savings
+
+    model: fitted tree ensemble
+    compacted: CompactForest returned by compact(model, ...)
+    X: design matrix the latency is measured on
+    """
+    import pandas as pd
+
+    trees, _, _ = _trees(model)
+    report = pd.DataFrame(
+        {
+            "original": {
+                "trees": len(trees),
+                "nodes": sum(tree.node_count for tree, _, _ in trees),
+                "bytes": len(pickle.dumps(model, protocol=5)),
+                "seconds": _best_time(model.predict_proba, X),
+            },
+            "compact": {
+                "trees": compacted.n_trees,
+                "nodes": compacted.n_nodes,
+                "bytes": len(pickle.dumps(compacted, protocol=5)),
+                "seconds": _best_time(compacted.predict_proba, X),
+            },
+        }
+    ).T
+    report["max_error"] = [0.0, compacted.max_error]
+    report["saving"] = 1 - report["bytes"] / report.loc["original", "bytes"]
+    report["speedup"] = report.loc["original", "seconds"] / report["seconds"]
+    return report
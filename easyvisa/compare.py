@@ -0,0 +1,231 @@
+"""
+Cross-validated model comparison with confidence intervals and paired tests
+"""
+
+import contextlib
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from .profiling import stage
+
+METRICS = ["Accuracy", "Recall", "Precision", "F1"]
+COSTS = ["fit_time", "predict_time"]
+
+
+def _fit_fold(estimator, X, y, train, test, path):
+    """
+    Fit one model on one fold and score it on the held-out part, reusing
+    the fitted model cached at path when there is one
+    """
+    import joblib
+    from sklearn.base import clone
+    from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score
+
+    if path is not None and os.path.exists(path):
+        model, fit_time = joblib.load(path)
+    else:
+        model = clone(estimator)
+        start = time.perf_counter()
+        model.fit(X[train], y[train])
+        fit_time = time.perf_counter() - start
+        if path is not None:
+            joblib.dump((model, fit_time), path)
+    start = time.perf_counter()
+    proba = model.predict_proba(X[test])[:, 1]
+    predict_time = time.perf_counter() - start
+    pred = (proba > 0.5).astype(np.uint8)
+    scores = {
+        "Accuracy": accuracy_score(y[test], pred),
+        "Recall": recall_score(y[test], pred),
+        "Precision": precision_score(y[test], pred),
+        "F1": f1_score(y[test], pred),
+        "fit_time": fit_time,
+        "predict_time": predict_time,
+    }
+    return scores, proba
+
+
+class ModelComparison:
+    """
+    Scores of several models over the same repeated stratified K-fold
+
+    All models see identical folds, so their per-fold scores are paired.
+    Confidence intervals and tests use the corrected resampled t statistic
+    of Nadeau and Bengio, which accounts for the overlap of training sets
+    between folds and is far less optimistic than a plain t-test.
+    """
+
+    def __init__(self, scores, oof_proba, folds, n_splits):
+        """
+        scores: dataframe with one row per (model, fold)
+        oof_proba: dict of model name to an (n_repeats, n_rows) array of
+            out-of-fold probabilities of certification, NaN outside the folds
+        folds: list of Split
+        n_splits: number of folds per repeat
+        """
+        self.scores = scores
+        self.oof_proba = oof_proba
+        self.folds = folds
+        self.n_splits = n_splits
+
+    def _correction(self):
+        n_test = len(self.folds[0].test)
+        n_train = len(self.folds[0].train)
+        return 1 / len(self.folds) + n_test / n_train
+
+    def summary(self, confidence=0.95):
+        """
+        Mean and confidence interval half-width of every metric and cost
+
+        confidence: confidence level of the intervals
+        """
+        from scipy import stats
+
+        k = len(self.folds)
+        t = stats.t.ppf((1 + confidence) / 2, k - 1)
+        grouped = self.scores.groupby("model", sort=False)[METRICS + COSTS]
+        mean = grouped.mean()
+        half_width = t * np.sqrt(grouped.var(ddof=1) * self._correction())
+        return pd.concat({"mean": mean, "ci": half_width}, axis=1).swaplevel(axis=1)[
+            METRICS + COSTS
+        ]
+
+    def paired_tests(self, metric="F1"):
+        """
+        Corrected paired t-test of the best model against every other one
+
+        metric: metric used to pick the best model
+        """
+        from scipy import stats
+
+        table = self.scores.pivot(index="fold", columns="model", values=metric)
+        best = table.mean().idxmax()
+        k = len(self.folds)
+        rows = {}
+        for model in table.columns:
+            diff = table[best] - table[model]
+            variance = diff.var(ddof=1) * self._correction()
+            if model == best:
+                statistic, p_value = np.nan, np.nan
+            elif variance > 0:
+                statistic = diff.mean() / np.sqrt(variance)
+                p_value = 2 * stats.t.sf(np.abs(statistic), k - 1)
+            elif diff.mean() == 0:
+                # identical fold scores: a tie, not a difference
+                statistic, p_value = 0.0, 1.0
+            else:
+                # the same non-zero difference on every fold
+                statistic, p_value = np.inf, 0.0
+            rows[model] = {
+                "difference": diff.mean(),
+                "t": statistic,
+                "p_value": p_value,
+            }
+        tests = pd.DataFrame(rows).T
+        tests.attrs["best"] = best
+        return tests
+
+    def best(self, metric="F1", alpha=0.05):
+        """
+        Best model by mean metric, and the models not significantly worse
+
+        metric: metric to maximize
+        alpha: significance level of the paired tests
+        """
+        tests = self.paired_tests(metric)
+        tied = tests.index[~(tests["p_value"] < alpha)].tolist()
+        return tests.attrs["best"], [m for m in tied if m != tests.attrs["best"]]
+
+
+def compare_models(
+    store,
+    estimators,
+    splitter=None,
+    n_splits=5,
+    n_repeats=3,
+    random_state=1,
+    n_jobs=-1,
+    cache_dir=None,
+):
+    """
+    Evaluate every model on every fold in parallel
+
+    Each (model, fold) pair is one task of a joblib pool, so the scheduler
+    balances slow and fast models across the cores; the design matrix is
+    memory-mapped into the workers rather than copied. With n_jobs=-1 the
+    pool's processes and their threads are reserved with
+    resources.reservation from the memory of the most expensive model's
+    fit on the first fold, alongside the other searches on the machine. Fitted fold models
+    are cached under cache_dir keyed on the estimator, the data and the
+    fold, so reruns and overlapping comparisons only fit what is new.
+
+    store: FeatureStore with a target
+    estimators: dict of model name to unfitted estimator
+    splitter: Splitter of the store, whose folds over the holdout training
+        rows are reused; a new one by default
+    n_splits: number of folds
+    n_repeats: number of times the K-fold is repeated
+    random_state: seed of the folds
+    n_jobs: number of parallel tasks, -1 to size the pool from the memory
+        and CPUs left
+    cache_dir: directory of fitted fold models, no caching by default
+    """
+    import joblib
+    from joblib import Parallel, delayed
+
+    from .resources import cpu_count, fit_memory, reservation, with_threads
+    from .split import Splitter
+
+    splitter = splitter or Splitter(store)
+    folds = splitter.folds(n_splits, n_repeats, random_state)
+    X, y = store.design_matrix(), store.target
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        data = store.fingerprint()
+
+    schedule = contextlib.nullcontext({"processes": n_jobs, "threads": 1})
+    if n_jobs == -1:
+        fit_bytes = 0
+        if cpu_count() > 1:
+            fit_bytes = max(
+                fit_memory(estimator, X, y, folds[0].train)
+                for estimator in estimators.values()
+            )
+        schedule = reservation(fit_bytes, len(estimators) * len(folds))
+
+    with schedule as plan:
+        tasks = []
+        for name, estimator in estimators.items():
+            # parallel folds must not oversubscribe the cores
+            estimator = with_threads(estimator, plan["threads"])
+            for i, fold in enumerate(folds):
+                path = None
+                if cache_dir is not None:
+                    key = joblib.hash((estimator, data, fold.train))
+                    path = os.path.join(cache_dir, key + ".joblib")
+                tasks.append(
+                    (
+                        name,
+                        i,
+                        delayed(_fit_fold)(
+                            estimator, X, y, fold.train, fold.test, path
+                        ),
+                    )
+                )
+
+        with stage("compare", rows=len(folds[0].train) * len(tasks)):
+            results = Parallel(n_jobs=plan["processes"])(task for _, _, task in tasks)
+
+    rows = []
+    oof_proba = {
+        name: np.full((n_repeats, len(store)), np.nan, dtype=np.float32)
+        for name in estimators
+    }
+    for (name, i, _), (scores, proba) in zip(tasks, results):
+        rows.append(dict(scores, model=name, fold=i))
+        oof_proba[name][i // n_splits, folds[i].test] = proba
+    scores = pd.DataFrame(rows)[["model", "fold"] + METRICS + COSTS]
+    return ModelComparison(scores, oof_proba, folds, n_splits)
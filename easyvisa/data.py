@@ -0,0 +1,44 @@
+"""
+Loading and cleaning of the EasyVisa applications
+"""
+
+import numpy as np
+
+from .profiling import timed
+from .schema import CATEGORIES, FLAGS, ID_COLUMN, NUMERIC, POSITIVE_CLASS, TARGET
+
+
+def _rows(result):
+    # read_csv returns a chunk iterator when given a chunksize
+    return len(result) if hasattr(result, "__len__") else None
+
+
+@timed("load", rows=_rows)
+def load_visa(path, **kwargs):
+    """
+    Read the EasyVisa csv with compact dtypes
+
+    path: location of the csv file
+    kwargs: passed on to pd.read_csv, chunksize for an iterator of chunks
+    """
+    import pandas as pd
+
+    dtype = {column: "category" for column in list(CATEGORIES) + FLAGS}
+    dtype.update(NUMERIC)
+    dtype.update(kwargs.pop("dtype", {}))
+    return pd.read_csv(path, dtype=dtype, **kwargs)
+
+
+@timed("clean", rows=len)
+def clean(data):
+    """
+    Apply the notebook's cleaning steps and return a new dataframe
+
+    data: dataframe as read by load_visa
+    """
+    data = data.drop(columns=[ID_COLUMN], errors="ignore")
+    # taking the absolute values for number of employees
+    data["no_of_employees"] = np.abs(data["no_of_employees"])
+    if TARGET in data:
+        data[TARGET] = (data[TARGET] == POSITIVE_CLASS).astype(np.uint8)
+    return data
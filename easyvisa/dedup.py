@@ -0,0 +1,144 @@
+"""
+Detection of duplicate and near-duplicate applications
+"""
+
+import numpy as np
+
+from .profiling import stage
+from .schema import CATEGORIES, FLAGS, ID_COLUMN
+
+# columns that identify an employer's application apart from the wage and
+# the head count, which resubmissions tend to revise slightly
+BLOCK_COLUMNS = list(CATEGORIES) + FLAGS + ["yr_of_estab"]
+
+
+def row_hashes(data):
+    """
+    64-bit hash of every row over all columns but case_id
+
+    The values, not the category codes, are hashed, so chunks read
+    separately with different category levels hash alike.
+
+    data: dataframe of applications, raw or cleaned
+    """
+    import pandas as pd
+
+    data = data.drop(columns=[ID_COLUMN], errors="ignore")
+    return pd.util.hash_pandas_object(data, index=False).to_numpy()
+
+
+class Deduplicator:
+    """
+    Drops the rows equal to an earlier row, case_id aside, from a stream of
+    dataframe chunks
+
+    Only the sorted distinct row hashes and their counts are kept between
+    chunks, 16 bytes per distinct row (24 when collapsing), so tens of
+    millions of rows go through in chunks of any size.
+    """
+
+    def __init__(self, collapse=False):
+        """
+        collapse: remember the kept rows so that submissions() can count
+            the occurrences of each
+        """
+        self.collapse = collapse
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.rows = 0
+        self._kept = []
+
+    @property
+    def duplicates(self):
+        """
+        Number of rows dropped so far
+        """
+        return self.rows - len(self.keys)
+
+    def partial(self, chunk):
+        """
+        Rows of a chunk not seen before, with their first occurrence kept
+
+        chunk: dataframe of applications
+        """
+        with stage("dedup", rows=len(chunk)):
+            hashes = row_hashes(chunk)
+            unique, first, counts = np.unique(
+                hashes, return_index=True, return_counts=True
+            )
+            position = np.searchsorted(self.keys, unique)
+            seen = position < len(self.keys)
+            seen[seen] = self.keys[position[seen]] == unique[seen]
+            self.counts[position[seen]] += counts[seen]
+            new = ~seen
+            self.keys = np.insert(self.keys, position[new], unique[new])
+            self.counts = np.insert(self.counts, position[new], counts[new])
+            keep = np.sort(first[new])
+            if self.collapse:
+                self._kept.append(hashes[keep])
+            self.rows += len(chunk)
+        return chunk.iloc[keep]
+
+    def submissions(self):
+        """
+        Number of occurrences of every kept row, in the order they were kept
+        """
+        if not self.collapse:
+            raise ValueError("submissions are only counted with collapse=True")
+        kept = np.concatenate(self._kept) if self._kept else self.keys[:0]
+        return self.counts[np.searchsorted(self.keys, kept)]
+
+
+def deduplicate(data, collapse=False):
+    """
+    Drop the rows equal to an earlier row, case_id aside
+
+    data: dataframe of applications
+    collapse: add a column n_submissions with the number of occurrences of
+        every kept row
+    """
+    deduplicator = Deduplicator(collapse)
+    data = deduplicator.partial(data)
+    if collapse:
+        data = data.assign(n_submissions=deduplicator.submissions())
+    return data
+
+
+def near_duplicates(
+    data, wage_tolerance=0.01, employee_tolerance=0.05, window=8, partitions=1
+):
+    """
+    Position of a near-duplicate of every row, -1 for none
+
+    Rows are blocked on BLOCK_COLUMNS and sorted by wage within a block;
+    each row is compared with the window rows before it, and matches one
+    whose wage and number of employees differ by at most the relative
+    tolerances. Exact duplicates match too. Only the hash of the block
+    columns, the wage and the head count are held, and blocks are
+    processed in hash partitions to bound the sorting workspace.
+
+    data: dataframe of applications
+    wage_tolerance: largest relative difference of prevailing_wage
+    employee_tolerance: largest relative difference of no_of_employees
+    window: rows of a block compared with every row
+    partitions: number of block hash partitions processed one at a time
+    """
+    with stage("dedup", rows=len(data)):
+        block = row_hashes(data[BLOCK_COLUMNS])
+        wage = data["prevailing_wage"].to_numpy(dtype=np.float32)
+        employees = np.abs(data["no_of_employees"].to_numpy(dtype=np.float32))
+        match = np.full(len(data), -1, dtype=np.int64)
+        for part in range(partitions):
+            rows = np.flatnonzero(block % np.uint64(partitions) == part)
+            order = rows[np.lexsort((wage[rows], block[rows]))]
+            b, w, e = block[order], wage[order], employees[order]
+            found = np.full(len(order), -1, dtype=np.int64)
+            for k in range(1, window + 1):
+                close = (b[k:] == b[:-k]) & (found[k:] == -1)
+                close &= np.abs(w[k:] - w[:-k]) <= wage_tolerance * w[k:]
+                close &= np.abs(e[k:] - e[:-k]) <= employee_tolerance * np.maximum(
+                    e[k:], e[:-k]
+                )
+                found[k:][close] = order[:-k][close]
+            match[order] = found
+    return match
@@ -0,0 +1,214 @@
+"""
+Data and prediction drift monitoring with streaming histograms
+"""
+
+import numpy as np
+
+from .profiling import stage
+from .schema import CATEGORIES, FEATURES, NUMERIC, TARGET
+
+PREDICTION = "prediction"
+EPSILON = 1e-4
+
+
+class FeatureProfile:
+    """
+    Binned distribution of every feature on the training data
+
+    Category levels and Y/N flags get one bin per code (plus one for
+    unknown levels), numeric columns and predicted probabilities get
+    quantile bins learned from the training rows.
+    """
+
+    def __init__(self, cuts, expected):
+        """
+        cuts: dict of feature name to the interior bin edges of numeric
+            features, None for coded features
+        expected: dict of feature name to the bin proportions
+        """
+        self.cuts = cuts
+        self.expected = expected
+
+    @classmethod
+    def from_store(cls, store, rows=None, proba=None, bins=10):
+        """
+        Profile the training rows of a FeatureStore
+
+        store: FeatureStore
+        rows: index array of the training rows, by default all rows
+        proba: predicted probabilities of certification on those rows
+        bins: number of quantile bins of the numeric features
+        """
+        profile = cls({}, {})
+        for name, values in _columns(store, rows, proba):
+            if name in NUMERIC or name == PREDICTION:
+                quantiles = np.quantile(values, np.linspace(0, 1, bins + 1)[1:-1])
+                profile.cuts[name] = np.unique(quantiles)
+            else:
+                profile.cuts[name] = None
+            counts = np.bincount(
+                profile.bin(name, values), minlength=profile.size(name)
+            )
+            profile.expected[name] = counts / max(counts.sum(), 1)
+        return profile
+
+    def size(self, name):
+        """
+        Number of bins of a feature
+
+        name: feature name
+        """
+        if self.cuts[name] is not None:
+            return len(self.cuts[name]) + 1
+        if name in CATEGORIES:
+            return len(CATEGORIES[name]) + 1
+        return 2
+
+    def bin(self, name, values):
+        """
+        Bin index of every value
+
+        name: feature name
+        values: column of a FeatureStore, or predicted probabilities
+        """
+        if self.cuts[name] is not None:
+            return np.searchsorted(self.cuts[name], values, side="right")
+        # unknown category levels fall in the last bin
+        return np.minimum(values, self.size(name) - 1)
+
+    def save(self, path):
+        """
+        Write the profile to a .npz file
+
+        path: destination file
+        """
+        arrays = {}
+        for name, expected in self.expected.items():
+            arrays["expected__" + name] = expected
+            if self.cuts[name] is not None:
+                arrays["cuts__" + name] = self.cuts[name]
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a profile written by save
+
+        path: .npz file
+        """
+        cuts, expected = {}, {}
+        with np.load(path) as arrays:
+            for key in arrays.files:
+                kind, name = key.split("__", 1)
+                (cuts if kind == "cuts" else expected)[name] = arrays[key]
+        for name in expected:
+            cuts.setdefault(name, None)
+        return cls(cuts, expected)
+
+
+class DriftMonitor:
+    """
+    Streaming comparison of scored batches against a FeatureProfile
+
+    update() only adds bin counts, so the monitor holds one small count
+    array per feature whatever the window length and is cheap enough to
+    run inline in the scoring path. metrics() reports the population
+    stability index (PSI) of every feature and, for the numeric features
+    and the predictions, the Kolmogorov-Smirnov distance between the binned
+    distributions.
+    """
+
+    def __init__(
+        self, profile, psi_threshold=0.2, ks_threshold=0.1, window=None, on_window=None
+    ):
+        """
+        profile: FeatureProfile of the training data
+        psi_threshold: PSI above which a feature is flagged
+        ks_threshold: KS distance above which a feature is flagged
+        window: number of rows after which the window is published and reset
+        on_window: callable receiving the metrics of every full window
+        """
+        self.profile = profile
+        self.psi_threshold = psi_threshold
+        self.ks_threshold = ks_threshold
+        self.window = window
+        self.on_window = on_window
+        self.reset()
+
+    def reset(self):
+        """
+        Start a new window
+        """
+        self.counts = {
+            name: np.zeros(self.profile.size(name), dtype=np.int64)
+            for name in self.profile.expected
+        }
+        self.n_rows = 0
+
+    def update(self, store, proba=None):
+        """
+        Add a scored batch to the current window
+
+        store: FeatureStore of the batch
+        proba: predicted probabilities of certification for the batch
+        """
+        with stage("monitor", rows=len(store)):
+            for name, values in _columns(store, None, proba):
+                if name in self.counts:
+                    self.counts[name] += np.bincount(
+                        self.profile.bin(name, values),
+                        minlength=len(self.counts[name]),
+                    )
+        self.n_rows += len(store)
+        if self.window is not None and self.n_rows >= self.window:
+            if self.on_window is not None:
+                self.on_window(self.metrics())
+            self.reset()
+
+    def metrics(self):
+        """
+        PSI and KS distance of every feature in the current window
+
+        A feature without rows in the window, such as the case status of
+        unlabelled scoring batches, gets NaN metrics and is not flagged.
+        """
+        import pandas as pd
+
+        rows = {}
+        for name, counts in self.counts.items():
+            if not counts.sum():
+                rows[name] = {"psi": np.nan, "ks": np.nan, "rows": 0}
+                continue
+            expected = np.clip(self.profile.expected[name], EPSILON, None)
+            actual = np.clip(counts / max(counts.sum(), 1), EPSILON, None)
+            psi = np.sum((actual - expected) * np.log(actual / expected))
+            ks = np.nan
+            if self.profile.cuts[name] is not None:
+                ks = np.max(np.abs(np.cumsum(actual) - np.cumsum(expected)))
+            rows[name] = {"psi": psi, "ks": ks, "rows": counts.sum()}
+        metrics = pd.DataFrame(rows).T
+        # NaN compares False, so empty features never drift
+        metrics["drift"] = (metrics["psi"] > self.psi_threshold) | (
+            metrics["ks"] > self.ks_threshold
+        )
+        return metrics
+
+    def needs_retrain(self):
+        """
+        Whether any feature in the current window has drifted
+        """
+        return self.n_rows > 0 and bool(self.metrics()["drift"].any())
+
+
+def _columns(store, rows, proba):
+    """
+    Yield (name, values) of every monitored column: the predictors, the
+    case status when known and the predicted probabilities when given
+    """
+    for name in FEATURES:
+        values = store.column(name)
+        yield name, values if rows is None else values[rows]
+    if store.target is not None:
+        yield TARGET, store.target if rows is None else store.target[rows]
+    if proba is not None:
+        yield PREDICTION, np.asarray(proba)
@@ -0,0 +1,168 @@
+"""
+Smoothed target encoding of the categorical predictors, fitted out of fold
+"""
+
+import numpy as np
+
+from .profiling import stage
+from .schema import CATEGORIES, FEATURES
+
+
+def _rates(codes, target, n_codes, prior, smoothing):
+    """
+    Certification rate of every code shrunk towards the prior, the last
+    entry (unseen codes) being the prior itself
+    """
+    counts = np.bincount(codes, minlength=n_codes + 1)[: n_codes + 1]
+    positives = np.bincount(codes, weights=target, minlength=n_codes + 1)
+    rates = (positives[: n_codes + 1] + smoothing * prior) / (counts + smoothing)
+    return rates.astype(np.float32)
+
+
+class TargetEncoder:
+    """
+    Replaces every categorical predictor (continent, education, region,
+    unit of wage) and every extra column by its smoothed certification
+    rate
+
+    The output is a float32 matrix with one column per predictor, in
+    FEATURES order and followed by the extra columns: 10 columns against
+    the 21 of the one-hot design matrix, and one instead of thousands per
+    high-cardinality extra column. A rate is (positives + smoothing *
+    prior) / (count + smoothing) over the training rows with that value;
+    fit_transform encodes the training rows out of fold so that no row
+    sees its own target.
+    """
+
+    def __init__(self, extras=(), smoothing=20.0, n_splits=5, random_state=1):
+        """
+        extras: names of extra categorical columns of the dataframes
+        smoothing: weight of the prior certification rate, in rows
+        n_splits: folds of the out-of-fold encoding of the training rows
+        random_state: seed of the folds
+        """
+        self.columns = list(extras)
+        self.smoothing = smoothing
+        self.n_splits = n_splits
+        self.random_state = random_state
+        self.prior = None
+        self.tables = {}
+        self.vocabularies = {}
+
+    @property
+    def feature_names(self):
+        """
+        Names of the columns of transform()
+        """
+        return FEATURES + self.columns
+
+    def _codes(self, data, store):
+        """
+        Integer code of every row for each encoded column; the codes of an
+        extra column index its vocabulary and those of a categorical
+        predictor its levels, with len(vocabulary) or len(levels) for
+        unseen values (MISSING_CODE in the store)
+        """
+        import pandas as pd
+
+        codes = {}
+        for column in FEATURES:
+            if column in CATEGORIES:
+                values = store.column(column).astype(np.intp)
+                n_levels = len(CATEGORIES[column])
+                codes[column] = np.minimum(values, n_levels)
+        for column in self.columns:
+            vocabulary = self.vocabularies[column]
+            found = pd.Categorical(data[column].astype(str), categories=vocabulary)
+            codes[column] = np.where(
+                found.codes < 0, len(vocabulary), found.codes
+            ).astype(np.intp)
+        return codes
+
+    def _sizes(self):
+        sizes = {
+            column: len(levels)
+            for column, levels in CATEGORIES.items()
+            if column in FEATURES
+        }
+        sizes.update(
+            (column, len(self.vocabularies[column])) for column in self.columns
+        )
+        return sizes
+
+    def _tables(self, codes, target, rows):
+        prior = target[rows].mean()
+        sizes = self._sizes()
+        tables = {
+            column: _rates(
+                values[rows], target[rows], sizes[column], prior, self.smoothing
+            )
+            for column, values in codes.items()
+        }
+        return prior, tables
+
+    def _matrix(self, store, encoded, rows):
+        names = self.feature_names
+        matrix = np.empty((len(rows), len(names)), dtype=np.float32, order="F")
+        for j, column in enumerate(names):
+            if column in encoded:
+                matrix[:, j] = encoded[column]
+            else:
+                matrix[:, j] = store.column(column)[rows]
+        return matrix
+
+    def fit(self, data, store, rows=None):
+        """
+        Learn the vocabularies of the extra columns and the rate tables
+
+        data: cleaned dataframe holding the extra columns
+        store: FeatureStore with a target, encoded from the same rows
+        rows: index array of the training rows, all rows by default
+        """
+        rows = np.arange(len(store)) if rows is None else np.asarray(rows)
+        for column in self.columns:
+            values = data[column].iloc[rows].astype(str)
+            self.vocabularies[column] = list(np.unique(values))
+        codes = self._codes(data, store)
+        self.prior, self.tables = self._tables(codes, store.target, rows)
+        return self
+
+    def fit_transform(self, data, store, rows=None):
+        """
+        fit on the training rows and return their out-of-fold encoding
+
+        data: cleaned dataframe holding the extra columns
+        store: FeatureStore with a target, encoded from the same rows
+        rows: index array of the training rows, all rows by default
+        """
+        from .split import stratified_folds
+
+        rows = np.arange(len(store)) if rows is None else np.asarray(rows)
+        with stage("target_encode", rows=len(rows)):
+            self.fit(data, store, rows)
+            codes = self._codes(data, store)
+            encoded = {
+                column: np.empty(len(rows), dtype=np.float32) for column in codes
+            }
+            folds = stratified_folds(
+                store.target[rows], self.n_splits, 1, self.random_state
+            )
+            for train, test in folds:
+                _, tables = self._tables(codes, store.target, rows[train])
+                for column, table in tables.items():
+                    encoded[column][test] = table[codes[column][rows[test]]]
+            return self._matrix(store, encoded, rows)
+
+    def transform(self, data, store):
+        """
+        Encoding of every row with the fitted tables
+
+        data: cleaned dataframe holding the extra columns
+        store: FeatureStore encoded from the same rows
+        """
+        with stage("target_encode", rows=len(store)):
+            codes = self._codes(data, store)
+            encoded = {
+                column: self.tables[column][values] for column, values in codes.items()
+            }
+            return self._matrix(store, encoded, np.arange(len(store)))
@@ -0,0 +1,227 @@
+"""
+Compact in-memory representation of the EasyVisa feature matrix
+"""
+
+import numpy as np
+
+from .profiling import stage, timed
+from .schema import CATEGORIES, FEATURES, FLAGS, NUMERIC, TARGET, dummy_columns
+
+# code used for category levels that are not part of the schema
+MISSING_CODE = 255
+
+
+def _layout(n_rows):
+    """
+    Offsets of every column inside the shared buffer, each column padded
+    to a multiple of 8 bytes so that the typed views stay aligned
+
+    n_rows: number of rows held by the store
+    """
+    layout = {}
+    offset = 0
+    for column in FEATURES:
+        dtype = np.dtype(NUMERIC.get(column, "uint8"))
+        layout[column] = (dtype, offset)
+        offset += -(-n_rows * dtype.itemsize // 8) * 8
+    return layout, offset
+
+
+class FeatureStore:
+    """
+    Column-major store of the EasyVisa predictors in one contiguous buffer
+
+    Category levels are held as uint8 codes in the order of
+    schema.CATEGORIES, Y/N flags as uint8 0/1 and the numeric columns as
+    int32/float32. design_matrix() expands the store once into the float32
+    Fortran-ordered one-hot matrix that the tree models and XGBoost work on,
+    so fitting and predicting on it does not trigger any conversion copies.
+    """
+
+    def __init__(self, buffer, n_rows, target=None):
+        """
+        buffer: uint8 array laid out as described by _layout
+        n_rows: number of rows held by the store
+        target: optional uint8 array of 0/1 case status
+        """
+        self.layout, size = _layout(n_rows)
+        if buffer.nbytes != size:
+            raise ValueError(
+                "buffer holds {} bytes, {} rows need {}".format(
+                    buffer.nbytes, n_rows, size
+                )
+            )
+        self.buffer = buffer
+        self.n_rows = n_rows
+        self.target = target
+        self._matrix = None
+
+    @classmethod
+    def empty(cls, n_rows, with_target=True):
+        """
+        Allocate a zero-filled store
+
+        n_rows: number of rows to allocate
+        with_target: whether to allocate a target array as well
+        """
+        _, size = _layout(n_rows)
+        target = np.zeros(n_rows, dtype=np.uint8) if with_target else None
+        return cls(np.zeros(size, dtype=np.uint8), n_rows, target)
+
+    @classmethod
+    @timed("encode", rows=len)
+    def from_frame(cls, data):
+        """
+        Encode a cleaned dataframe (see data.clean) into a new store
+
+        data: dataframe holding the predictors and optionally case_status
+        """
+        import pandas as pd
+
+        store = cls.empty(len(data), with_target=TARGET in data)
+        for column in FEATURES:
+            values = data[column]
+            if column in NUMERIC:
+                store.column(column)[:] = np.asarray(values)
+            elif column in FLAGS:
+                store.column(column)[:] = np.asarray(values == "Y")
+            else:
+                codes = pd.Categorical(values, categories=CATEGORIES[column]).codes
+                # unknown levels have code -1, which wraps to MISSING_CODE
+                store.column(column)[:] = codes.astype(np.uint8)
+        if store.target is not None:
+            store.target[:] = np.asarray(data[TARGET])
+        return store
+
+    @classmethod
+    def concat(cls, stores):
+        """
+        Stack stores row-wise into a new store
+
+        stores: list of FeatureStore, all with or all without a target
+        """
+        n_rows = sum(len(store) for store in stores)
+        combined = cls.empty(n_rows, with_target=stores[0].target is not None)
+        for column in FEATURES:
+            np.concatenate(
+                [store.column(column) for store in stores], out=combined.column(column)
+            )
+        if combined.target is not None:
+            np.concatenate([store.target for store in stores], out=combined.target)
+        return combined
+
+    def slice(self, start, stop):
+        """
+        Copy rows start:stop into a new store
+
+        start: first row copied
+        stop: row after the last one copied
+        """
+        sliced = self.empty(stop - start, with_target=self.target is not None)
+        for column in FEATURES:
+            sliced.column(column)[:] = self.column(column)[start:stop]
+        if sliced.target is not None:
+            sliced.target[:] = self.target[start:stop]
+        return sliced
+
+    def save(self, path):
+        """
+        Write the store to an uncompressed .npz file
+
+        path: destination file
+        """
+        arrays = {"buffer": self.buffer, "n_rows": np.int64(self.n_rows)}
+        if self.target is not None:
+            arrays["target"] = self.target
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read a store written by save
+
+        path: .npz file
+        """
+        with np.load(path) as arrays:
+            target = arrays["target"] if "target" in arrays else None
+            return cls(arrays["buffer"], int(arrays["n_rows"]), target)
+
+    def __len__(self):
+        return self.n_rows
+
+    def column(self, name):
+        """
+        Typed view of one column, without copying
+
+        name: column name from schema.FEATURES
+        """
+        dtype, offset = self.layout[name]
+        return np.frombuffer(self.buffer, dtype=dtype, count=self.n_rows, offset=offset)
+
+    @property
+    def feature_names(self):
+        return dummy_columns()
+
+    def design_matrix(self):
+        """
+        float32 one-hot matrix with the columns of
+        pd.get_dummies(X, drop_first=True), built once and cached
+        """
+        if self._matrix is None:
+            with stage("encode", rows=self.n_rows):
+                self._matrix = self._expand()
+        return self._matrix
+
+    def _expand(self):
+        names = self.feature_names
+        matrix = np.zeros((self.n_rows, len(names)), dtype=np.float32, order="F")
+        j = 0
+        for column in FEATURES:
+            if column in NUMERIC:
+                matrix[:, j] = self.column(column)
+                j += 1
+        for column in FEATURES:
+            if column in CATEGORIES:
+                codes = self.column(column)
+                for code in range(1, len(CATEGORIES[column])):
+                    matrix[:, j] = codes == code
+                    j += 1
+            elif column in FLAGS:
+                matrix[:, j] = self.column(column)
+                j += 1
+        return matrix
+
+    def fingerprint(self):
+        """
+        sha1 of the compact columns and the target, identifying the data
+        a model was fitted or evaluated on
+        """
+        import hashlib
+
+        digest = hashlib.sha1(self.buffer)
+        if self.target is not None:
+            digest.update(self.target)
+        return digest.hexdigest()
+
+    @property
+    def nbytes(self):
+        """
+        Bytes held by the compact columns and the target
+        """
+        target = 0 if self.target is None else self.target.nbytes
+        return self.buffer.nbytes + target
+
+    def memory_report(self):
+        """
+        Bytes per million rows of every column, of the compact store and of
+        the cached design matrix
+        """
+        import pandas as pd
+
+        scale = 1e6 / max(self.n_rows, 1)
+        report = {column: self.layout[column][0].itemsize * 1e6 for column in FEATURES}
+        report["compact store"] = self.nbytes * scale
+        report["design matrix"] = (
+            len(self.feature_names) * np.dtype(np.float32).itemsize * 1e6
+        )
+        return pd.Series(report, name="bytes per million rows")
@@ -0,0 +1,197 @@
+"""
+Incremental retraining when new batches of applications arrive
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from .data import clean
+from .drift import DriftMonitor, FeatureProfile
+from .features import FeatureStore
+from .metrics import model_performance_classification_sklearn
+from .models import tune
+from .profiling import stage
+from .split import stratified_split
+
+# sklearn ensembles that can grow extra trees with warm_start=True
+WARM_START = {
+    "bagging_classifier",
+    "bagging_estimator_tuned",
+    "rf_estimator",
+    "rf_tuned",
+    "gb_classifier",
+    "gbc_tuned",
+}
+# XGBoost models, continued from their current booster
+XGBOOST = {"xgb_classifier", "xgb_tuned"}
+
+
+class IncrementalTrainer:
+    """
+    Keeps a cached dataset and fitted models in a directory and updates
+    them batch by batch
+
+    initialize() tunes every model once on the first dataset. update()
+    appends a batch to the cached FeatureStore and, unless the batch has
+    drifted away from the training data, only adds trees to the ensembles
+    (warm_start for the sklearn ensembles, booster continuation for
+    XGBoost); models without an incremental path are refit with their
+    tuned parameters. Hyperparameters are searched again only when a
+    DriftMonitor over the batch flags drift against the training profile.
+    Evaluation covers the new batch (scored before the models see it) and
+    the fixed holdout drawn at initialization.
+    """
+
+    def __init__(
+        self,
+        directory,
+        models=("rf_tuned", "bagging_estimator_tuned", "gbc_tuned", "xgb_tuned"),
+        extra_estimators=10,
+        psi_threshold=0.2,
+        test_size=0.30,
+        random_state=1,
+    ):
+        """
+        directory: folder holding the cached dataset, holdout and models
+        models: names from models.MODELS to maintain
+        extra_estimators: trees or boosting rounds added per update
+        psi_threshold: population stability index of any feature above
+            which hyperparameters are re-tuned
+        test_size: fraction of the first dataset kept as holdout
+        random_state: seed of the holdout split
+        """
+        self.directory = directory
+        self.names = list(models)
+        self.extra_estimators = extra_estimators
+        self.psi_threshold = psi_threshold
+        self.test_size = test_size
+        self.random_state = random_state
+        self.models = {}
+
+    def _path(self, *parts):
+        return os.path.join(self.directory, *parts)
+
+    def initialize(self, data):
+        """
+        Encode and cache the first dataset, hold out a test set and tune
+        every model on the remaining rows
+
+        data: raw dataframe as read by data.load_visa
+        """
+        store = FeatureStore.from_frame(clean(data))
+        split = stratified_split(store.target, self.test_size, self.random_state)
+        X_train = store.design_matrix()[split.train]
+        y_train = store.target[split.train]
+        self.models = {name: tune(name, X_train, y_train) for name in self.names}
+        self._save(store, split.test, split.train)
+
+    def update(self, batch):
+        """
+        Append a batch of applications, update the models and evaluate them
+        on the batch and on the holdout
+
+        batch: raw dataframe of new applications with their case_status
+        """
+        store, holdout = self._load()
+        new = FeatureStore.from_frame(clean(batch))
+        drift = self.drift(new)
+
+        performance = {}
+        for name, model in self.models.items():
+            performance[("delta", name)] = model_performance_classification_sklearn(
+                model, new.design_matrix(), new.target
+            ).iloc[0]
+
+        store = FeatureStore.concat([store, new])
+        # holdout indices point into the first dataset, new rows go after it
+        train = np.setdiff1d(np.arange(len(store)), holdout, assume_unique=True)
+        X_train = store.design_matrix()[train]
+        y_train = store.target[train]
+        for name in self.names:
+            if drift["drift"].any():
+                self.models[name] = tune(name, X_train, y_train)
+            else:
+                with stage("fit", rows=len(y_train)):
+                    self.models[name] = self._grow(name, X_train, y_train)
+
+        X_test, y_test = store.design_matrix()[holdout], store.target[holdout]
+        for name, model in self.models.items():
+            performance[("holdout", name)] = model_performance_classification_sklearn(
+                model, X_test, y_test
+            ).iloc[0]
+        self._save(store, holdout, train)
+
+        report = pd.DataFrame(performance).T
+        report.index.names = ["data", "model"]
+        report.attrs["drift"] = drift
+        report.attrs["retuned"] = bool(drift["drift"].any())
+        return report
+
+    def _grow(self, name, X, y):
+        """
+        Add trees to a fitted model, or refit it with its current parameters
+        when it has no incremental path
+        """
+        from sklearn.base import clone
+
+        model = self.models[name]
+        if name in WARM_START:
+            model.set_params(
+                warm_start=True,
+                n_estimators=model.n_estimators + self.extra_estimators,
+            )
+            if getattr(model, "oob_score", False):
+                # the out-of-bag estimate would be recomputed over every tree
+                model.set_params(oob_score=False)
+            return model.fit(X, y)
+        if name in XGBOOST:
+            booster = model.get_booster()
+            rounds = booster.num_boosted_rounds()
+            model.set_params(n_estimators=self.extra_estimators)
+            model.fit(X, y, xgb_model=booster)
+            # back to all the rounds, so that clones and refits train them all
+            return model.set_params(n_estimators=rounds + self.extra_estimators)
+        return clone(model).fit(X, y)
+
+    def drift(self, store):
+        """
+        Drift metrics of a new batch against the training data profile
+
+        store: FeatureStore of the batch
+        """
+        monitor = DriftMonitor(
+            FeatureProfile.load(self._path("profile.npz")),
+            psi_threshold=self.psi_threshold,
+        )
+        monitor.update(store)
+        return monitor.metrics()
+
+    def _save(self, store, holdout, train):
+        import joblib
+
+        os.makedirs(self._path("models"), exist_ok=True)
+        store.save(self._path("store.npz"))
+        np.save(self._path("holdout.npy"), holdout)
+        FeatureProfile.from_store(store, train).save(self._path("profile.npz"))
+        for name, model in self.models.items():
+            joblib.dump(model, self._path("models", name + ".joblib"))
+        with open(self._path("state.json"), "w") as f:
+            json.dump({"models": self.names, "n_rows": len(store)}, f)
+
+    def _load(self):
+        import joblib
+
+        with open(self._path("state.json")) as f:
+            state = json.load(f)
+        self.names = state["models"]
+        if not self.models:
+            self.models = {
+                name: joblib.load(self._path("models", name + ".joblib"))
+                for name in self.names
+            }
+        return FeatureStore.load(self._path("store.npz")), np.load(
+            self._path("holdout.npy")
+        )
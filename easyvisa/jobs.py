@@ -0,0 +1,486 @@
+"""
+SQLite-backed queue of tuning and training jobs with progress, priorities,
+cancellation and resumption
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from .profiling import stage
+
+STATUSES = ["queued", "running", "done", "failed", "cancelled"]
+FINISHED = ("done", "failed", "cancelled")
+# seconds between the heartbeats of a running job, and without one after
+# which recover() takes its worker for dead
+HEARTBEAT = 10.0
+STALE = 60.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    spec TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    cancel INTEGER NOT NULL DEFAULT 0,
+    submitted REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    total INTEGER,
+    completed INTEGER NOT NULL DEFAULT 0,
+    best_score REAL,
+    best_params TEXT,
+    result TEXT,
+    error TEXT,
+    worker TEXT,
+    heartbeat REAL
+);
+CREATE TABLE IF NOT EXISTS candidates (
+    job INTEGER NOT NULL REFERENCES jobs(id),
+    candidate INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    score REAL,
+    fold_scores TEXT NOT NULL,
+    fit_time REAL NOT NULL,
+    recorded REAL,
+    PRIMARY KEY (job, candidate)
+);
+"""
+
+
+class Cancelled(Exception):
+    """
+    Raised inside a job whose cancellation was requested
+    """
+
+
+class JobQueue:
+    """
+    Jobs persisted in one SQLite file, shared by the processes submitting,
+    watching and running them
+
+    Every grid search candidate is committed as soon as it is scored, so a
+    job interrupted by a crash or a killed worker is put back in the queue
+    by recover() and resumes with the candidates it had not scored yet.
+    Workers claim the queued job of highest priority, oldest first, within
+    one write transaction, so several workers can share a queue. A running
+    job holds the id of its worker and a heartbeat refreshed every
+    HEARTBEAT seconds while it runs, so that recover() only requeues the
+    jobs of workers that stopped beating.
+    """
+
+    def __init__(self, path, worker=None):
+        """
+        path: SQLite database file, created if missing
+        worker: id of the worker running the jobs claimed through this
+            queue, host:pid by default
+        """
+        self.path = path
+        self.worker = worker or "{}:{}".format(socket.gethostname(), os.getpid())
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(_SCHEMA)
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(jobs)")]
+        for column, kind in [("worker", "TEXT"), ("heartbeat", "REAL")]:
+            if column not in columns:
+                # queues created before the workers sent heartbeats
+                self._db.execute(
+                    "ALTER TABLE jobs ADD COLUMN {} {}".format(column, kind)
+                )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(candidates)")]
+        if "recorded" not in columns:
+            # queues created before the candidates were timestamped
+            self._db.execute("ALTER TABLE candidates ADD COLUMN recorded REAL")
+
+    def close(self):
+        self._db.close()
+
+    def submit(self, kind, priority=0, **spec):
+        """
+        Queue a job and return its id
+
+        kind: "tune" (grid search of a model, refit on the training rows)
+            or "train" (fit of a model with given or default parameters)
+        priority: jobs of higher priority are run first
+        spec: data (csv path), model (key of models.MODELS), out (artifact
+            directory), n_jobs, trials (trials.TrialStore path, for
+            "tune", next to the queue by default), sample, size and ratio
+            (sampling strategy of the search and its arguments, for
+            "tune", see sampling.tune_sampled), params (for "train")
+        """
+        from .models import MODELS
+
+        if kind not in _RUNNERS:
+            raise ValueError("kind must be one of {}".format(sorted(_RUNNERS)))
+        if spec.get("model") not in MODELS:
+            raise ValueError("unknown model {!r}".format(spec.get("model")))
+        cursor = self._db.execute(
+            "INSERT INTO jobs (kind, spec, priority, submitted) VALUES (?, ?, ?, ?)",
+            (kind, json.dumps(spec), priority, time.time()),
+        )
+        return cursor.lastrowid
+
+    def cancel(self, job):
+        """
+        Cancel a queued job, or ask a running one to stop after its current
+        candidate
+
+        job: job id
+        """
+        with self._transaction():
+            self._db.execute(
+                "UPDATE jobs SET status = 'cancelled', finished = ? "
+                "WHERE id = ? AND status = 'queued'",
+                (time.time(), job),
+            )
+            self._db.execute(
+                "UPDATE jobs SET cancel = 1 WHERE id = ? AND status = 'running'",
+                (job,),
+            )
+
+    def get(self, job):
+        """
+        Row of a job as a dict, with its progress (see progress)
+
+        job: job id
+        """
+        row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job,)).fetchone()
+        if row is None:
+            raise KeyError("no job {}".format(job))
+        return dict(row, **self.progress(row))
+
+    def jobs(self, status=None):
+        """
+        All the jobs, or those with one status, in the order they run
+
+        status: one of STATUSES
+        """
+        query = "SELECT * FROM jobs"
+        args = ()
+        if status is not None:
+            query += " WHERE status = ?"
+            args = (status,)
+        query += " ORDER BY status != 'running', priority DESC, id"
+        return [dict(row) for row in self._db.execute(query, args)]
+
+    def candidates(self, job):
+        """
+        Scored candidates of a job in grid order
+
+        job: job id
+        """
+        rows = self._db.execute(
+            "SELECT * FROM candidates WHERE job = ? ORDER BY candidate", (job,)
+        )
+        return [dict(row) for row in rows]
+
+    def progress(self, row):
+        """
+        Fraction done and estimated seconds left of a job row, from the
+        mean time of the candidates scored since it was last started
+
+        row: job row
+        """
+        total, completed = row["total"], row["completed"]
+        if not total:
+            return {"fraction": 0.0, "eta": None}
+        eta = None
+        if row["status"] == "running" and row["started"]:
+            timed = self._db.execute(
+                "SELECT COUNT(*), SUM(fit_time) FROM candidates "
+                "WHERE job = ? AND recorded >= ?",
+                (row["id"], row["started"]),
+            ).fetchone()
+            if timed[0]:
+                eta = timed[1] / timed[0] * (total - completed)
+        return {"fraction": completed / total, "eta": eta}
+
+    def watch(self, job, interval=1.0):
+        """
+        Yield the job row whenever its progress changes, until it finishes
+
+        job: job id
+        interval: seconds between polls
+        """
+        last = None
+        while True:
+            row = self.get(job)
+            state = (row["status"], row["completed"], row["best_score"])
+            if state != last:
+                yield row
+                last = state
+            if row["status"] in FINISHED:
+                return
+            time.sleep(interval)
+
+    def recover(self, stale=STALE):
+        """
+        Put the jobs left running by a dead worker, whose heartbeat is older
+        than stale seconds, back in the queue; they resume with their
+        unscored candidates. Returns their number.
+
+        stale: seconds without a heartbeat after which a worker is taken
+            for dead, several times HEARTBEAT
+        """
+        cursor = self._db.execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL "
+            "WHERE status = 'running' AND (heartbeat IS NULL OR heartbeat < ?)",
+            (time.time() - stale,),
+        )
+        return cursor.rowcount
+
+    def claim(self):
+        """
+        Mark the next queued job running and return its row, None if the
+        queue is empty
+        """
+        with self._transaction():
+            row = self._db.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' "
+                "ORDER BY priority DESC, id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            self._db.execute(
+                "UPDATE jobs SET status = 'running', started = ?, worker = ?, "
+                "heartbeat = ? WHERE id = ?",
+                (now, self.worker, now, row["id"]),
+            )
+        return dict(row, status="running", worker=self.worker, heartbeat=now)
+
+    def _transaction(self):
+        return _Transaction(self._db)
+
+    def _update(self, job, **values):
+        columns = ", ".join("{} = ?".format(name) for name in values)
+        self._db.execute(
+            "UPDATE jobs SET {} WHERE id = ?".format(columns),
+            tuple(values.values()) + (job,),
+        )
+
+    def _check_cancel(self, job):
+        row = self._db.execute("SELECT cancel FROM jobs WHERE id = ?", (job,))
+        if row.fetchone()[0]:
+            raise Cancelled()
+
+    def _record(self, job, candidate, params, fold_scores, fit_time):
+        """
+        Commit a scored candidate and the job's progress and best score
+        """
+        scores = [score for score in fold_scores if score == score]
+        score = sum(scores) / len(scores) if len(scores) == len(fold_scores) else None
+        with self._transaction():
+            self._db.execute(
+                "INSERT OR REPLACE INTO candidates (job, candidate, params, "
+                "score, fold_scores, fit_time, recorded) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job,
+                    candidate,
+                    params,
+                    score,
+                    json.dumps(fold_scores),
+                    fit_time,
+                    time.time(),
+                ),
+            )
+            best = self._best(job)
+            self._db.execute(
+                "UPDATE jobs SET completed = "
+                "(SELECT COUNT(*) FROM candidates WHERE job = ?), "
+                "best_score = ?, best_params = ? WHERE id = ?",
+                (job, best and best["score"], best and best["params"], job),
+            )
+
+    def _best(self, job):
+        """
+        Candidate with the highest mean score, the first one on ties as in
+        GridSearchCV
+        """
+        row = self._db.execute(
+            "SELECT * FROM candidates WHERE job = ? AND score IS NOT NULL "
+            "ORDER BY score DESC, candidate LIMIT 1",
+            (job,),
+        ).fetchone()
+        return None if row is None else dict(row)
+
+    def run(self, job):
+        """
+        Run a claimed job to completion, failure or cancellation
+
+        job: job row returned by claim
+        """
+        spec = json.loads(job["spec"])
+        beating = threading.Event()
+        heart = threading.Thread(
+            target=_beat, args=(self.path, job["id"], self.worker, beating)
+        )
+        heart.daemon = True
+        heart.start()
+        try:
+            with stage("job:" + job["kind"]):
+                result = _RUNNERS[job["kind"]](self, job["id"], spec)
+        except Cancelled:
+            self._update(job["id"], status="cancelled", finished=time.time())
+        except Exception as error:
+            self._update(
+                job["id"],
+                status="failed",
+                finished=time.time(),
+                error="{}: {}".format(type(error).__name__, error),
+            )
+        else:
+            self._db.execute(
+                "UPDATE jobs SET status = 'done', finished = ?, result = ?, "
+                "completed = COALESCE(total, completed) WHERE id = ?",
+                (time.time(), result, job["id"]),
+            )
+        finally:
+            beating.set()
+            heart.join()
+
+
+def _beat(path, job, worker, stop):
+    """
+    Refresh the heartbeat of a running job every HEARTBEAT seconds until
+    stop is set, on a connection of its own
+    """
+    db = sqlite3.connect(path, timeout=30, isolation_level=None)
+    try:
+        while not stop.wait(HEARTBEAT):
+            db.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ?",
+                (time.time(), job, worker),
+            )
+    finally:
+        db.close()
+
+
+class _Transaction:
+    """
+    BEGIN IMMEDIATE ... COMMIT, rolled back on error
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, kind, value, traceback):
+        self.db.execute("ROLLBACK" if kind else "COMMIT")
+
+
+def _training(path):
+    """
+    Training design matrix and target of a csv, with the notebook's split
+    """
+    from .data import clean, load_visa
+    from .features import FeatureStore
+    from .split import Splitter
+
+    store = FeatureStore.from_frame(clean(load_visa(path)))
+    splitter = Splitter(store)
+    return splitter.arrays(splitter.holdout().train)
+
+
+def _save(spec, model, **metadata):
+    from .scoring import save_model
+
+    out = spec.get("out", "artifacts")
+    os.makedirs(out, exist_ok=True)
+    path = os.path.join(out, spec["model"] + ".joblib")
+    save_model(path, model, spec["model"], **metadata)
+    return path
+
+
+def _tune(queue, job, spec):
+    """
+    models.tune (or sampling.tune_sampled with spec["sample"]) of a model,
+    recording every grid candidate as it is scored and saving the refit
+    model with the out-of-fold predictions of the best candidate
+
+    The search runs on the trials.TrialStore of spec["trials"], by default
+    a -trials.db file next to the queue, so a resumed job refits none of
+    the folds scored before it was interrupted.
+    """
+    from sklearn.model_selection import ParameterGrid
+
+    from .models import MODELS, tune
+    from .sampling import tune_sampled
+    from .trials import params_json
+
+    model = MODELS[spec["model"]]
+    X, y = _training(spec["data"])
+    if model.grid is None:
+        queue._update(job, total=1)
+        return _save(spec, tune(spec["model"], X, y))
+    queue._update(job, total=len(ParameterGrid(model.grid())))
+    done = {row["candidate"] for row in queue.candidates(job)}
+
+    def record(candidate, params, fold_scores, seconds):
+        if candidate not in done:
+            queue._record(
+                job, candidate, params_json(params), fold_scores.tolist(), seconds
+            )
+        queue._check_cancel(job)
+
+    queue._check_cancel(job)
+    search = dict(
+        trials=spec.get("trials") or os.path.splitext(queue.path)[0] + "-trials.db",
+        return_oof=True,
+        callback=record,
+    )
+    if "n_jobs" in spec:
+        search["n_jobs"] = spec["n_jobs"]
+    if spec.get("sample"):
+        fitted, oof = tune_sampled(
+            spec["model"],
+            X,
+            y,
+            spec["sample"],
+            size=spec.get("size", 0.2),
+            ratio=spec.get("ratio", 1.0),
+            **search,
+        )
+    else:
+        fitted, oof = tune(spec["model"], X, y, **search)
+    return _save(spec, fitted, oof=oof)
+
+
+def _train(queue, job, spec):
+    """
+    Fit of a model with the notebook's parameters updated by spec["params"]
+    """
+    from .models import MODELS
+
+    queue._update(job, total=1)
+    X, y = _training(spec["data"])
+    model = MODELS[spec["model"]].build().set_params(**spec.get("params", {}))
+    return _save(spec, model.fit(X, y))
+
+
+_RUNNERS = {"tune": _tune, "train": _train}
+
+
+def work(queue, once=False, poll=1.0):
+    """
+    Run queued jobs until the queue is empty (once) or forever
+
+    queue: JobQueue
+    once: return when no job is queued instead of polling for new ones
+    poll: seconds between polls of an empty queue
+    """
+    while True:
+        job = queue.claim()
+        if job is None:
+            if once:
+                return
+            time.sleep(poll)
+            continue
+        queue.run(job)
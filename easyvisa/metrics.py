@@ -0,0 +1,36 @@
+"""
+Classification metrics used to compare the EasyVisa models
+"""
+
+import pandas as pd
+
+from .profiling import stage
+
+
+# defining a function to compute different metrics to check performance of a classification model built using sklearn
+def model_performance_classification_sklearn(model, predictors, target):
+    """
+    Function to compute different metrics to check classification model performance
+
+    model: classifier
+    predictors: independent variables
+    target: dependent variable
+    """
+    from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score
+
+    # predicting using the independent variables
+    with stage("predict", rows=len(target)):
+        pred = model.predict(predictors)
+
+    acc = accuracy_score(target, pred)  # to compute Accuracy
+    recall = recall_score(target, pred)  # to compute Recall
+    precision = precision_score(target, pred)  # to compute Precision
+    f1 = f1_score(target, pred)  # to compute F1-score
+
+    # creating a dataframe of metrics
+    df_perf = pd.DataFrame(
+        {"Accuracy": acc, "Recall": recall, "Precision": precision, "F1": f1},
+        index=[0],
+    )
+
+    return df_perf
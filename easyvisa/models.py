@@ -0,0 +1,340 @@
+"""
+The notebook's classifiers and hyperparameter grids
+"""
+
+import contextlib
+from collections import namedtuple
+
+import numpy as np
+
+from .profiling import stage
+
+ModelSpec = namedtuple("ModelSpec", ["label", "build", "grid", "search"])
+
+
+def _decision_tree(**params):
+    from sklearn.tree import DecisionTreeClassifier
+
+    return DecisionTreeClassifier(**params)
+
+
+def _bagging(**params):
+    from sklearn.ensemble import BaggingClassifier
+
+    return BaggingClassifier(**params)
+
+
+def _random_forest(**params):
+    from sklearn.ensemble import RandomForestClassifier
+
+    return RandomForestClassifier(**params)
+
+
+def _adaboost(**params):
+    from sklearn.ensemble import AdaBoostClassifier
+
+    return AdaBoostClassifier(**params)
+
+
+def _gradient_boosting(**params):
+    from sklearn.ensemble import AdaBoostClassifier, GradientBoostingClassifier
+
+    params.setdefault("init", AdaBoostClassifier(random_state=1))
+    return GradientBoostingClassifier(**params)
+
+
+def _xgboost(**params):
+    from xgboost import XGBClassifier
+
+    return XGBClassifier(**params)
+
+
+def _stumps():
+    return [
+        _decision_tree(max_depth=1, class_weight="balanced", random_state=1),
+        _decision_tree(max_depth=2, class_weight="balanced", random_state=1),
+    ]
+
+
+# Models in the order of the notebook's comparison tables. build() returns
+# the unfitted estimator, grid is None for the untuned models and search
+# holds the GridSearchCV arguments used in the notebook.
+MODELS = {
+    "decision_tree": ModelSpec(
+        "Decision Tree",
+        lambda: _decision_tree(random_state=1),
+        None,
+        {},
+    ),
+    "dtree_estimator": ModelSpec(
+        "Tuned Decision Tree",
+        lambda: _decision_tree(class_weight="balanced", random_state=1),
+        lambda: {
+            "max_depth": np.arange(5, 16, 5),
+            "min_samples_leaf": [3, 5, 7],
+            "max_leaf_nodes": [2, 5],
+            "min_impurity_decrease": [0.0001, 0.001],
+        },
+        {"n_jobs": -1},
+    ),
+    "bagging_classifier": ModelSpec(
+        "Bagging Classifier",
+        lambda: _bagging(random_state=1),
+        None,
+        {},
+    ),
+    "bagging_estimator_tuned": ModelSpec(
+        "Tuned Bagging Classifier",
+        lambda: _bagging(random_state=1),
+        lambda: {
+            "max_samples": [0.7, 0.9],
+            "max_features": [0.7, 0.9],
+            "n_estimators": np.arange(90, 111, 10),
+        },
+        {"cv": 5},
+    ),
+    "rf_estimator": ModelSpec(
+        "Random Forest",
+        lambda: _random_forest(random_state=1, class_weight="balanced"),
+        None,
+        {},
+    ),
+    "rf_tuned": ModelSpec(
+        "Tuned Random Forest",
+        lambda: _random_forest(random_state=1, oob_score=True, bootstrap=True),
+        lambda: {
+            "max_depth": list(np.arange(5, 15, 5)),
+            "max_features": ["sqrt", "log2"],
+            "min_samples_split": [5, 7],
+            "n_estimators": np.arange(15, 26, 5),
+        },
+        {"cv": 5, "n_jobs": -1},
+    ),
+    "ab_classifier": ModelSpec(
+        "Adaboost Classifier",
+        lambda: _adaboost(random_state=1),
+        None,
+        {},
+    ),
+    "abc_tuned": ModelSpec(
+        "Tuned Adaboost Classifier",
+        lambda: _adaboost(random_state=1),
+        lambda: {
+            # Let's try different max_depth for the base estimator
+            "estimator": _stumps(),
+            "n_estimators": np.arange(80, 101, 10),
+            "learning_rate": np.arange(0.1, 0.4, 0.1),
+        },
+        {"cv": 5},
+    ),
+    "gb_classifier": ModelSpec(
+        "Gradient Boost Classifier",
+        lambda: _gradient_boosting(init=None, random_state=1),
+        None,
+        {},
+    ),
+    "gbc_tuned": ModelSpec(
+        "Tuned Gradient Boost Classifier",
+        lambda: _gradient_boosting(random_state=1),
+        lambda: {
+            "n_estimators": [200, 250],
+            "subsample": [0.9, 1],
+            "max_features": [0.8, 0.9],
+            "learning_rate": np.arange(0.1, 0.21, 0.1),
+        },
+        {"cv": 5, "n_jobs": -1},
+    ),
+    "xgb_classifier": ModelSpec(
+        "XGBoost Classifier",
+        lambda: _xgboost(random_state=1, eval_metric="logloss"),
+        None,
+        {},
+    ),
+    "xgb_tuned": ModelSpec(
+        "XGBoost Classifier Tuned",
+        lambda: _xgboost(random_state=1, eval_metric="logloss"),
+        lambda: {
+            "n_estimators": np.arange(150, 250, 50),
+            "scale_pos_weight": [1, 2],
+            "subsample": [0.9, 1],
+            "learning_rate": np.arange(0.1, 0.21, 0.1),
+            "gamma": [3, 5],
+            "colsample_bytree": [0.8, 0.9],
+            "colsample_bylevel": [0.9, 1],
+        },
+        {"cv": 5},
+    ),
+}
+
+# estimators combined by the stacking classifier, and its final estimator
+STACKING_ESTIMATORS = [
+    ("AdaBoost", "ab_classifier"),
+    ("Gradient Boosting", "gbc_tuned"),
+    ("Random Forest", "rf_tuned"),
+]
+STACKING_FINAL = "xgb_tuned"
+
+
+def f1_scorer():
+    """
+    Type of scoring used to compare parameter combinations
+    """
+    from sklearn import metrics
+
+    return metrics.make_scorer(metrics.f1_score)
+
+
+def tune(
+    name,
+    X,
+    y,
+    cv=None,
+    rows=None,
+    sample=None,
+    sample_weight=None,
+    trials=None,
+    return_oof=False,
+    callback=None,
+    **search,
+):
+    """
+    Run the notebook's grid search for a model and refit the best
+    combination of parameters on X, y
+
+    name: key of MODELS
+    X: design matrix
+    y: target
+    cv: number of folds or iterable of (train, test) index arrays,
+        by default the notebook's setting for the model
+    rows: index array of the rows to refit on, by default all rows; pass
+        the training rows when cv holds global fold indices from Splitter
+    sample: index array of the rows the grid search runs on, by default
+        all rows; the best combination is still refit on rows (see
+        sampling.draw)
+    sample_weight: weights of the sample rows passed to every fit of the
+        grid search
+    trials: trials.TrialStore, or the path of one, holding the fold scores
+        of earlier searches; only the candidates and folds it lacks are
+        fitted, and the new ones are added to it
+    return_oof: return (model, oof), oof being the out-of-fold
+        predictions of the best combination kept from the search folds
+        rather than refitted: a dict of the probabilities of certification
+        of the search rows (NaN where a fit failed), their target and their
+        sample_weight, None for a model without a grid. The search then
+        runs through a trials.TrialStore, in memory without trials, which
+        picks the same combination as GridSearchCV.
+    callback: called after every grid candidate as callback(candidate,
+        params, fold_scores, seconds), see trials.grid_search; the search
+        then runs through a trials.TrialStore as for return_oof
+    search: extra GridSearchCV arguments; n_jobs=-1, the notebook's setting
+        for some models, runs as many workers as the CPUs and the memory
+        measured for one fit allow, each with its share of the CPUs as
+        BLAS/OpenMP threads (see resources.plan)
+    """
+    spec = MODELS[name]
+    X_fit, y_fit = (X, y) if rows is None else (X[rows], y[rows])
+    if spec.grid is None:
+        with stage("fit", rows=len(y_fit)):
+            model = spec.build().fit(X_fit, y_fit)
+        return (model, None) if return_oof else model
+    kwargs = dict(spec.search, **search)
+    if cv is not None:
+        kwargs["cv"] = cv
+    X_search, y_search = (X, y) if sample is None else (X[sample], y[sample])
+    if (return_oof or callback is not None) and trials is None:
+        from .trials import TrialStore
+
+        trials = TrialStore(":memory:")
+    schedule = contextlib.nullcontext()
+    if kwargs.get("n_jobs") == -1:
+        schedule = _schedule(spec, X_search, y_search, kwargs)
+    with schedule:
+        best_params, oof = _search(
+            name, spec, X_search, y_search, sample_weight, trials, kwargs, callback
+        )
+    # Fit the best combination of parameters on the data
+    with stage("fit", rows=len(y_fit)):
+        model = spec.build().set_params(**best_params).fit(X_fit, y_fit)
+    if return_oof:
+        return model, oof
+    return model
+
+
+@contextlib.contextmanager
+def _schedule(spec, X, y, kwargs):
+    """
+    Reserve the worker processes and threads of a grid search asking for
+    every core (n_jobs=-1) for the duration of the block, sized by
+    resources.reserve_search from one fit of the grid's last, usually
+    largest, candidate; sets the folds and n_jobs of the search kwargs
+    """
+    from sklearn.model_selection import ParameterGrid, check_cv
+
+    from .resources import reserve_search
+
+    folds = list(check_cv(kwargs.get("cv", 5), y, classifier=True).split(X, y))
+    grid = ParameterGrid(spec.grid())
+    largest = spec.build().set_params(**grid[len(grid) - 1])
+    with reserve_search(largest, X, y, folds, len(grid)) as plan:
+        kwargs["cv"], kwargs["n_jobs"] = folds, plan["processes"]
+        yield plan
+
+
+def _search(
+    name, spec, X_search, y_search, sample_weight, trials, kwargs, callback=None
+):
+    """
+    Best parameters of the grid search of a model, and the out-of-fold
+    predictions of the best candidate when the search runs on trials
+    """
+    from sklearn.model_selection import GridSearchCV, check_cv
+
+    oof = None
+    if trials is not None:
+        from .trials import TrialStore, grid_search
+
+        store = trials if isinstance(trials, TrialStore) else TrialStore(trials)
+        folds = list(
+            check_cv(kwargs.get("cv", 5), y_search, classifier=True).split(
+                X_search, y_search
+            )
+        )
+        n_jobs = kwargs.get("n_jobs")
+        best_params, _ = grid_search(
+            name, X_search, y_search, store, folds, sample_weight, n_jobs, callback
+        )
+        best = spec.build().set_params(**best_params)
+        oof = {
+            "proba": store.oof_proba(
+                best, X_search, y_search, folds, sample_weight, n_jobs
+            ),
+            "target": y_search,
+            "sample_weight": sample_weight,
+        }
+    else:
+        grid_obj = GridSearchCV(
+            spec.build(), spec.grid(), scoring=f1_scorer(), refit=False, **kwargs
+        )
+        fit_params = {} if sample_weight is None else {"sample_weight": sample_weight}
+        with stage("tune", rows=len(y_search)):
+            best_params = grid_obj.fit(X_search, y_search, **fit_params).best_params_
+    return best_params, oof
+
+
+def build_stacking(fitted):
+    """
+    Stacking classifier over the notebook's estimators, with unfitted
+    copies of the given models
+
+    fitted: dict of model name to fitted (or configured) estimator, holding
+        at least the names in STACKING_ESTIMATORS and STACKING_FINAL
+    """
+    from sklearn.base import clone
+    from sklearn.ensemble import StackingClassifier
+
+    return StackingClassifier(
+        estimators=[
+            (label, clone(fitted[name])) for label, name in STACKING_ESTIMATORS
+        ],
+        final_estimator=clone(fitted[STACKING_FINAL]),
+    )
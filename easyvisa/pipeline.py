@@ -0,0 +1,342 @@
+"""
+Resumable pipeline runner with fingerprinted stage checkpoints
+"""
+
+import functools
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict, namedtuple
+
+from .profiling import stage
+
+Stage = namedtuple("Stage", ["name", "inputs", "run", "params"])
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    sha256 of a file's content
+
+    path: file to hash
+    chunk_size: bytes read at a time
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Pipeline:
+    """
+    load -> clean [-> dedup] -> encode -> split -> tune:<model> ... ->
+    stack -> evaluate -> report, with every stage output checkpointed to disk
+
+    The fingerprint of a stage hashes its name, its parameters and the
+    fingerprints of its inputs, down to the content of the csv file. A
+    stage whose checkpoint carries the current fingerprint is skipped
+    without loading it, so a crashed run resumes after the last stage that
+    completed and a rerun after a change only repeats the stages
+    downstream of it.
+    """
+
+    def __init__(
+        self,
+        data_path,
+        directory,
+        models=None,
+        stack=True,
+        n_jobs=None,
+        dedup=False,
+        sample=None,
+        trials=None,
+    ):
+        """
+        data_path: EasyVisa csv file
+        directory: checkpoint directory
+        models: names from models.MODELS to tune, all of them by default
+        stack: whether to fit the notebook's stacking classifier
+        n_jobs: n_jobs of every grid search, the notebook's setting by
+            default; it does not change the results and is not fingerprinted
+        dedup: drop the applications equal to an earlier one (case_id aside)
+            before encoding; the notebook keeps them
+        sample: (strategy, size, ratio) of the training sample every grid
+            search runs on (see sampling.draw), the best parameters being
+            refit on all the training rows; the notebook searches on all of
+            them
+        trials: path of a trials.TrialStore the grid searches reuse and
+            extend; like n_jobs it does not change the results and is not
+            fingerprinted
+        """
+        from .models import MODELS, STACKING_ESTIMATORS, STACKING_FINAL
+
+        self.data_path = data_path
+        self.directory = directory
+        self.n_jobs = n_jobs
+        self.trials = trials
+        self.sample = None if sample is None else tuple(sample)
+        models = list(MODELS if models is None else models)
+        if stack:
+            required = [name for _, name in STACKING_ESTIMATORS] + [STACKING_FINAL]
+            models += [name for name in required if name not in models]
+        self.models = models
+
+        self.stages = OrderedDict()
+        self._add("load", [], functools.partial(_load, data_path))
+        self._add("clean", ["load"], _clean)
+        if dedup:
+            self._add("dedup", ["clean"], _dedup)
+        self._add("encode", ["dedup" if dedup else "clean"], _encode)
+        self._add("split", ["encode"], functools.partial(_split, 0.30, 1), 0.30, 1)
+        for name in models:
+            spec = MODELS[name]
+            grid = None if spec.grid is None else sorted(spec.grid().items())
+            self._add(
+                "tune:" + name,
+                ["encode", "split"],
+                self._tune(name),
+                repr(spec.build()),
+                repr(grid),
+                spec.search,
+                self.sample,
+            )
+        fitted = ["tune:" + name for name in models]
+        if stack:
+            self._add(
+                "stack",
+                ["encode", "split"] + fitted,
+                functools.partial(_stack, models=models),
+                models,
+            )
+            fitted.append("stack")
+        self._add(
+            "evaluate",
+            ["encode", "split"] + fitted,
+            functools.partial(_evaluate, models=models, stack=stack),
+            models,
+            stack,
+        )
+        self._add("report", ["encode", "evaluate"] + fitted, self._report)
+
+        self._fingerprints = {}
+        self._results = {}
+
+    def _add(self, name, inputs, run, *params):
+        """
+        Register a stage; run is called with the outputs of the inputs and
+        params only enter the fingerprint
+        """
+        self.stages[name] = Stage(name, inputs, run, params)
+
+    def _tune(self, name):
+        def run(store, split):
+            from .models import tune
+            from .sampling import tune_sampled
+
+            search = {} if self.n_jobs is None else {"n_jobs": self.n_jobs}
+            if self.trials is not None:
+                search["trials"] = self.trials
+            X_train, y_train = (
+                store.design_matrix()[split.train],
+                store.target[split.train],
+            )
+            if self.sample is not None:
+                return tune_sampled(name, X_train, y_train, *self.sample, **search)
+            return tune(name, X_train, y_train, **search)
+
+        return run
+
+    def _path(self, name, extension):
+        return os.path.join(self.directory, name.replace(":", "-") + extension)
+
+    def fingerprint(self, name):
+        """
+        Fingerprint of a stage's output
+
+        name: stage name
+        """
+        if name not in self._fingerprints:
+            stage_ = self.stages[name]
+            if name == "load":
+                params = [file_digest(self.data_path)]
+            else:
+                params = [repr(param) for param in stage_.params]
+            parts = [name] + params + [self.fingerprint(i) for i in stage_.inputs]
+            self._fingerprints[name] = hashlib.sha256(
+                "\0".join(parts).encode()
+            ).hexdigest()
+        return self._fingerprints[name]
+
+    def is_current(self, name):
+        """
+        Whether the checkpoint of a stage matches its fingerprint
+
+        name: stage name
+        """
+        try:
+            with open(self._path(name, ".json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return meta.get("fingerprint") == self.fingerprint(name) and os.path.exists(
+            self._path(name, ".joblib")
+        )
+
+    def result(self, name):
+        """
+        Output of a stage, loaded from its checkpoint when current and
+        computed (and checkpointed) otherwise
+
+        name: stage name
+        """
+        import joblib
+
+        if name not in self._results:
+            if self.is_current(name):
+                self._results[name] = joblib.load(self._path(name, ".joblib"))
+            else:
+                self._results[name] = self._execute(name)
+        return self._results[name]
+
+    def _execute(self, name):
+        import joblib
+
+        stage_ = self.stages[name]
+        inputs = [self.result(i) for i in stage_.inputs]
+        start = time.perf_counter()
+        with stage(name):
+            output = stage_.run(*inputs)
+        seconds = time.perf_counter() - start
+
+        os.makedirs(self.directory, exist_ok=True)
+        # write to temporary files first so a crash never leaves a checkpoint
+        # that looks current but is truncated
+        path = self._path(name, ".joblib")
+        joblib.dump(output, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        meta = {"fingerprint": self.fingerprint(name), "seconds": seconds}
+        with open(self._path(name, ".json") + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(self._path(name, ".json") + ".tmp", self._path(name, ".json"))
+        return output
+
+    def run(self, until=None, force=()):
+        """
+        Run every stage whose checkpoint is missing or outdated and return
+        the status of each stage
+
+        until: last stage to run, by default the whole pipeline
+        force: names of stages to recompute even if their checkpoint is current
+        """
+        for name in force:
+            self.invalidate(name)
+        status = OrderedDict()
+        for name in self.stages:
+            if self.is_current(name):
+                status[name] = "skipped"
+            else:
+                self.result(name)
+                status[name] = "ran"
+            if name == until:
+                break
+        return status
+
+    def invalidate(self, name):
+        """
+        Drop the checkpoints of a stage and of every stage downstream of it
+
+        name: stage name
+        """
+        for other in self.stages:
+            if other == name or self._depends(other, name):
+                self._results.pop(other, None)
+                if os.path.exists(self._path(other, ".json")):
+                    os.remove(self._path(other, ".json"))
+
+    def _depends(self, name, upstream):
+        inputs = self.stages[name].inputs
+        return upstream in inputs or any(self._depends(i, upstream) for i in inputs)
+
+    def _report(self, store, evaluation, *models):
+        """
+        Write the comparison tables and the feature importances of the best
+        model on the test set
+        """
+        os.makedirs(self._path("report", ""), exist_ok=True)
+        paths = {}
+        for part, comparison in evaluation.items():
+            paths[part] = os.path.join(self._path("report", ""), part + ".csv")
+            comparison.to_csv(paths[part])
+        best = evaluation["test"].loc["F1"].idxmax()
+        labels = list(evaluation["test"].columns)
+        model = models[labels.index(best)]
+        if hasattr(model, "feature_importances_"):
+            paths["importances"] = os.path.join(
+                self._path("report", ""), "importances.png"
+            )
+            from .attribution import plot_importances
+
+            plot_importances(model, paths["importances"], best)
+        return paths
+
+
+def _load(path):
+    from .data import load_visa
+
+    return load_visa(path)
+
+
+def _clean(data):
+    from .data import clean
+
+    return clean(data)
+
+
+def _dedup(data):
+    from .dedup import deduplicate
+
+    return deduplicate(data)
+
+
+def _encode(data):
+    from .features import FeatureStore
+
+    store = FeatureStore.from_frame(data)
+    store.design_matrix()
+    return store
+
+
+def _split(test_size, random_state, store):
+    from .split import stratified_split
+
+    return stratified_split(store.target, test_size, random_state)
+
+
+def _stack(store, split, *fitted, models):
+    from .models import build_stacking
+
+    stacking_classifier = build_stacking(dict(zip(models, fitted)))
+    X_train, y_train = store.design_matrix()[split.train], store.target[split.train]
+    return stacking_classifier.fit(X_train, y_train)
+
+
+def _evaluate(store, split, *fitted, models, stack):
+    import pandas as pd
+
+    from .metrics import model_performance_classification_sklearn
+    from .models import MODELS
+
+    labels = [MODELS[name].label for name in models]
+    if stack:
+        labels.append("Stacking Classifier")
+    evaluation = {}
+    for part, rows in [("train", split.train), ("test", split.test)]:
+        X, y = store.design_matrix()[rows], store.target[rows]
+        comparison = pd.concat(
+            [model_performance_classification_sklearn(m, X, y).T for m in fitted],
+            axis=1,
+        )
+        comparison.columns = labels
+        evaluation[part] = comparison
+    return evaluation
@@ -0,0 +1,330 @@
+"""
+Per-stage timers, counters and optional profiling of the pipeline
+
+Stages are timed with the stage() context manager or the timed()
+decorator; a stage entered again under its own name, on the same thread,
+is recorded once. Profiling is off unless the EASYVISA_PROFILE environment
+variable is set or PROFILER.enable() is called, and while it is off both
+cost one attribute lookup per call.
+"""
+
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, namedtuple
+
+Record = namedtuple(
+    "Record", ["name", "start", "wall", "cpu", "peak_memory", "rows", "thread"]
+)
+
+_NULL = contextlib.nullcontext()
+
+
+class _Stage:
+    """
+    Handle yielded by Profiler.stage; set rows once they are known
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+
+
+class Profiler:
+    """
+    Collects wall time, CPU time, peak traced memory and rows processed of
+    every stage, plus named counters
+
+    The records can be exported as a Chrome trace (chrome://tracing or
+    Perfetto) and summarized per stage. One stage can additionally be
+    profiled with cProfile, or sampled py-spy style by a background thread
+    that collects folded stacks of the thread running the stage.
+    """
+
+    def __init__(self, enabled=False, track_memory=False):
+        """
+        enabled: whether stages are recorded
+        track_memory: whether peak memory is traced with tracemalloc, which
+            slows down allocation-heavy code
+        """
+        self.enabled = enabled
+        self.track_memory = track_memory
+        self.profile_stage = None
+        self.profile_mode = "cprofile"
+        self.interval = 0.005
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def enable(self, track_memory=None):
+        """
+        Start recording
+
+        track_memory: override the tracemalloc setting
+        """
+        if track_memory is not None:
+            self.track_memory = track_memory
+        self.enabled = True
+
+    def disable(self):
+        """
+        Stop recording, keeping what was recorded so far
+        """
+        self.enabled = False
+
+    def reset(self):
+        """
+        Drop every record, counter and profile
+        """
+        self.records = []
+        self.counters = Counter()
+        self.profiles = {}
+        self.samples = Counter()
+        self._origin = time.perf_counter()
+
+    def profile(self, stage, mode="cprofile", interval=0.005):
+        """
+        Profile every run of one stage
+
+        stage: stage name
+        mode: "cprofile" for deterministic profiling or "sample" for
+            periodic stack sampling
+        interval: seconds between samples in "sample" mode
+        """
+        self.profile_stage = stage
+        self.profile_mode = mode
+        self.interval = interval
+
+    def stage(self, name, rows=None):
+        """
+        Context manager timing one stage
+
+        name: stage name, for example "load", "encode" or "fit"
+        rows: number of rows processed, if known upfront
+        """
+        if not self.enabled:
+            return _NULL
+        return self._stage(name, rows)
+
+    @contextlib.contextmanager
+    def _stage(self, name, rows):
+        active = getattr(self._local, "active", None)
+        if active is None:
+            active = self._local.active = {}
+        if name in active:
+            # a stage re-entered under its own name, a @timed function
+            # called inside stage() of the same name say, is recorded once
+            yield active[name]
+            return
+        handle = active[name] = _Stage(rows)
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        if self.track_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1][1] = max(stack[-1][1], peak)
+            tracemalloc.reset_peak()
+            stack.append([current, current])
+        profiler = sampler = None
+        if name == self.profile_stage:
+            if self.profile_mode == "cprofile":
+                profiler = cProfile.Profile()
+                profiler.enable()
+            else:
+                sampler = _Sampler(threading.get_ident(), self.interval)
+                sampler.start()
+        start = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield handle
+        finally:
+            del active[name]
+            wall = time.perf_counter() - start
+            cpu = time.process_time() - cpu
+            if profiler is not None:
+                profiler.disable()
+                self._add_profile(name, profiler)
+            if sampler is not None:
+                sampler.stop()
+                with self._lock:
+                    self.samples.update(sampler.stacks)
+            peak_memory = None
+            if self.track_memory and stack:
+                base, seen = stack.pop()
+                top = max(seen, tracemalloc.get_traced_memory()[1])
+                peak_memory = top - base
+                if stack:
+                    stack[-1][1] = max(stack[-1][1], top)
+            record = Record(
+                name,
+                start - self._origin,
+                wall,
+                cpu,
+                peak_memory,
+                handle.rows,
+                threading.get_ident(),
+            )
+            with self._lock:
+                self.records.append(record)
+
+    def _add_profile(self, name, profiler):
+        with self._lock:
+            if name in self.profiles:
+                self.profiles[name].add(profiler)
+            else:
+                self.profiles[name] = pstats.Stats(profiler)
+
+    def timed(self, name=None, rows=None):
+        """
+        Decorator timing every call of a function as a stage
+
+        name: stage name, by default the function name
+        rows: optional callable returning the rows processed from the
+            function's return value
+        """
+
+        def decorator(function):
+            stage_name = name or function.__name__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with self._stage(stage_name, None) as handle:
+                    result = function(*args, **kwargs)
+                    if rows is not None:
+                        handle.rows = rows(result)
+                    return result
+
+            return wrapper
+
+        return decorator
+
+    def count(self, name, value=1):
+        """
+        Add to a named counter
+
+        name: counter name
+        value: amount to add
+        """
+        if self.enabled:
+            with self._lock:
+                self.counters[name] += value
+
+    def summary(self):
+        """
+        Totals per stage: calls, wall and CPU seconds, peak memory, rows
+        and rows per second
+        """
+        import pandas as pd
+
+        columns = ["calls", "wall", "cpu", "peak_memory", "rows", "rows/s"]
+        if not self.records:
+            return pd.DataFrame(columns=columns)
+        records = pd.DataFrame(self.records, columns=Record._fields)
+        summary = records.groupby("name", sort=False).agg(
+            calls=("wall", "size"),
+            wall=("wall", "sum"),
+            cpu=("cpu", "sum"),
+            peak_memory=("peak_memory", "max"),
+            rows=("rows", "sum"),
+        )
+        summary["rows/s"] = summary["rows"] / summary["wall"]
+        return summary.sort_values("wall", ascending=False)[columns]
+
+    def chrome_trace(self, path):
+        """
+        Write the records and counters as Chrome trace event JSON
+
+        path: destination file
+        """
+        pid = os.getpid()
+        events = []
+        for record in self.records:
+            events.append(
+                {
+                    "name": record.name,
+                    "ph": "X",
+                    "ts": record.start * 1e6,
+                    "dur": record.wall * 1e6,
+                    "pid": pid,
+                    "tid": record.thread,
+                    "args": {
+                        "cpu": record.cpu,
+                        "peak_memory": record.peak_memory,
+                        "rows": record.rows,
+                    },
+                }
+            )
+        end = max((r.start + r.wall for r in self.records), default=0.0)
+        for name, value in self.counters.items():
+            events.append(
+                {
+                    "name": name,
+                    "ph": "C",
+                    "ts": end * 1e6,
+                    "pid": pid,
+                    "args": {name: value},
+                }
+            )
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def write_folded(self, path):
+        """
+        Write the sampled stacks in the folded format read by flamegraph.pl
+        and speedscope
+
+        path: destination file
+        """
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write("{} {}\n".format(stack, count))
+
+
+class _Sampler(threading.Thread):
+    """
+    Background thread sampling the stack of one thread at a fixed interval
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(
+                    "{} ({}:{})".format(
+                        code.co_name, os.path.basename(code.co_filename), frame.f_lineno
+                    )
+                )
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+PROFILER = Profiler(enabled=bool(os.environ.get("EASYVISA_PROFILE")))
+
+stage = PROFILER.stage
+timed = PROFILER.timed
+count = PROFILER.count
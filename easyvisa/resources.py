@@ -0,0 +1,368 @@
+"""
+Process and thread counts of parallel fits sized from the measured memory
+of a fit and the memory and CPUs available
+
+Searches running at the same time on one machine, in several processes,
+share a ledger file of the memory and CPUs each one planned for, so that
+every plan only counts what the others left (see reservation).
+"""
+
+import contextlib
+import itertools
+import os
+import tempfile
+import time
+import tracemalloc
+
+from .profiling import stage
+
+try:
+    import fcntl
+except ImportError:  # Windows: the ledger is not locked
+    fcntl = None
+
+# thread pools of the BLAS and OpenMP runtimes, read when they start
+THREAD_VARIABLES = [
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "BLIS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+]
+# estimator parameters holding a number of threads or joblib workers
+THREAD_PARAMS = ("n_jobs", "nthread")
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cpu_count():
+    """
+    CPUs this process may run on, within its affinity mask and its cgroup
+    CPU quota
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = _read("/sys/fs/cgroup/cpu.max")
+    if quota and not quota.startswith("max"):
+        limit, period = quota.split()
+        cpus = min(cpus, max(1, int(limit) // int(period)))
+    return cpus
+
+
+def available_memory():
+    """
+    Bytes that can be allocated without swapping: MemAvailable, capped by
+    the room left under the cgroup memory limit
+    """
+    available = None
+    meminfo = _read("/proc/meminfo")
+    if meminfo:
+        for line in meminfo.splitlines():
+            if line.startswith("MemAvailable:"):
+                available = int(line.split()[1]) * 1024
+    if available is None:
+        available = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    for limit_path, usage_path in [
+        ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory.current"),
+        (
+            "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+            "/sys/fs/cgroup/memory/memory.usage_in_bytes",
+        ),
+    ]:
+        limit, usage = _read(limit_path), _read(usage_path)
+        if limit and usage and limit.isdigit():
+            available = min(available, int(limit) - int(usage))
+    return max(0, available)
+
+
+def _status(field):
+    status = _read("/proc/self/status") or ""
+    for line in status.splitlines():
+        if line.startswith(field + ":"):
+            return int(line.split()[1]) * 1024
+    return None
+
+
+@contextlib.contextmanager
+def peak_memory():
+    """
+    Measure the peak memory allocated within the block, above what was
+    resident when it started
+
+    Yields a dict whose "bytes" entry is set when the block exits. On
+    Linux the peak resident set (VmHWM) is reset on entry, so the
+    allocations of compiled code count as well; elsewhere the peak traced
+    by tracemalloc is used, which only sees Python and numpy allocations.
+    """
+    result = {"bytes": None}
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        base = _status("VmRSS")
+    except OSError:
+        base = None
+    if base is None:
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        traced = tracemalloc.get_traced_memory()[0]
+    try:
+        yield result
+    finally:
+        if base is not None:
+            result["bytes"] = max(0, _status("VmHWM") - base)
+        else:
+            result["bytes"] = tracemalloc.get_traced_memory()[1] - traced
+            if started:
+                tracemalloc.stop()
+
+
+def with_threads(estimator, threads):
+    """
+    Copy of an estimator with the thread and joblib worker counts of it
+    and its nested estimators (n_jobs, XGBoost's nthread) set to threads
+    """
+    from sklearn.base import clone
+
+    estimator = clone(estimator)
+    params = estimator.get_params(deep=True)
+    estimator.set_params(
+        **{key: threads for key in params if key.split("__")[-1] in THREAD_PARAMS}
+    )
+    return estimator
+
+
+def fit_memory(estimator, X, y, rows):
+    """
+    Peak bytes allocated by one single-threaded fit of an estimator on
+    some rows, their copy included
+
+    estimator: unfitted estimator
+    X: design matrix
+    y: target
+    rows: index array of the rows, for example the training rows of a fold
+    """
+    import numpy as np
+
+    estimator = with_threads(estimator, 1)
+    with stage("measure_fit", rows=len(rows)):
+        with peak_memory() as peak:
+            estimator.fit(X[rows], np.asarray(y)[rows])
+    del estimator
+    return peak["bytes"]
+
+
+def plan(fit_bytes, n_tasks, memory=None, cpus=None, headroom=0.8):
+    """
+    Worker processes and threads per worker for n_tasks fits of
+    fit_bytes each
+
+    As many processes run as the CPUs, the tasks and headroom times the
+    available memory allow, and the CPUs left are shared out as threads
+    of the BLAS, OpenMP and estimator pools of every process, so
+    processes * threads never exceeds the CPUs. When not even one fit
+    fits, one process is planned and wait is set (see reservation).
+
+    fit_bytes: peak bytes of one fit (see fit_memory)
+    n_tasks: number of fits, for example candidates * folds
+    memory: bytes available, available_memory() by default
+    cpus: CPUs available, cpu_count() by default
+    headroom: fraction of the available memory the fits may take
+    """
+    memory = available_memory() if memory is None else memory
+    cpus = cpu_count() if cpus is None else cpus
+    fits = int(headroom * memory // max(fit_bytes, 1))
+    processes = max(1, min(cpus, n_tasks, fits))
+    return {
+        "processes": processes,
+        "threads": max(1, cpus // processes),
+        "fit_bytes": fit_bytes,
+        "memory": memory,
+        "wait": fits < 1,
+    }
+
+
+def wait_for_memory(nbytes, timeout=600.0, poll=5.0, headroom=0.8):
+    """
+    Block until nbytes fit in headroom times the available memory, so that
+    work started alongside other searches queues instead of overcommitting
+
+    Returns whether the memory became available within timeout seconds.
+
+    nbytes: bytes needed
+    timeout: seconds to wait at most
+    poll: seconds between checks
+    headroom: fraction of the available memory that may be taken
+    """
+    deadline = time.monotonic() + timeout
+    while headroom * available_memory() < nbytes:
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(poll)
+    return True
+
+
+@contextlib.contextmanager
+def limit_threads(threads):
+    """
+    Cap the BLAS and OpenMP thread pools of this process, and of the
+    processes and joblib workers started within the block, to threads
+
+    threads: threads per process
+    """
+    from joblib import parallel_config
+    from threadpoolctl import threadpool_limits
+
+    saved = {name: os.environ.get(name) for name in THREAD_VARIABLES}
+    os.environ.update({name: str(threads) for name in THREAD_VARIABLES})
+    try:
+        with threadpool_limits(threads):
+            with parallel_config(backend="loky", inner_max_num_threads=threads):
+                yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+_tokens = itertools.count()
+
+
+def ledger_path():
+    """
+    Ledger file of the reservations on this machine: $EASYVISA_LEDGER, or
+    easyvisa-resources.ledger in the temporary directory
+    """
+    return os.environ.get("EASYVISA_LEDGER") or os.path.join(
+        tempfile.gettempdir(), "easyvisa-resources.ledger"
+    )
+
+
+def _alive(pid):
+    if os.name == "nt":
+        # os.kill would terminate the process
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextlib.contextmanager
+def _ledger(path):
+    """
+    Lock the ledger and yield its live reservations as a list of [pid,
+    token, bytes, cpus], written back when the block exits; those of dead
+    processes are dropped
+    """
+    with open(path, "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0)
+            entries = []
+            for line in f.read().splitlines():
+                pid, token, nbytes, cpus = line.split()
+                if _alive(int(pid)):
+                    entries.append([int(pid), token, int(nbytes), int(cpus)])
+            yield entries
+            f.seek(0)
+            f.truncate()
+            f.writelines("{} {} {} {}\n".format(*entry) for entry in entries)
+            f.flush()
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def reserved(path=None):
+    """
+    Bytes and CPUs held by the live reservations of the ledger
+
+    path: ledger file, ledger_path() by default
+    """
+    with _ledger(path or ledger_path()) as entries:
+        return sum(entry[2] for entry in entries), sum(entry[3] for entry in entries)
+
+
+@contextlib.contextmanager
+def reservation(fit_bytes, n_tasks, headroom=0.8, timeout=600.0, poll=5.0, path=None):
+    """
+    Plan n_tasks fits of fit_bytes each (see plan) within the memory and
+    CPUs the other reservations of the ledger leave, hold processes *
+    fit_bytes bytes and processes * threads CPUs in the ledger for the
+    duration of the block, and cap the thread pools to the planned threads
+
+    Planning and recording happen under the ledger's lock, so concurrent
+    searches see each other's plans. When not even one fit fits, the
+    reservation waits for others to be released, polling every poll
+    seconds; after timeout seconds one process is planned anyway. The
+    reserved bytes are counted on top of the available memory even once
+    the fits have allocated them, which errs on the side of queuing.
+    Yields the plan.
+
+    fit_bytes: peak bytes of one fit (see fit_memory)
+    n_tasks: number of fits, for example candidates * folds
+    headroom: fraction of the available memory the fits may take
+    timeout: seconds to wait for memory at most
+    poll: seconds between checks of the ledger
+    path: ledger file, ledger_path() by default
+    """
+    path = path or ledger_path()
+    token = "{}.{}".format(os.getpid(), next(_tokens))
+    deadline = time.monotonic() + timeout
+    while True:
+        with _ledger(path) as entries:
+            memory = available_memory() - sum(entry[2] for entry in entries)
+            cpus = max(1, cpu_count() - sum(entry[3] for entry in entries))
+            planned = plan(fit_bytes, n_tasks, max(memory, 0), cpus, headroom)
+            if not planned["wait"] or time.monotonic() >= deadline:
+                processes, threads = planned["processes"], planned["threads"]
+                entries.append(
+                    [os.getpid(), token, processes * fit_bytes, processes * threads]
+                )
+                break
+        time.sleep(poll)
+    try:
+        with limit_threads(planned["threads"]):
+            yield planned
+    finally:
+        with _ledger(path) as entries:
+            entries[:] = [entry for entry in entries if entry[1] != token]
+
+
+@contextlib.contextmanager
+def reserve_search(estimator, X, y, folds, n_candidates, headroom=0.8):
+    """
+    reservation() of a cross-validated search, from the memory of one fit
+    of the estimator on the first fold; yields the plan
+
+    On one CPU nothing is measured and a single process is planned.
+
+    estimator: unfitted estimator, the most expensive candidate if known
+    X: design matrix
+    y: target
+    folds: list of (train, test) index arrays
+    n_candidates: number of parameter combinations
+    headroom: fraction of the available memory the fits may take
+    """
+    fit_bytes = 0
+    if cpu_count() > 1:
+        fit_bytes = fit_memory(estimator, X, y, folds[0][0])
+    with reservation(fit_bytes, n_candidates * len(folds), headroom) as planned:
+        yield planned
@@ -0,0 +1,247 @@
+"""
+Training samples for fast hyperparameter search: stratified subsamples,
+majority-class undersampling and importance-weighted coresets
+"""
+
+import time
+
+import numpy as np
+
+from .profiling import stage
+
+STRATEGIES = ["stratified", "undersample", "coreset"]
+
+
+def _size(size, n_rows):
+    """
+    Number of rows for a fraction (float up to 1) or a count (int)
+    """
+    if isinstance(size, float) and size <= 1:
+        size = int(round(size * n_rows))
+    return min(max(int(size), 1), n_rows)
+
+
+def stratified_sample(y, size=0.2, random_state=1):
+    """
+    Sorted index array of a subsample with the class proportions of y
+
+    y: target array
+    size: fraction of the rows or number of rows to keep
+    random_state: seed of the draw
+    """
+    from sklearn.model_selection import train_test_split
+
+    n_rows = _size(size, len(y))
+    if n_rows == len(y):
+        return np.arange(len(y))
+    sample, _ = train_test_split(
+        np.arange(len(y)), train_size=n_rows, stratify=y, random_state=random_state
+    )
+    return np.sort(sample)
+
+
+def undersample(y, ratio=1.0, random_state=1):
+    """
+    Every minority row and a random ratio * n_minority majority rows, with
+    the majority rows weighted up so that both classes keep their total
+    weight in the full data
+
+    With the weights, models that take the classes as they come, XGBoost's
+    scale_pos_weight included, see the class balance of the full data
+    while every fit of the search runs on a fraction of the Certified
+    rows. class_weight="balanced" is computed from the unweighted counts
+    of the sample, so on top of the weights it would give the M:m balance
+    of the full counts rather than 1:1; tune_sampled drops the weights
+    for such models, which balance the sample 1:1 by themselves.
+
+    y: 0/1 target array
+    ratio: majority rows kept per minority row
+    random_state: seed of the draw
+    """
+    rng = np.random.default_rng(random_state)
+    counts = np.bincount(y, minlength=2)
+    minority = int(np.argmin(counts))
+    majority = np.flatnonzero(y != minority)
+    kept = min(len(majority), int(round(ratio * counts[minority])))
+    chosen = rng.choice(majority, kept, replace=False)
+    sample = np.sort(np.concatenate([np.flatnonzero(y == minority), chosen]))
+    weights = np.ones(len(sample))
+    weights[y[sample] != minority] = len(majority) / kept
+    return sample, weights
+
+
+def coreset(X, y, size=0.2, random_state=1):
+    """
+    Lightweight coreset: rows drawn per class with probability mixing the
+    uniform one with the squared distance to the class mean, weighted by
+    the inverse of that probability
+
+    Outlying applications, which shape the tree splits the most, are
+    drawn more often than under uniform sampling, and the weights keep
+    every class at its total weight in the full data. Rows drawn several
+    times appear once with their weights summed.
+
+    X: design matrix, dense or CSR
+    y: target array
+    size: fraction of the rows or number of draws
+    random_state: seed of the draw
+    """
+    rng = np.random.default_rng(random_state)
+    n_draws = _size(size, len(y))
+    squared = X.multiply(X) if hasattr(X, "multiply") else X * X
+    mean = np.asarray(X.mean(axis=0), dtype=np.float64).ravel()
+    variance = np.asarray(squared.mean(axis=0), dtype=np.float64).ravel() - mean**2
+    inverse = 1 / np.where(variance > 0, variance, 1)
+    samples, weights = [], []
+    for label in np.unique(y):
+        rows = np.flatnonzero(y == label)
+        center = np.asarray(X[rows].mean(axis=0), dtype=np.float64).ravel()
+        # sum of (x - center)^2 / variance expanded, so a CSR X stays sparse
+        distance = (
+            squared[rows] @ inverse
+            - 2 * (X[rows] @ (center * inverse))
+            + (center**2 * inverse).sum()
+        )
+        distance = np.maximum(np.asarray(distance).ravel(), 0)
+        q = 0.5 / len(rows) + 0.5 * distance / max(distance.sum(), 1e-300)
+        q /= q.sum()
+        draws = max(1, int(round(n_draws * len(rows) / len(y))))
+        drawn, times = np.unique(rng.choice(len(rows), draws, p=q), return_counts=True)
+        samples.append(rows[drawn])
+        weights.append(times / (draws * q[drawn]))
+    sample = np.concatenate(samples)
+    order = np.argsort(sample)
+    return sample[order], np.concatenate(weights)[order]
+
+
+def draw(strategy, X, y, size=0.2, ratio=1.0, random_state=1):
+    """
+    Index array of a training sample and the sample weights of its rows,
+    None when the rows are unweighted
+
+    strategy: one of STRATEGIES
+    X: design matrix
+    y: target array
+    size: fraction or number of rows for "stratified" and "coreset"
+    ratio: majority rows kept per minority row for "undersample"
+    random_state: seed of the draw
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError("strategy must be one of {}".format(STRATEGIES))
+    with stage("sample", rows=len(y)):
+        if strategy == "stratified":
+            return stratified_sample(y, size, random_state), None
+        if strategy == "undersample":
+            return undersample(y, ratio, random_state)
+        return coreset(X, y, size, random_state)
+
+
+def tune_sampled(
+    name, X, y, strategy="stratified", size=0.2, ratio=1.0, random_state=1, **search
+):
+    """
+    Grid search a model on a sample of X, y and refit the best combination
+    of parameters on all of X, y
+
+    An undersample is searched without its weights when the model weighs
+    the classes with class_weight="balanced" (see undersample); the
+    out-of-fold predictions returned with return_oof keep them, so that a
+    calibration fitted on them sees the class balance of the full data.
+
+    name: key of models.MODELS
+    X: design matrix
+    y: target
+    strategy: one of STRATEGIES
+    size: fraction or number of rows, see draw
+    ratio: majority rows per minority row, see draw
+    random_state: seed of the sample
+    search: extra GridSearchCV arguments
+    """
+    from .models import tune
+
+    sample, weights = draw(strategy, X, y, size, ratio, random_state)
+    search_weights = weights
+    if strategy == "undersample" and _balances_classes(name):
+        search_weights = None
+    result = tune(name, X, y, sample=sample, sample_weight=search_weights, **search)
+    if search.get("return_oof") and result[1] is not None:
+        result[1]["sample_weight"] = weights
+    return result
+
+
+def _balances_classes(name):
+    """
+    Whether the grid candidates of a model, or estimators nested in them,
+    weigh the classes with class_weight="balanced"
+    """
+    from sklearn.model_selection import ParameterGrid
+
+    from .models import MODELS
+
+    spec = MODELS[name]
+    estimator = spec.build()
+    if spec.grid is not None:
+        estimator.set_params(**ParameterGrid(spec.grid())[0])
+    params = estimator.get_params(deep=True)
+    return any(
+        key.split("__")[-1] == "class_weight" and value == "balanced"
+        for key, value in params.items()
+    )
+
+
+def sampling_report(
+    names,
+    X_train,
+    y_train,
+    X_test,
+    y_test,
+    strategies=STRATEGIES,
+    size=0.2,
+    ratio=1.0,
+    **search,
+):
+    """
+    Test F1 and tuning time of models tuned on the full training data and
+    on samples of it, every model being refit on the full training data
+
+    Returns a frame indexed by (model, strategy) with the test F1, its
+    difference to the full search (f1_loss), the seconds spent and the
+    fraction of them saved.
+
+    names: keys of models.MODELS
+    X_train: training design matrix
+    y_train: training target
+    X_test: test design matrix
+    y_test: test target
+    strategies: sampling strategies compared with the full search
+    size: fraction or number of rows, see draw
+    ratio: majority rows per minority row, see draw
+    search: extra GridSearchCV arguments
+    """
+    import pandas as pd
+    from sklearn.metrics import f1_score
+
+    from .models import tune
+
+    report = {}
+    for name in names:
+        for strategy in ["full"] + list(strategies):
+            start = time.perf_counter()
+            if strategy == "full":
+                model = tune(name, X_train, y_train, **search)
+            else:
+                model = tune_sampled(
+                    name, X_train, y_train, strategy, size, ratio, **search
+                )
+            report[name, strategy] = {
+                "F1": f1_score(y_test, model.predict(X_test)),
+                "seconds": time.perf_counter() - start,
+            }
+    report = pd.DataFrame(report).T.rename_axis(["model", "strategy"])
+    full = report.xs("full", level="strategy")
+    models = report.index.get_level_values("model")
+    report["f1_loss"] = full["F1"].reindex(models).to_numpy() - report["F1"]
+    report["time_saved"] = (
+        1 - report["seconds"] / full["seconds"].reindex(models).to_numpy()
+    )
+    return report
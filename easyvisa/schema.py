@@ -0,0 +1,80 @@
+"""
+Column names and category levels of the EasyVisa data
+"""
+
+ID_COLUMN = "case_id"
+TARGET = "case_status"
+POSITIVE_CLASS = "Certified"
+
+# Columns in the order of the data dictionary
+RAW_COLUMNS = [
+    "case_id",
+    "continent",
+    "education_of_employee",
+    "has_job_experience",
+    "requires_job_training",
+    "no_of_employees",
+    "yr_of_estab",
+    "region_of_employment",
+    "prevailing_wage",
+    "unit_of_wage",
+    "full_time_position",
+    "case_status",
+]
+
+# Category levels sorted the way pd.get_dummies sorts them, so the first level
+# of every list is the one dropped by drop_first=True
+CATEGORIES = {
+    "continent": [
+        "Africa",
+        "Asia",
+        "Europe",
+        "North America",
+        "Oceania",
+        "South America",
+    ],
+    "education_of_employee": ["Bachelor's", "Doctorate", "High School", "Master's"],
+    "region_of_employment": ["Island", "Midwest", "Northeast", "South", "West"],
+    "unit_of_wage": ["Hour", "Month", "Week", "Year"],
+}
+
+# Y/N columns
+FLAGS = ["has_job_experience", "requires_job_training", "full_time_position"]
+
+# Numeric columns and the dtype used to hold them
+NUMERIC = {
+    "no_of_employees": "int32",
+    "yr_of_estab": "int32",
+    "prevailing_wage": "float32",
+}
+
+# Every predictor, in the order of the data dictionary
+FEATURES = [c for c in RAW_COLUMNS if c not in (ID_COLUMN, TARGET)]
+
+
+def dummy_columns():
+    """
+    Column names produced by pd.get_dummies(X, drop_first=True) on the
+    cleaned predictors: numeric columns first, then one column for every
+    non-first level of each categorical and Y/N column
+    """
+    columns = [c for c in FEATURES if c in NUMERIC]
+    for column in FEATURES:
+        if column in CATEGORIES:
+            columns += [column + "_" + level for level in CATEGORIES[column][1:]]
+        elif column in FLAGS:
+            columns.append(column + "_Y")
+    return columns
+
+
+def dummy_sources():
+    """
+    Predictor encoded by every column of dummy_columns(), in the same order
+    """
+    sources = [c for c in FEATURES if c in NUMERIC]
+    for column in FEATURES:
+        if column in CATEGORIES:
+            sources += [column] * (len(CATEGORIES[column]) - 1)
+        elif column in FLAGS:
+            sources.append(column)
+    return sources
@@ -0,0 +1,195 @@
+"""
+Scoring of applications with a saved model
+"""
+
+import numpy as np
+
+from .profiling import stage
+from .schema import FEATURES, ID_COLUMN, dummy_columns
+
+
+def save_model(path, model, name, **metadata):
+    """
+    Write a fitted model and its metadata as one joblib artifact
+
+    path: destination file
+    model: fitted classifier trained on FeatureStore.design_matrix()
+    name: model name, for example a key of models.MODELS
+    metadata: extra entries stored with the model, such as the
+        calibration applied by Scorer
+    """
+    import joblib
+
+    artifact = dict(metadata, model=model, name=name, feature_names=dummy_columns())
+    artifact.setdefault("version", name)
+    joblib.dump(artifact, path)
+
+
+class Scorer:
+    """
+    Scores FeatureStores or raw application frames with one fitted model
+    """
+
+    def __init__(
+        self,
+        model,
+        name="model",
+        version=None,
+        threshold=0.5,
+        calibration=None,
+        cache=None,
+        encoder=None,
+    ):
+        """
+        model: fitted classifier with predict_proba
+        name: model name
+        version: identifier of the fitted model, by default its name
+        threshold: probability of certification above which a case is
+            predicted Certified
+        calibration: calibration.Calibration applied to the probabilities
+            of the model, none by default
+        cache: cache.PredictionCache consulted before the model, none by
+            default; it is emptied whenever it sees another model version
+        encoder: sparse.SparseEncoder or encoding.TargetEncoder turning a
+            cleaned dataframe and its FeatureStore into the model's input,
+            none by default for the design matrix; such a model scores
+            dataframes with score_frame only
+        """
+        self.model = model
+        self.name = name
+        self.version = version or name
+        self.threshold = threshold
+        self.calibration = calibration
+        self.cache = cache
+        self.encoder = encoder
+
+    @classmethod
+    def load(cls, path, threshold=0.5, cache=None):
+        """
+        Create a scorer from an artifact written by save_model
+
+        path: artifact file
+        threshold: decision threshold on the probability of certification
+        cache: cache.PredictionCache of the scorer
+        """
+        import joblib
+
+        artifact = joblib.load(path)
+        if artifact["feature_names"] != dummy_columns():
+            raise ValueError(
+                "{} was trained on different features than this schema".format(path)
+            )
+        return cls(
+            artifact["model"],
+            artifact["name"],
+            artifact["version"],
+            threshold,
+            artifact.get("calibration"),
+            cache,
+            artifact.get("encoder"),
+        )
+
+    def predict_proba(self, store):
+        """
+        Probability of certification of every row
+
+        With a cache, only the rows missing from it are evaluated, and rows
+        sharing a key within the batch are evaluated once.
+
+        store: FeatureStore
+        """
+        if self.encoder is not None:
+            raise ValueError(
+                "{} is fitted on the output of {}, score it with score_frame".format(
+                    self.name, type(self.encoder).__name__
+                )
+            )
+        with stage("predict", rows=len(store)):
+            if self.cache is None:
+                return self._predict(store.design_matrix())
+            self.cache.bind(self.version)
+            keys = self.cache.keys(store)
+            proba = self.cache.lookup(keys)
+            missing = np.flatnonzero(np.isnan(proba))
+            if len(missing):
+                unique, first, inverse = np.unique(
+                    keys[missing], return_index=True, return_inverse=True
+                )
+                computed = self._predict(store.design_matrix()[missing[first]])
+                proba[missing] = computed[inverse]
+                self.cache.update(unique, computed)
+            return proba
+
+    def _predict(self, X):
+        proba = self.model.predict_proba(X)[:, 1]
+        if self.calibration is not None:
+            proba = self.calibration(proba)
+        return proba
+
+    def score_arrow(self, data):
+        """
+        Score raw applications held in Arrow and return a record batch of
+        case_id, probability and prediction (see arrow.score_arrow)
+
+        data: pyarrow RecordBatch or Table with the columns of
+            arrow.schema()
+        """
+        from .arrow import score_arrow
+
+        return score_arrow(self, data)
+
+    def score_ipc(self, source, sink):
+        """
+        Score an Arrow IPC stream of raw applications into an IPC stream of
+        scores, one record batch at a time; returns the rows scored
+
+        source: path, bytes or readable file of the input stream
+        sink: path or writable binary file of the output stream
+        """
+        from .arrow import score_ipc
+
+        return score_ipc(self, source, sink)
+
+    def score_frame(self, data, reasons=0):
+        """
+        Score raw applications and return case_id, probability and decision
+
+        data: dataframe as read by data.load_visa
+        reasons: number of predictors pushing every case most towards
+            denial and towards certification attached as reason codes, from
+            the TreeSHAP contributions of the model
+        """
+        import pandas as pd
+
+        from .data import clean
+        from .features import FeatureStore
+
+        cleaned = clean(data)
+        store = FeatureStore.from_frame(cleaned)
+        if self.encoder is None:
+            proba = self.predict_proba(store)
+        else:
+            with stage("predict", rows=len(store)):
+                proba = self._predict(self.encoder.transform(cleaned, store))
+        scores = pd.DataFrame(
+            {
+                "probability": proba,
+                "prediction": np.where(proba > self.threshold, "Certified", "Denied"),
+            },
+            index=data.index,
+        )
+        if ID_COLUMN in data:
+            scores.insert(0, ID_COLUMN, data[ID_COLUMN])
+        if reasons:
+            if self.encoder is not None:
+                raise ValueError("no reason codes for models with an encoder")
+            from .attribution import group_contributions, reason_codes
+            from .attribution import tree_contributions
+
+            contributions = group_contributions(
+                tree_contributions(self.model, store.design_matrix())
+            )
+            codes = reason_codes(contributions, FEATURES, reasons)
+            codes.index = data.index
+            scores = scores.join(codes)
+        return scores
@@ -0,0 +1,166 @@
+"""
+CSR one-hot encoding of high-cardinality extra columns, next to the
+EasyVisa predictors
+"""
+
+import numpy as np
+
+from .profiling import stage
+from .schema import CATEGORIES, FEATURES, FLAGS, NUMERIC, dummy_columns
+
+
+def _base_slots(store):
+    """
+    (column, value) of every row in each of the FeatureStore predictors,
+    as (n_rows, n_predictors) arrays laid out like design_matrix(), with
+    zero values where the dummy column is not set
+    """
+    n_rows = len(store)
+    columns = np.zeros((n_rows, len(FEATURES)), dtype=np.int32)
+    values = np.zeros((n_rows, len(FEATURES)), dtype=np.float32)
+    slot = j = 0
+    for column in FEATURES:
+        if column in NUMERIC:
+            columns[:, slot] = j
+            values[:, slot] = store.column(column)
+            slot += 1
+            j += 1
+    for column in FEATURES:
+        if column in CATEGORIES:
+            codes = store.column(column).astype(np.int32)
+            # the first level is dropped and unseen levels (MISSING_CODE) have
+            # no dummy: their rows keep a zero value in the first column
+            known = (codes > 0) & (codes < len(CATEGORIES[column]))
+            columns[:, slot] = j + np.where(known, codes - 1, 0)
+            values[:, slot] = known
+            j += len(CATEGORIES[column]) - 1
+        elif column in FLAGS:
+            columns[:, slot] = j
+            values[:, slot] = store.column(column)
+            j += 1
+        else:
+            continue
+        slot += 1
+    return columns, values
+
+
+class SparseEncoder:
+    """
+    One-hot encoding of extra categorical columns (job title, SOC code,
+    employer name, worksite state...) into a CSR matrix appended to the
+    design matrix columns
+
+    Every extra column gets either a vocabulary of its most frequent
+    values, capped in size and in minimum count, plus one column for all
+    the other values, or a fixed number of hash buckets. A row holds one
+    non-zero per extra column, so the matrix grows with the rows and not
+    with the size of the vocabularies; the tree models and XGBoost train
+    and predict on it directly.
+    """
+
+    def __init__(
+        self, columns, max_categories=1000, min_frequency=5, hash_buckets=None
+    ):
+        """
+        columns: names of the extra columns
+        max_categories: largest vocabulary of a column
+        min_frequency: fewest training rows a value needs to get a column
+        hash_buckets: number of hash buckets per column; when set, values
+            are hashed instead of looked up and nothing needs fitting
+        """
+        self.columns = list(columns)
+        self.max_categories = max_categories
+        self.min_frequency = min_frequency
+        self.hash_buckets = hash_buckets
+        self.vocabularies = {}
+
+    def fit(self, data):
+        """
+        Learn the vocabulary of every extra column
+
+        data: dataframe holding the extra columns, the training rows only
+        """
+        if self.hash_buckets:
+            return self
+        for column in self.columns:
+            counts = data[column].astype(str).value_counts()
+            counts = counts[counts >= self.min_frequency][: self.max_categories]
+            self.vocabularies[column] = list(counts.index)
+        return self
+
+    def widths(self):
+        """
+        Number of columns encoding every extra column
+        """
+        if self.hash_buckets:
+            return [self.hash_buckets] * len(self.columns)
+        return [len(self.vocabularies[column]) + 1 for column in self.columns]
+
+    @property
+    def feature_names(self):
+        """
+        Names of the columns of transform(): dummy_columns() then the
+        encoded extra columns
+        """
+        names = dummy_columns()
+        for column in self.columns:
+            if self.hash_buckets:
+                names += [
+                    "{}_hash{}".format(column, i) for i in range(self.hash_buckets)
+                ]
+            else:
+                names += [column + "_" + value for value in self.vocabularies[column]]
+                names.append(column + "_other")
+        return names
+
+    def codes(self, values, column):
+        """
+        Column of every value within the encoding of one extra column
+
+        values: series of the extra column
+        column: its name
+        """
+        import pandas as pd
+
+        if self.hash_buckets:
+            hashes = pd.util.hash_pandas_object(values.astype(str), index=False)
+            return (hashes.to_numpy() % np.uint64(self.hash_buckets)).astype(np.int32)
+        vocabulary = self.vocabularies[column]
+        codes = pd.Categorical(values.astype(str), categories=vocabulary).codes
+        return np.where(codes < 0, len(vocabulary), codes).astype(np.int32)
+
+    def transform(self, data, store):
+        """
+        float32 CSR matrix of the predictors of a store and the extra
+        columns of the matching dataframe
+
+        data: cleaned dataframe holding the extra columns
+        store: FeatureStore encoded from the same rows
+        """
+        from scipy import sparse
+
+        with stage("sparse_encode", rows=len(store)):
+            columns, values = _base_slots(store)
+            offset = len(dummy_columns())
+            extra_columns, extra_values = [columns], [values]
+            for column, width in zip(self.columns, self.widths()):
+                extra_columns.append(offset + self.codes(data[column], column)[:, None])
+                extra_values.append(np.ones((len(store), 1), dtype=np.float32))
+                offset += width
+            columns = np.hstack(extra_columns)
+            values = np.hstack(extra_values)
+            indptr = np.arange(0, columns.size + 1, columns.shape[1], dtype=np.int64)
+            matrix = sparse.csr_matrix(
+                (values.ravel(), columns.ravel(), indptr), shape=(len(store), offset)
+            )
+            matrix.eliminate_zeros()
+        return matrix
+
+    def fit_transform(self, data, store):
+        """
+        fit on data, then transform it
+
+        data: cleaned dataframe holding the extra columns
+        store: FeatureStore encoded from the same rows
+        """
+        return self.fit(data).transform(data, store)
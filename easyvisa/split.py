@@ -0,0 +1,214 @@
+"""
+Train/test and cross-validation splits as index arrays into a FeatureStore
+"""
+
+import hashlib
+from collections import namedtuple
+
+import numpy as np
+
+from .profiling import timed
+
+Split = namedtuple("Split", ["train", "test"])
+
+
+def _rows(split):
+    return len(split.train) + len(split.test)
+
+
+@timed("split", rows=_rows)
+def stratified_split(y, test_size=0.30, random_state=1):
+    """
+    Stratified holdout split returning index arrays
+
+    Uses the same StratifiedShuffleSplit draw as
+    train_test_split(X, Y, test_size=test_size, random_state=random_state, stratify=Y),
+    so X[split.train] matches the notebook's X_train row for row.
+
+    y: target array
+    test_size: fraction of rows in the test set
+    random_state: seed of the shuffle
+    """
+    from sklearn.model_selection import StratifiedShuffleSplit
+
+    splitter = StratifiedShuffleSplit(
+        n_splits=1, test_size=test_size, random_state=random_state
+    )
+    train, test = next(splitter.split(np.zeros((len(y), 1)), y))
+    return Split(train, test)
+
+
+@timed("split")
+def stratified_folds(y, n_splits=5, n_repeats=1, random_state=1):
+    """
+    Repeated stratified K-fold splits returning index arrays
+
+    y: target array
+    n_splits: number of folds
+    n_repeats: number of times the K-fold is repeated with a new shuffle
+    random_state: seed of the shuffles
+    """
+    from sklearn.model_selection import RepeatedStratifiedKFold
+
+    splitter = RepeatedStratifiedKFold(
+        n_splits=n_splits, n_repeats=n_repeats, random_state=random_state
+    )
+    return [
+        Split(train, test) for train, test in splitter.split(np.zeros((len(y), 1)), y)
+    ]
+
+
+@timed("split", rows=_rows)
+def time_split(values, test_size=0.30):
+    """
+    Holdout split on a time column: the latest periods form the test set
+
+    The cut is placed on a period boundary so that no period is shared by
+    both sides; the test set therefore holds roughly test_size of the rows.
+    Raises ValueError when the earliest period alone already reaches the
+    cut, which would leave no training rows.
+
+    values: array of years or dates
+    test_size: fraction of rows in the test set, strictly between 0 and 1
+    """
+    if not 0 < test_size < 1:
+        raise ValueError("test_size must be between 0 and 1, got {}".format(test_size))
+    values = np.asarray(values)
+    cutoff = np.sort(values, kind="stable")[int(len(values) * (1 - test_size))]
+    train = np.flatnonzero(values < cutoff)
+    if not len(train):
+        raise ValueError(
+            "no period precedes the cutoff {}: the training set would be "
+            "empty".format(cutoff)
+        )
+    return Split(train, np.flatnonzero(values >= cutoff))
+
+
+@timed("split")
+def time_folds(values, n_splits=5):
+    """
+    Expanding-window splits on a time column: every split trains on all
+    periods before a boundary and tests on the periods up to the next one
+
+    values: array of years or dates
+    n_splits: number of splits
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == "M":
+        # np.quantile takes no datetime64: split on the int64 ticks
+        values = values.view(np.int64)
+    boundaries = np.unique(
+        np.quantile(values, np.linspace(0, 1, n_splits + 2)[1:], method="nearest")
+    )
+    folds = []
+    for start, stop in zip(boundaries[:-1], boundaries[1:]):
+        test = (values >= start) & (values < stop)
+        if stop == boundaries[-1]:
+            test |= values == stop
+        folds.append(Split(np.flatnonzero(values < start), np.flatnonzero(test)))
+    return folds
+
+
+class Splitter:
+    """
+    Cache of the splits of one FeatureStore
+
+    Every split is computed once and shared as index arrays by tuning,
+    evaluation and benchmarking; nothing here copies the feature matrix.
+    Folds are returned as global row indices, so they can be passed as
+    cv= to a search fitted on the full design matrix (with refit=False)
+    without materializing X_train.
+    """
+
+    def __init__(self, store):
+        """
+        store: FeatureStore with a target
+        """
+        self.store = store
+        self._cache = {}
+
+    def _cached(self, key, make):
+        if key not in self._cache:
+            self._cache[key] = make()
+        return self._cache[key]
+
+    def holdout(self, test_size=0.30, random_state=1):
+        """
+        Stratified holdout split, the notebook's 70:30 by default
+
+        test_size: fraction of rows in the test set
+        random_state: seed of the shuffle
+        """
+        return self._cached(
+            ("holdout", test_size, random_state),
+            lambda: stratified_split(self.store.target, test_size, random_state),
+        )
+
+    def folds(self, n_splits=5, n_repeats=1, random_state=1, within=None):
+        """
+        Repeated stratified K-fold over the rows in within
+
+        n_splits: number of folds
+        n_repeats: number of times the K-fold is repeated
+        random_state: seed of the shuffles
+        within: index array of the rows to split, by default the training
+            rows of the default holdout
+        """
+        within = self.holdout().train if within is None else np.asarray(within)
+        key = (
+            "folds",
+            n_splits,
+            n_repeats,
+            random_state,
+            hashlib.sha1(np.ascontiguousarray(within).tobytes()).hexdigest(),
+        )
+
+        def make():
+            folds = stratified_folds(
+                self.store.target[within], n_splits, n_repeats, random_state
+            )
+            return [Split(within[train], within[test]) for train, test in folds]
+
+        return self._cached(key, make)
+
+    def by_time(self, column="yr_of_estab", test_size=0.30):
+        """
+        Holdout split on a time column of the store
+
+        column: name of a store column, or an array of dates aligned with
+            the store (for example the filing date, when available)
+        test_size: fraction of rows in the test set
+        """
+        values = self._time_values(column)
+        key = ("time", _key(column), test_size)
+        return self._cached(key, lambda: time_split(values, test_size))
+
+    def time_folds(self, column="yr_of_estab", n_splits=5):
+        """
+        Expanding-window splits on a time column of the store
+
+        column: name of a store column or an array of dates
+        n_splits: number of splits
+        """
+        values = self._time_values(column)
+        key = ("time_folds", _key(column), n_splits)
+        return self._cached(key, lambda: time_folds(values, n_splits))
+
+    def _time_values(self, column):
+        if isinstance(column, str):
+            return self.store.column(column)
+        return np.asarray(column)
+
+    def arrays(self, indices):
+        """
+        Rows of the design matrix and target selected by an index array
+
+        indices: index array, for example split.train
+        """
+        return self.store.design_matrix()[indices], self.store.target[indices]
+
+
+def _key(column):
+    if isinstance(column, str):
+        return column
+    return hashlib.sha1(np.ascontiguousarray(column).tobytes()).hexdigest()
@@ -0,0 +1,193 @@
+"""
+Seeded synthetic EasyVisa applications with the shape of the real data,
+generated in chunks
+"""
+
+import numpy as np
+
+from .profiling import stage
+from .schema import NUMERIC, POSITIVE_CLASS, RAW_COLUMNS
+
+# Summaries of the 25,480 applications of the EDA: the share of every level
+# and the share of its applications that were certified
+CERTIFIED_RATE = 0.668
+LEVELS = {
+    "continent": {
+        "Africa": (0.022, 0.721),
+        "Asia": (0.662, 0.653),
+        "Europe": (0.146, 0.792),
+        "North America": (0.129, 0.619),
+        "Oceania": (0.008, 0.635),
+        "South America": (0.033, 0.579),
+    },
+    "education_of_employee": {
+        "Bachelor's": (0.402, 0.622),
+        "Doctorate": (0.086, 0.872),
+        "High School": (0.134, 0.340),
+        "Master's": (0.378, 0.786),
+    },
+    "region_of_employment": {
+        "Island": (0.015, 0.603),
+        "Midwest": (0.169, 0.755),
+        "Northeast": (0.282, 0.629),
+        "South": (0.275, 0.700),
+        "West": (0.259, 0.623),
+    },
+    "unit_of_wage": {
+        "Hour": (0.085, 0.346),
+        "Month": (0.003, 0.618),
+        "Week": (0.011, 0.621),
+        "Year": (0.901, 0.699),
+    },
+    "has_job_experience": {"N": (0.419, 0.561), "Y": (0.581, 0.745)},
+    "requires_job_training": {"N": (0.884, 0.666), "Y": (0.116, 0.679)},
+    "full_time_position": {"N": (0.106, 0.685), "Y": (0.894, 0.666)},
+}
+# median and log standard deviation of the prevailing wage in every unit
+WAGES = {
+    "Hour": (370.0, 0.6),
+    "Week": (78000.0, 0.55),
+    "Month": (80000.0, 0.55),
+    "Year": (72000.0, 0.5),
+}
+# mean prevailing wage of every region over the mean of all applications
+REGION_WAGES = {
+    "Island": 1.23,
+    "Midwest": 1.23,
+    "Northeast": 0.91,
+    "South": 0.99,
+    "West": 0.94,
+}
+# median and log standard deviation of the employees and of the age of the
+# employer in 2016, share of negative employee counts (fixed by clean())
+EMPLOYEES = (2100.0, 1.4, 33 / 25480)
+AGE = (19.0, 1.1)
+MAX_EMPLOYEES = 602069
+MAX_WAGE = 319210.27
+
+
+def _conditional_tables():
+    """
+    Cumulative distribution of the levels of every categorical and Y/N
+    column given a denied (row 0) and a certified (row 1) application
+    """
+    tables = {}
+    for column, levels in LEVELS.items():
+        shares, rates = np.array(list(levels.values())).T
+        given = np.vstack([shares * (1 - rates), shares * rates])
+        given /= given.sum(axis=1, keepdims=True)
+        tables[column] = np.cumsum(given, axis=1)
+    return tables
+
+
+_TABLES = _conditional_tables()
+
+
+def _draw(rng, cumulative, status):
+    """
+    Level codes drawn from the row of a cumulative table of every status
+    """
+    u = rng.random(len(status))
+    rows = cumulative[status]
+    codes = np.zeros(len(status), dtype=np.int8)
+    for j in range(cumulative.shape[1] - 1):
+        codes += u >= rows[:, j]
+    return codes
+
+
+def _lognormal(rng, median, sigma, size):
+    return median * np.exp(sigma * rng.standard_normal(size, dtype=np.float32))
+
+
+def _chunk(rng, start, stop, case_ids):
+    import pandas as pd
+
+    n = stop - start
+    status = (rng.random(n) < CERTIFIED_RATE).astype(np.intp)
+    codes = {column: _draw(rng, table, status) for column, table in _TABLES.items()}
+
+    units = list(LEVELS["unit_of_wage"])
+    median = np.array([WAGES[unit][0] for unit in units], dtype=np.float32)
+    sigma = np.array([WAGES[unit][1] for unit in units], dtype=np.float32)
+    region = np.array(
+        [REGION_WAGES[r] for r in LEVELS["region_of_employment"]], dtype=np.float32
+    )
+    unit = codes["unit_of_wage"]
+    wage = _lognormal(rng, median[unit], sigma[unit], n)
+    wage *= region[codes["region_of_employment"]]
+    wage = np.clip(np.round(wage, 2), 2.0, MAX_WAGE)
+
+    median, sigma, negative = EMPLOYEES
+    employees = np.minimum(_lognormal(rng, median, sigma, n), MAX_EMPLOYEES)
+    employees = np.maximum(employees, 1).astype(np.int32)
+    flip = rng.random(n) < negative
+    employees[flip] = -rng.integers(11, 27, flip.sum(), dtype=np.int32)
+    age = np.minimum(_lognormal(rng, *AGE, n), 216)
+    year = (2016 - age).astype(np.int32)
+
+    data = {}
+    if case_ids:
+        data["case_id"] = "EZYV" + pd.RangeIndex(start + 1, stop + 1).astype(str)
+    for column, levels in LEVELS.items():
+        data[column] = pd.Categorical.from_codes(codes[column], list(levels))
+    data["no_of_employees"] = employees
+    data["yr_of_estab"] = year
+    data["prevailing_wage"] = wage.astype(NUMERIC["prevailing_wage"])
+    data["case_status"] = pd.Categorical.from_codes(status, ["Denied", POSITIVE_CLASS])
+    columns = [c for c in RAW_COLUMNS if c in data]
+    return pd.DataFrame(data, columns=columns, index=pd.RangeIndex(start, stop))
+
+
+def generate(n_rows, seed=0, chunk_rows=1000000, case_ids=True):
+    """
+    Yield synthetic applications as dataframes of chunk_rows rows, with
+    the columns and dtypes of load_visa
+
+    The case status is drawn first, then every categorical and Y/N column
+    given the status, so that the share of every level (continent,
+    education, region, unit of wage...) and its certification rate match
+    the EDA summaries in LEVELS. The prevailing wage depends on the unit
+    of wage and the region, the employees and the year of establishment
+    follow log-normal fits of their distributions, and a few employee
+    counts are negative as in the real data. Chunk i is drawn from the
+    generator seeded with (seed, i), so the same seed and chunk_rows give
+    the same rows, and chunks can be drawn independently.
+
+    n_rows: total number of applications
+    seed: seed of the random generators
+    chunk_rows: rows per chunk
+    case_ids: whether to add the case_id column ("EZYV1", "EZYV2"...)
+    """
+    for i, start in enumerate(range(0, n_rows, chunk_rows)):
+        stop = min(start + chunk_rows, n_rows)
+        with stage("synthesize", rows=stop - start):
+            chunk = _chunk(np.random.default_rng([seed, i]), start, stop, case_ids)
+        yield chunk
+
+
+def synthetic_visa(n_rows, seed=0, chunk_rows=1000000, case_ids=True):
+    """
+    All the chunks of generate() in one dataframe, a stand-in for
+    load_visa(path)
+    """
+    import pandas as pd
+
+    chunks = list(generate(n_rows, seed, chunk_rows, case_ids))
+    if len(chunks) == 1:
+        return chunks[0]
+    return pd.concat(chunks)
+
+
+def write_csv(path, n_rows, seed=0, chunk_rows=1000000):
+    """
+    Write synthetic applications to a csv readable by load_visa, one chunk
+    at a time
+
+    path: output csv file
+    n_rows: total number of applications
+    seed: seed of the random generators
+    chunk_rows: rows held in memory at once
+    """
+    for i, chunk in enumerate(generate(n_rows, seed, chunk_rows)):
+        with stage("write_csv", rows=len(chunk)):
+            chunk.to_csv(path, mode="a" if i else "w", header=not i, index=False)
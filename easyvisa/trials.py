@@ -0,0 +1,400 @@
+"""
+SQLite store of cross-validated hyperparameter trials, consulted by the
+grid searches before fitting
+"""
+
+import json
+import sqlite3
+import time
+
+import numpy as np
+
+from .profiling import count, stage
+
+# parameters that change how fast a model is fitted, not what it learns
+RUNTIME_PARAMS = ("n_jobs", "nthread", "verbose", "verbosity")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trials (
+    estimator TEXT NOT NULL,
+    data TEXT NOT NULL,
+    fold TEXT NOT NULL,
+    model TEXT NOT NULL,
+    params TEXT NOT NULL,
+    n_train INTEGER NOT NULL,
+    score REAL,
+    fit_time REAL NOT NULL,
+    score_time REAL NOT NULL,
+    recorded REAL NOT NULL,
+    proba BLOB,
+    PRIMARY KEY (estimator, data, fold)
+);
+"""
+
+
+def _plain(value):
+    """
+    JSON value of a numpy scalar, repr of an estimator
+    """
+    return value.item() if hasattr(value, "item") else repr(value)
+
+
+def params_json(params):
+    """
+    JSON text of a dict of parameters, with numpy scalars as numbers and
+    nested estimators by their repr
+
+    params: dict of parameter name to value
+    """
+    return json.dumps(params, sort_keys=True, default=_plain)
+
+
+def _model_params(estimator):
+    """
+    Parameters of an estimator that determine its fitted model
+    """
+    return {
+        name: value
+        for name, value in estimator.get_params(deep=False).items()
+        if name not in RUNTIME_PARAMS
+    }
+
+
+def _qualname(cls):
+    return cls.__module__ + "." + cls.__qualname__
+
+
+def _estimator_key(estimator):
+    """
+    Hash of an estimator's class and model parameters keying its trials
+    """
+    import joblib
+
+    return joblib.hash((_qualname(type(estimator)), _model_params(estimator)))
+
+
+def data_key(X, y, sample_weight=None):
+    """
+    Fingerprint of a design matrix, dense or CSR, its target and weights
+
+    X: design matrix
+    y: target
+    sample_weight: weights of the rows, if they are weighted
+    """
+    import joblib
+
+    return joblib.hash((X, np.asarray(y), sample_weight))
+
+
+def fold_key(train, test):
+    """
+    Fingerprint of a (train, test) pair of index arrays
+    """
+    import joblib
+
+    return joblib.hash((np.asarray(train), np.asarray(test)))
+
+
+def _fit_and_score(estimator, X, y, train, test, sample_weight):
+    """
+    F1 of an estimator fitted on the train rows, on the test rows, as in
+    GridSearchCV (NaN if the fit fails), the fit and scoring times, and
+    the float32 probabilities of certification of the test rows (None if
+    the fit fails)
+    """
+    from sklearn.base import clone
+
+    from .models import f1_scorer
+
+    model = clone(estimator)
+    fit_params = (
+        {} if sample_weight is None else {"sample_weight": sample_weight[train]}
+    )
+    start = time.perf_counter()
+    try:
+        model.fit(X[train], y[train], **fit_params)
+    except Exception:
+        return float("nan"), time.perf_counter() - start, 0.0, None
+    fit_time = time.perf_counter() - start
+    start = time.perf_counter()
+    score = f1_scorer()(model, X[test], y[test])
+    score_time = time.perf_counter() - start
+    proba = model.predict_proba(X[test])[:, 1].astype(np.float32)
+    return float(score), fit_time, score_time, proba
+
+
+class TrialStore:
+    """
+    Fold scores of every (model class, parameters, data, fold) fitted so
+    far, in one SQLite file
+
+    A trial is keyed on a hash of the estimator's class and the parameters
+    that change its fitted model (n_jobs and verbosity aside), the
+    fingerprint of the data (data_key) and the fold's indices (fold_key).
+    evaluate() only fits the trials the store does not hold, so rerunning
+    a grid search, or one that overlaps an earlier grid, fits nothing or
+    only the new candidates. The scores are the F1 of models.f1_scorer on
+    the held-out rows, so they equal GridSearchCV's, and the held-out
+    probabilities are kept as well for oof_proba(), until grid_search drops
+    those of the candidates that lost.
+    """
+
+    def __init__(self, path):
+        """
+        path: SQLite database file, created if missing
+        """
+        self.path = path
+        self._db = sqlite3.connect(path, timeout=30)
+        self._db.executescript(_SCHEMA)
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(trials)")]
+        if "proba" not in columns:
+            # stores created before the probabilities were kept
+            with self._db:
+                self._db.execute("ALTER TABLE trials ADD COLUMN proba BLOB")
+
+    def close(self):
+        self._db.close()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM trials").fetchone()[0]
+
+    def evaluate(self, estimators, X, y, folds, sample_weight=None, n_jobs=None):
+        """
+        (n_estimators, n_folds) array of the F1 of every estimator on every
+        fold, fitting only the trials not stored yet
+
+        estimators: unfitted estimators, for example one per grid candidate
+        X: design matrix, dense or CSR
+        y: target
+        folds: list of (train, test) index arrays into X
+        sample_weight: weights of the rows of X passed to every fit
+        n_jobs: number of fits run in parallel by joblib
+        """
+        trials = self._trials(estimators, X, y, folds, sample_weight, n_jobs)
+        scores = np.full((len(estimators), len(folds)), np.nan)
+        for i, row in enumerate(trials):
+            for j, (score, _) in enumerate(row):
+                if score is not None:
+                    scores[i, j] = score
+        return scores
+
+    def oof_proba(self, estimator, X, y, folds, sample_weight=None, n_jobs=None):
+        """
+        Out-of-fold probabilities of certification of an estimator, from
+        the held-out probabilities of its trials, fitting only the folds
+        not stored yet (or stored without their probabilities)
+
+        Returns a float64 array over the rows of X, the mean over the folds
+        holding a row out, NaN for rows in no test fold or whose fit failed.
+
+        estimator: unfitted estimator, for example the best grid candidate
+        X: design matrix, dense or CSR
+        y: target
+        folds: list of (train, test) index arrays into X
+        sample_weight: weights of the rows of X passed to every fit
+        n_jobs: number of fits run in parallel by joblib
+        """
+        trials = self._trials([estimator], X, y, folds, sample_weight, n_jobs, True)
+        total = np.zeros(len(y))
+        counts = np.zeros(len(y))
+        for (_, test), (_, proba) in zip(folds, trials[0]):
+            if proba is not None:
+                np.add.at(total, test, np.frombuffer(proba, dtype=np.float32))
+                np.add.at(counts, test, 1)
+        with np.errstate(invalid="ignore"):
+            return total / counts
+
+    def _trials(self, estimators, X, y, folds, sample_weight, n_jobs, proba=False):
+        """
+        (score, probabilities) of every estimator on every fold as nested
+        lists, fitting and storing the trials the store lacks and, with
+        proba, those stored without their probabilities
+        """
+        from joblib import Parallel, delayed
+
+        y = np.asarray(y)
+        data = data_key(X, y, sample_weight)
+        fold_keys = [fold_key(train, test) for train, test in folds]
+        trials = [[None] * len(folds) for _ in estimators]
+        tasks = []
+        rows = []
+        for i, estimator in enumerate(estimators):
+            params = _model_params(estimator)
+            key = _estimator_key(estimator)
+            stored = {
+                fold: (score, blob)
+                for fold, score, blob in self._db.execute(
+                    "SELECT fold, score, proba FROM trials "
+                    "WHERE estimator = ? AND data = ?",
+                    (key, data),
+                )
+            }
+            for j, (train, test) in enumerate(folds):
+                trial = stored.get(fold_keys[j])
+                # trials stored before the probabilities were kept have a
+                # score only; a failed fit has neither
+                refit = proba and trial is not None and trial[0] is not None
+                if trial is not None and not (refit and trial[1] is None):
+                    trials[i][j] = trial
+                    continue
+                tasks.append(
+                    delayed(_fit_and_score)(estimator, X, y, train, test, sample_weight)
+                )
+                rows.append(
+                    (i, j, key, params_json(params), _qualname(type(estimator)))
+                )
+        count("trials_reused", len(estimators) * len(folds) - len(tasks))
+        count("trials_fitted", len(tasks))
+        if not tasks:
+            return trials
+        with stage("trials", rows=sum(len(folds[j][0]) for _, j, *_ in rows)):
+            results = Parallel(n_jobs=n_jobs)(tasks)
+        recorded = time.time()
+        with self._db:
+            for (i, j, key, params, model), result in zip(rows, results):
+                score, fit_time, score_time, fold_proba = result
+                score = None if np.isnan(score) else score
+                blob = None if fold_proba is None else fold_proba.tobytes()
+                trials[i][j] = (score, blob)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO trials VALUES "
+                    "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        key,
+                        data,
+                        fold_keys[j],
+                        model,
+                        params,
+                        len(folds[j][0]),
+                        score,
+                        fit_time,
+                        score_time,
+                        recorded,
+                        blob,
+                    ),
+                )
+        return trials
+
+    def drop_proba(self, estimators, X, y, sample_weight=None):
+        """
+        Forget the held-out probabilities of the trials of some estimators
+        on some data, keeping their scores; oof_proba() refits them if
+        they are asked for again
+
+        estimators: estimators whose probabilities are dropped, for
+            example the grid candidates that lost a search
+        X: design matrix, dense or CSR
+        y: target
+        sample_weight: weights of the rows of X the trials were fitted with
+        """
+        data = data_key(X, np.asarray(y), sample_weight)
+        with self._db:
+            self._db.executemany(
+                "UPDATE trials SET proba = NULL WHERE estimator = ? AND data = ?",
+                [(_estimator_key(estimator), data) for estimator in estimators],
+            )
+
+    def results(self, model=None, data=None):
+        """
+        One row per (model class, parameters, data) tried: the parameters
+        in columns, the training rows per fold (n_train), the number of
+        folds, and the mean and standard deviation of the score and the
+        mean fit time over the folds
+
+        model: estimator class or its qualified name (module.Class) to
+            restrict the results to
+        data: data_key to restrict the results to
+        """
+        import pandas as pd
+
+        query = (
+            "SELECT model, params, data, n_train, COUNT(*) AS folds, "
+            "AVG(score) AS score, AVG(score * score) AS square, "
+            "AVG(fit_time) AS fit_time FROM trials"
+        )
+        where, args = [], []
+        if model is not None:
+            where.append("model = ?")
+            args.append(model if isinstance(model, str) else _qualname(model))
+        if data is not None:
+            where.append("data = ?")
+            args.append(data)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " GROUP BY estimator, data, n_train ORDER BY MIN(recorded)"
+        frame = pd.read_sql_query(query, self._db, params=args)
+        frame["score_std"] = np.sqrt(
+            np.maximum(frame.pop("square") - frame["score"] ** 2, 0)
+        )
+        params = pd.DataFrame(
+            [json.loads(text) for text in frame.pop("params")], index=frame.index
+        )
+        return pd.concat([frame, params], axis=1)
+
+    def learning_curve(self, model, x, data=None):
+        """
+        Best mean score and its fit time for every value of a parameter or
+        of the number of training rows, over all the other parameters
+
+        model: estimator class or its qualified name (module.Class)
+        x: name of a parameter, or "n_train" for the score against the
+            training rows (of the sampled searches, say)
+        data: data_key to restrict the curve to, all the data by default
+        """
+        results = self.results(model, data)
+        if results.empty:
+            return results
+        best = results.sort_values("score", ascending=False, kind="stable")
+        best = best.drop_duplicates(x).sort_values(x)
+        return best.set_index(x)[["score", "score_std", "fit_time", "folds"]]
+
+
+def grid_search(
+    name, X, y, store, cv=5, sample_weight=None, n_jobs=None, callback=None
+):
+    """
+    Best parameters of the notebook's grid for a model, as GridSearchCV
+    would pick them, with the fold scores taken from a TrialStore where it
+    holds them
+
+    Returns the best parameters and the (n_candidates, n_folds) scores.
+    The held-out probabilities of the other candidates are dropped from
+    the store once the best one is known, since only the best candidate's
+    out-of-fold predictions are read (see TrialStore.oof_proba).
+
+    name: key of models.MODELS
+    X: design matrix
+    y: target
+    store: TrialStore
+    cv: number of stratified folds or iterable of (train, test) index arrays
+    sample_weight: weights of the rows passed to every fit
+    n_jobs: number of fits run in parallel
+    callback: called as callback(candidate, params, fold_scores, seconds)
+        after every candidate, which are then evaluated one at a time;
+        an exception it raises stops the search
+    """
+    from sklearn.base import clone
+    from sklearn.model_selection import ParameterGrid, check_cv
+
+    from .models import MODELS
+
+    spec = MODELS[name]
+    grid = list(ParameterGrid(spec.grid()))
+    folds = list(check_cv(cv, y, classifier=True).split(X, y))
+    estimator = spec.build()
+    estimators = [clone(estimator).set_params(**params) for params in grid]
+    with stage("tune", rows=len(y)):
+        if callback is None:
+            scores = store.evaluate(estimators, X, y, folds, sample_weight, n_jobs)
+        else:
+            scores = np.empty((len(grid), len(folds)))
+            for i, estimator in enumerate(estimators):
+                start = time.perf_counter()
+                scores[i] = store.evaluate(
+                    [estimator], X, y, folds, sample_weight, n_jobs
+                )[0]
+                callback(i, grid[i], scores[i], time.perf_counter() - start)
+    mean = scores.mean(axis=1)
+    best = int(np.argmax(np.where(np.isnan(mean), -np.inf, mean)))
+    store.drop_proba(estimators[:best] + estimators[best + 1 :], X, y, sample_weight)
+    return grid[best], scores
@@ -0,0 +1,29 @@
+import numpy as np
+
+from easyvisa.data import clean
+from easyvisa.encoding import TargetEncoder
+from easyvisa.features import MISSING_CODE, FeatureStore
+from easyvisa.schema import FEATURES
+from easyvisa.synthetic import synthetic_visa
+
+
+def test_unseen_levels_get_the_prior():
+    train = clean(synthetic_visa(200, case_ids=False))
+    encoder = TargetEncoder(extras=["employer"])
+    train["employer"] = np.arange(len(train)) % 7
+    encoder.fit(train, FeatureStore.from_frame(train))
+
+    new = clean(synthetic_visa(3, seed=1, case_ids=False))
+    new["continent"] = new["continent"].astype(str)
+    new.loc[new.index[0], "continent"] = "Atlantis"
+    new["employer"] = [0, 99, 1]
+    store = FeatureStore.from_frame(new)
+    assert store.column("continent")[0] == MISSING_CODE
+
+    matrix = encoder.transform(new, store)
+    continent = FEATURES.index("continent")
+    employer = encoder.feature_names.index("employer")
+    assert matrix[0, continent] == encoder.tables["continent"][-1]
+    assert matrix[1, employer] == encoder.tables["employer"][-1]
+    assert np.isclose(matrix[0, continent], encoder.prior)
+    assert np.isclose(matrix[1, employer], encoder.prior)